@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
-    Client, Wallet, Transaction, Vehicle, Driver, Trip, Booking, Rating,
-    Chat, Message, SupportTicket, FCMToken, Notification, Transfer,
+    Client, Wallet, Transaction, WalletSnapshot, Vehicle, Driver, Trip, Booking, Rating,
+    AttachmentBlob, Chat, ChatReadCursor, Message, SupportTicket, FCMToken, Notification, Transfer,
     SubscriptionPlan, Subscription, Bonus, TripStop, ItemDelivery,
     CasheBooking, CasheItemDelivery
 )
@@ -25,6 +25,12 @@ class TransactionAdmin(admin.ModelAdmin):
     list_filter = ('transaction_type', 'status')
     readonly_fields = ('reference_number',)
 
+@admin.register(WalletSnapshot)
+class WalletSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('wallet', 'balance', 'last_transaction_id', 'created_at')
+    search_fields = ('wallet__user__username',)
+    readonly_fields = ('wallet', 'balance', 'last_transaction_id')
+
 @admin.register(Vehicle)
 class VehicleAdmin(admin.ModelAdmin):
     list_display = ('model', 'plate_number', 'color', 'capacity', 'vehicle_type', 'manufacture_year', 'status')
@@ -62,6 +68,16 @@ class ChatAdmin(admin.ModelAdmin):
     search_fields = ('participants__username',)
     list_filter = ()
 
+@admin.register(ChatReadCursor)
+class ChatReadCursorAdmin(admin.ModelAdmin):
+    list_display = ('chat', 'user', 'last_read_message_id', 'unread_count')
+    search_fields = ('user__username',)
+
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'content_type', 'size', 'created_at')
+    search_fields = ('sha256',)
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ('chat', 'sender', 'content', 'is_read', 'created_at')
@@ -76,7 +92,7 @@ class SupportTicketAdmin(admin.ModelAdmin):
 
 @admin.register(FCMToken)
 class FCMTokenAdmin(admin.ModelAdmin):
-    list_display = ('user', 'token', 'created_at')
+    list_display = ('user', 'token', 'created_at', 'last_seen')
     search_fields = ('user__username', 'token')
     list_filter = ('created_at',)
 
@@ -1,6 +1,8 @@
 # apis/apps.py
 import logging
+import sys
 from django.apps import AppConfig
+from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
@@ -10,6 +12,7 @@ class ApisConfig(AppConfig):
 
     def ready(self):
         self._load_signals()
+        self._check_channel_layer()
 
     def _load_signals(self):
         try:
@@ -18,3 +21,11 @@ class ApisConfig(AppConfig):
         except Exception as e:
             logger.error("❌ Failed to load notification signals", exc_info=True)
 
+    def _check_channel_layer(self):
+        # طبقة الذاكرة لا تصل إلا لعملاء نفس العملية: البث من Celery أو المجدول لا يبلغ daphne
+        backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+        if backend.endswith('InMemoryChannelLayer') and 'test' not in sys.argv[1:2]:
+            logger.warning(
+                "⚠️ CHANNEL_REDIS_URL is not set: using InMemoryChannelLayer, so updates sent from "
+                "Celery workers or the scheduler will not reach WebSocket clients"
+            )
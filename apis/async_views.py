@@ -0,0 +1,149 @@
+# File: apis/async_views.py
+"""
+نسخ غير متزامنة من واجهات الإشعارات والمحادثات وتوكنات FCM.
+
+تعمل عبر backend/asgi.py بالـ ORM غير المتزامن، فانتظار قاعدة البيانات أو مزود الإشعارات
+لا يحجز خيطاً، ويستطيع عامل واحد خدمة عدد كبير من العملاء البطيئين في الوقت نفسه.
+المصادقة بنفس توكن JWT المستخدم في واجهات DRF.
+"""
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.translation import gettext as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import attachments
+from .chats import chats_for_user
+from .fcm_tokens import register_tokens
+from .models import Chat, Message, Notification
+from .onesignal import asend_notification
+from .serializers import ChatSerializer, MessageSerializer, NotificationSerializer
+
+NOTIFICATIONS_PAGE_SIZE = 50
+
+
+def _json(data, status=200, safe=True):
+    # مثل JSONRenderer في DRF: النص العربي يُرسل كما هو
+    return JsonResponse(data, status=status, safe=safe, json_dumps_params={'ensure_ascii': False})
+
+
+def async_api(methods, admin_only=False):
+    """
+    يحوّل دالة async إلى واجهة JSON: يتحقق من الطريقة وتوكن JWT ويقرأ جسم JSON إلى request.json.
+    """
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return _json({'detail': _('الطريقة غير مسموحة')}, status=405)
+            try:
+                result = await sync_to_async(JWTAuthentication().authenticate)(request)
+            except AuthenticationFailed as e:
+                return _json({'detail': str(e.detail)}, status=401)
+            if result is None:
+                return _json({'detail': _('بيانات الدخول غير موجودة')}, status=401)
+            request.user = result[0]
+            if admin_only and not request.user.is_staff:
+                return _json({'detail': _('غير مصرح')}, status=403)
+
+            request.json = {}
+            if request.content_type == 'application/json' and request.body:
+                try:
+                    request.json = json.loads(request.body)
+                except ValueError:
+                    return _json({'detail': _('JSON غير صالح')}, status=400)
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _serialize(serializer_class, instance, **kwargs):
+    # قد يقرأ المُسلسِل علاقات غير محمّلة، فيعمل في خيط
+    return sync_to_async(lambda: serializer_class(instance, **kwargs).data)()
+
+
+@async_api(['POST'])
+async def save_fcm_token(request):
+    token = request.json.get('fcm_token')
+    if not token:
+        return _json({'error': _('FCM token is required.')}, status=400)
+
+    created, _updated, _unchanged = await sync_to_async(register_tokens)(
+        request.user, [token], request.json.get('device_info', {})
+    )
+    message = _('FCM token saved successfully.') if created else _('FCM token updated successfully.')
+    return _json({'message': message, 'created': bool(created)}, status=201 if created else 200)
+
+
+@async_api(['GET'])
+async def chat_list(request):
+    chats = [chat async for chat in chats_for_user(request.user)]
+    return _json(await _serialize(ChatSerializer, chats, many=True), safe=False)
+
+
+@async_api(['POST'])
+async def send_message(request, chat_id):
+    if not await Chat.objects.filter(id=chat_id, participants=request.user).aexists():
+        return _json({'detail': _('غير مصرح')}, status=403)
+
+    data = request.json or request.POST
+    content = (data.get('content') or '').strip()
+    attachment = request.FILES.get('attachment')
+    blob = None
+    if data.get('upload_id'):
+        try:
+            blob = await sync_to_async(attachments.completed_blob)(request.user, data['upload_id'])
+        except ValueError as e:
+            return _json({'detail': str(e)}, status=400)
+
+    if not content and not attachment and not blob:
+        return _json({'detail': _('أدخل محتوى أو مرفق')}, status=400)
+
+    message = await Message.objects.acreate(
+        chat_id=chat_id,
+        sender=request.user,
+        content=content or None,
+        attachment=attachment,
+        blob=blob,
+    )
+    return _json(await _serialize(MessageSerializer, message), status=201)
+
+
+@async_api(['GET'])
+async def notification_list(request):
+    """آخر إشعارات المستخدم؛ ?unread=1 لغير المقروءة فقط و ?before_id= للصفحة التالية."""
+    notifications = Notification.objects.filter(user=request.user).order_by('-id')
+    if request.GET.get('unread') in ('1', 'true'):
+        notifications = notifications.filter(is_read=False)
+    if request.GET.get('before_id', '').isdigit():
+        notifications = notifications.filter(id__lt=int(request.GET['before_id']))
+    page = [n async for n in notifications[:NOTIFICATIONS_PAGE_SIZE]]
+    return _json(await _serialize(NotificationSerializer, page, many=True), safe=False)
+
+
+@async_api(['POST'])
+async def notification_mark_read(request):
+    """{"ids": [...]} لتعليم إشعارات محددة كمقروءة، أو بدونها لتعليم الكل."""
+    notifications = Notification.objects.filter(user=request.user, is_read=False)
+    ids = request.json.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return _json({'detail': _('ids يجب أن تكون قائمة أرقام')}, status=400)
+        notifications = notifications.filter(id__in=ids)
+    updated = await notifications.aupdate(is_read=True)
+    return _json({'updated': updated})
+
+
+@async_api(['POST'], admin_only=True)
+async def notification_broadcast(request):
+    """إرسال إشعار عام عبر OneSignal؛ الانتظار لا يحجز خيطاً مهما أبطأ المزود."""
+    title, message = request.json.get('title'), request.json.get('message')
+    if not title or not message:
+        return _json({'detail': _('العنوان والمحتوى مطلوبان')}, status=400)
+    result = await asend_notification(title, message, request.json.get('segments') or ["All"])
+    return _json(result, status=502 if 'error' in result else 200)
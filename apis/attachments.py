@@ -0,0 +1,223 @@
+# File: apis/attachments.py
+"""
+خط رفع مرفقات المحادثات.
+
+الرفع مجزأ وقابل للاستئناف: يبدأ العميل رفعاً بالحجم الكلي، ثم يرسل الأجزاء بترويسة Upload-Offset
+فتُكتب من جسم الطلب إلى ملف مؤقت على القرص على دفعات صغيرة دون تحميل الملف كاملاً في الذاكرة.
+عند الاكتمال يُحسب SHA-256 ويُربط الملف بمساره حسب البصمة، فلا يُخزَّن نفس المحتوى مرتين،
+وتُولَّد الصورة المصغرة كأثر جانبي في عامل خلفي.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from .models import AttachmentBlob, AttachmentUpload
+from .side_effects import dispatch, side_effect
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'pdf', 'mp3', 'mp4')
+STREAM_CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (320, 320)
+
+
+class OffsetMismatch(ValueError):
+    """الجزء المرسل لا يبدأ من آخر بايت مستلم؛ offset هو الموضع الصحيح للاستئناف."""
+
+    def __init__(self, offset):
+        super().__init__(_("موضع الجزء غير صحيح."))
+        self.offset = offset
+
+
+def temp_path(upload_id):
+    return os.path.join(settings.ATTACHMENT_UPLOAD_DIR, f"{upload_id}.part")
+
+
+def blob_name(sha256, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return f"attachments/{sha256[:2]}/{sha256}{ext}"
+
+
+def start_upload(user, filename, total_size):
+    """ينشئ رفعاً جديداً وملفه المؤقت الفارغ بعد التحقق من الامتداد والحجم."""
+    filename = os.path.basename(filename or '')
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    if ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(_("نوع الملف غير مسموح."))
+    if total_size <= 0 or total_size > settings.ATTACHMENT_MAX_SIZE:
+        raise ValueError(_("حجم الملف غير مسموح."))
+
+    upload = AttachmentUpload.objects.create(
+        user=user,
+        filename=filename,
+        content_type=mimetypes.guess_type(filename)[0] or '',
+        total_size=total_size,
+    )
+    os.makedirs(settings.ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+    open(temp_path(upload.pk), 'wb').close()
+    return upload
+
+
+def append_chunk(upload_id, user, offset, stream):
+    """
+    يكتب الجزء القادم من stream عند offset. يُقفل صف الرفع طوال الكتابة حتى لا يتداخل جزآن،
+    ويقصّ الملف عند آخر بايت مكتوب حتى لا تبقى بقايا محاولة سابقة فاشلة.
+    """
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().get(pk=upload_id, user=user)
+        if upload.status != AttachmentUpload.Status.UPLOADING:
+            raise ValueError(_("اكتمل هذا الرفع بالفعل."))
+        if offset != upload.received_bytes:
+            raise OffsetMismatch(upload.received_bytes)
+
+        written = 0
+        with open(temp_path(upload.pk), 'r+b') as fh:
+            fh.seek(offset)
+            while True:
+                chunk = stream.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if offset + written + len(chunk) > upload.total_size:
+                    raise ValueError(_("الجزء يتجاوز الحجم المعلن للملف."))
+                fh.write(chunk)
+                written += len(chunk)
+            fh.truncate()
+
+        upload.received_bytes = offset + written
+        upload.save(update_fields=['received_bytes', 'updated_at'])
+    return upload
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _place_blob(path, name):
+    """
+    يربط الملف المؤقت بمساره النهائي (رابط صلب على نفس القرص دون نسخ) ويترك الملف المؤقت في مكانه،
+    فإن تراجعت المعاملة بقي الرفع قابلاً لإعادة الإكمال. المسار مشتق من البصمة، فالملف الموجود فيه
+    يحمل نفس المحتوى ولا يُستبدل.
+    """
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(path, target)
+    except FileExistsError:
+        pass
+
+
+def _remove_temp(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def complete_upload(upload_id, user):
+    """
+    يُنهي الرفع: يحسب البصمة دون قفل صف الرفع، ويربطه بمحتوى موجود بنفس البصمة أو يضع الملف في مساره
+    النهائي، ثم يطلب توليد الصورة المصغرة للمحتوى الجديد. الملف المؤقت لا يُحذف إلا بعد نجاح المعاملة.
+    """
+    upload = AttachmentUpload.objects.get(pk=upload_id, user=user)
+    if upload.status == AttachmentUpload.Status.COMPLETE:
+        return upload
+    if upload.received_bytes != upload.total_size:
+        raise ValueError(_("لم يكتمل رفع الملف بعد."))
+
+    path = temp_path(upload.pk)
+    try:
+        sha256 = _file_sha256(path)
+    except FileNotFoundError:
+        # أكمله طلب متزامن وحذف ملفه المؤقت بعد نجاح معاملته
+        upload.refresh_from_db()
+        if upload.status == AttachmentUpload.Status.COMPLETE:
+            return upload
+        raise
+    blob = AttachmentBlob.objects.filter(sha256=sha256).first()
+    if not blob:
+        _place_blob(path, blob_name(sha256, upload.filename))
+
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().get(pk=upload_id, user=user)
+        if upload.status == AttachmentUpload.Status.COMPLETE:
+            return upload
+        if not blob:
+            blob, created = AttachmentBlob.objects.get_or_create(
+                sha256=sha256,
+                defaults={
+                    'file': blob_name(sha256, upload.filename),
+                    'size': upload.total_size,
+                    'content_type': upload.content_type,
+                },
+            )
+            if created and blob.content_type.startswith('image/'):
+                dispatch('generate_attachment_thumbnail', blob.pk)
+
+        upload.blob = blob
+        upload.status = AttachmentUpload.Status.COMPLETE
+        upload.save(update_fields=['blob', 'status', 'updated_at'])
+        transaction.on_commit(lambda: _remove_temp(path))
+    return upload
+
+
+def completed_blob(user, upload_id):
+    """يُرجع محتوى رفع مكتمل يملكه المستخدم لإرفاقه برسالة، أو يرفع ValueError."""
+    try:
+        upload_id = uuid.UUID(str(upload_id))
+    except ValueError:
+        raise ValueError(_("معرّف المرفق غير صالح."))
+    upload = AttachmentUpload.objects.filter(
+        pk=upload_id, user=user, status=AttachmentUpload.Status.COMPLETE
+    ).select_related('blob').first()
+    if not upload:
+        raise ValueError(_("المرفق غير موجود أو لم يكتمل رفعه."))
+    return upload.blob
+
+
+@side_effect
+def generate_attachment_thumbnail(blob_id):
+    from PIL import Image, ImageOps
+
+    blob = AttachmentBlob.objects.filter(pk=blob_id, thumbnail='').first()
+    if not blob:
+        return
+    name = f"attachments/thumbs/{blob.sha256}.jpg"
+    target = default_storage.path(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(blob.file.path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(THUMBNAIL_SIZE)
+        image.convert('RGB').save(target, 'JPEG', quality=80)
+    AttachmentBlob.objects.filter(pk=blob_id).update(thumbnail=name)
+    logger.info(f"🖼️ تم توليد صورة مصغرة للمرفق {blob.sha256[:12]}")
+
+
+def purge_stale_uploads(max_age=timedelta(days=1)):
+    """يحذف عمليات الرفع غير المكتملة التي لم تتقدم منذ max_age مع ملفاتها المؤقتة."""
+    stale = AttachmentUpload.objects.filter(
+        status=AttachmentUpload.Status.UPLOADING,
+        updated_at__lt=timezone.now() - max_age,
+    )
+    ids = list(stale.values_list('pk', flat=True))
+    for upload_id in ids:
+        try:
+            os.remove(temp_path(upload_id))
+        except FileNotFoundError:
+            pass
+    AttachmentUpload.objects.filter(pk__in=ids).delete()
+    if ids:
+        logger.info(f"🧹 تم حذف {len(ids)} رفع مرفق غير مكتمل")
+    return len(ids)
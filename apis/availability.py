@@ -0,0 +1,71 @@
+# File: apis/availability.py
+"""
+دورة إتاحة السائقين للجدولة.
+
+السائق غير متاح ما دامت له رحلة مفتوحة (قيد الانتظار أو التنفيذ أو مكتملة المقاعد)، ويعود
+متاحاً عند انتهاء آخر رحلة مفتوحة له أو إلغائها. ويُعدّ السائق غير متصل إذا كان آخر موقع أرسله
+أقدم من DRIVER_HEARTBEAT_TIMEOUT ثانية (القيمة 0 تعطّل هذا الشرط)، فلا يُسند إليه شيء حتى يعود.
+السائق الذي لم يرسل أي موقع (تطبيق لا يدعم إرسال المواقع) لا توجد له نبضات يُحكم بها، فيبقى متصلاً.
+
+الانتقالات عبر save() تُطبَّق فوراً من الإشارات، والتحديثات الجماعية (update) التي لا تمر
+بالإشارات تصححها مطابقة دورية بتحديثين جماعيين.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .locations import flush_driver_locations
+from .models import Driver, Trip
+from .side_effects import side_effect
+
+logger = logging.getLogger(__name__)
+
+OPEN_TRIP_STATUSES = (Trip.Status.PENDING, Trip.Status.IN_PROGRESS, Trip.Status.FULL)
+CLOSED_TRIP_STATUSES = (Trip.Status.COMPLETED, Trip.Status.CANCELLED)
+
+
+def _has_open_trip():
+    return Exists(Trip.objects.filter(driver=OuterRef('pk'), status__in=OPEN_TRIP_STATUSES))
+
+
+def _online(now=None):
+    timeout = settings.DRIVER_HEARTBEAT_TIMEOUT
+    if not timeout:
+        return Q()
+    cutoff = (now or timezone.now()) - timedelta(seconds=timeout)
+    return Q(location_updated_at__isnull=True) | Q(location_updated_at__gte=cutoff)
+
+
+def available_drivers():
+    """السائقون الذين يمكن إسناد رحلة جديدة إليهم الآن."""
+    return Driver.objects.filter(_online(), is_available=True)
+
+
+@side_effect
+def release_driver(driver_id):
+    """بعد انتهاء رحلة أو إلغائها: يعود السائق متاحاً إذا لم تبقَ له رحلة مفتوحة وما زال متصلاً."""
+    Driver.objects.filter(_online(), pk=driver_id, is_available=False).exclude(_has_open_trip()).update(
+        is_available=True
+    )
+
+
+def reconcile_availability(now=None):
+    """يُرجع (عدد السائقين الذين عادوا متاحين، عدد من أصبحوا غير متاحين)."""
+    now = now or timezone.now()
+    # آخر المواقع في المخزن هي نبضات السائقين، فتُرحَّل قبل الحكم على انقطاعهم. هذا يتطلب مخزن Redis:
+    # مخزن الذاكرة في عامل Celery فارغ، وتتأخر النبضات فيه حتى يرحّلها عامل الويب (انظر apis/locations.py)
+    flush_driver_locations()
+    online = _online(now)
+    released = Driver.objects.filter(online, is_available=False).exclude(_has_open_trip()).update(
+        is_available=True
+    )
+    unavailable = Q(_has_open_trip())
+    if settings.DRIVER_HEARTBEAT_TIMEOUT:
+        unavailable |= ~online
+    withdrawn = Driver.objects.filter(unavailable, is_available=True).update(is_available=False)
+    if released or withdrawn:
+        logger.info(f"🚗 إتاحة السائقين: {released} عاد متاحاً، {withdrawn} أصبح غير متاح")
+    return released, withdrawn
@@ -0,0 +1,88 @@
+# File: apis/chats.py
+"""
+مؤشرات القراءة وآخر رسالة للمحادثات.
+
+عند الإرسال تُضبط آخر رسالة مباشرة من الرسالة الجديدة، ويُزاد عدّاد غير المقروءة لبقية المشاركين
+باستعلام UPDATE واحد؛ وعند القراءة يتقدم مؤشر القارئ ويُصفَّر عدّاده.
+بذلك تبقى كلفة الإرسال وعرض قائمة المحادثات ثابتة مهما طال سجل الرسائل.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Chat, ChatReadCursor, Message
+
+
+def chats_for_user(user):
+    """محادثات المستخدم مع عدد غير المقروءة من مؤشره، وآخر رسالة والمشاركين دون استعلام لكل محادثة."""
+    unread = ChatReadCursor.objects.filter(chat=OuterRef('pk'), user=user).values('unread_count')[:1]
+    return (
+        Chat.objects.filter(participants=user)
+        .annotate(unread_count=Coalesce(Subquery(unread), 0))
+        .select_related('last_message__sender', 'last_message__blob')
+        .prefetch_related('participants')
+        .order_by('-updated_at')
+    )
+
+
+def ensure_cursors(pairs):
+    """ينشئ مؤشرات القراءة الناقصة لأزواج (chat_id, user_id) دون المساس بالموجودة."""
+    ChatReadCursor.objects.bulk_create(
+        [ChatReadCursor(chat_id=chat_id, user_id=user_id) for chat_id, user_id in pairs],
+        ignore_conflicts=True,
+    )
+
+
+def get_or_create_direct_chat(user_id, other_user_id):
+    """
+    يجلب المحادثة الثنائية بين المستخدمين أو ينشئها، بفحص واحد لفهرس direct_key.
+    القيد الفريد يجعل الإنشاء المتزامن آمناً: الطلب الخاسر يجلب المحادثة التي أنشأها الآخر.
+    """
+    with transaction.atomic():
+        chat, created = Chat.objects.get_or_create(direct_key=Chat.direct_key_for(user_id, other_user_id))
+        if created:
+            chat.participants.add(user_id, other_user_id)
+    return chat, created
+
+
+def record_message(message):
+    """يضبط آخر رسالة للمحادثة ويزيد عدّاد غير المقروءة لكل المشاركين عدا المرسل."""
+    Chat.objects.filter(pk=message.chat_id).update(
+        last_message_id=message.pk,
+        updated_at=message.created_at,
+    )
+    ChatReadCursor.objects.filter(chat_id=message.chat_id).exclude(user_id=message.sender_id).update(
+        unread_count=F('unread_count') + 1,
+    )
+    # المرسل قرأ المحادثة حتى رسالته
+    ChatReadCursor.objects.filter(
+        chat_id=message.chat_id,
+        user_id=message.sender_id,
+        last_read_message_id__lt=message.pk,
+    ).update(last_read_message_id=message.pk, unread_count=0)
+
+
+def mark_read(chat_id, user_id, up_to_id=None):
+    """
+    يقدّم مؤشر القارئ إلى up_to_id (أو آخر رسالة في المحادثة) ويعيد حساب ما تبقى غير مقروء بعده.
+    لا يكتب شيئاً إذا كان المؤشر متقدماً أصلاً.
+    """
+    if up_to_id is None:
+        up_to_id = Chat.objects.filter(pk=chat_id).values_list('last_message_id', flat=True).first()
+    if not up_to_id:
+        return 0
+    # الرسائل بعد المؤشر فقط، ويغطيها فهرس (chat, id)
+    remaining = (
+        Message.objects.filter(chat_id=chat_id, id__gt=up_to_id)
+        .exclude(sender_id=user_id)
+        .order_by()
+        .values('chat_id')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return ChatReadCursor.objects.filter(
+        chat_id=chat_id, user_id=user_id, last_read_message_id__lt=up_to_id,
+    ).update(
+        last_read_message_id=up_to_id,
+        unread_count=Coalesce(Subquery(remaining), 0),
+    )
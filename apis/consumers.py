@@ -0,0 +1,90 @@
+# File: apis/consumers.py
+"""
+مستهلك WebSocket للتحديثات الحية ووسيط المصادقة بتوكن JWT.
+
+يتصل العميل بـ ws/updates/?token=<access token> فينضم تلقائياً إلى مجموعته،
+ثم يرسل {"action": "subscribe_trip", "trip": <id>} لمتابعة رحلة معينة.
+"""
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.middleware import BaseMiddleware
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import Trip
+from .realtime import trip_group, user_group
+
+User = get_user_model()
+
+
+@database_sync_to_async
+def _user_from_token(raw_token):
+    try:
+        user_id = AccessToken(raw_token)['user_id']
+    except (TokenError, KeyError):
+        return AnonymousUser()
+    return User.objects.filter(pk=user_id, is_active=True).first() or AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """يضبط scope['user'] من توكن الوصول في ?token= إذا لم تحدده الجلسة."""
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+        if token and not getattr(scope.get('user'), 'is_authenticated', False):
+            scope = dict(scope, user=await _user_from_token(token[0]))
+        return await super().__call__(scope, receive, send)
+
+
+@database_sync_to_async
+def _can_view_trip(user, trip_id):
+    # نفس قواعد TripViewSet: السائق يرى رحلاته، والعميل يرى الرحلات التي حجز فيها أو أرسل عبرها
+    trips = Trip.objects.filter(pk=trip_id)
+    if hasattr(user, 'driver'):
+        trips = trips.filter(driver=user.driver)
+    elif hasattr(user, 'client'):
+        trips = trips.filter(Q(bookings__customer=user.client) | Q(deliveries__sender=user))
+    return trips.exists()
+
+
+class UpdatesConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        user = self.scope.get('user')
+        if not getattr(user, 'is_authenticated', False):
+            await self.close(code=4401)
+            return
+        self.groups_joined = {user_group(user.pk)}
+        await self.channel_layer.group_add(user_group(user.pk), self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        for group in getattr(self, 'groups_joined', ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        action, trip_id = content.get('action'), content.get('trip')
+        if action not in ('subscribe_trip', 'unsubscribe_trip') or not isinstance(trip_id, int):
+            await self.send_json({'type': 'error', 'detail': 'طلب غير معروف'})
+            return
+
+        group = trip_group(trip_id)
+        if action == 'unsubscribe_trip':
+            self.groups_joined.discard(group)
+            await self.channel_layer.group_discard(group, self.channel_name)
+            await self.send_json({'type': 'unsubscribed', 'trip': trip_id})
+            return
+
+        if not await _can_view_trip(self.scope['user'], trip_id):
+            await self.send_json({'type': 'error', 'detail': 'غير مصرح', 'trip': trip_id})
+            return
+        self.groups_joined.add(group)
+        await self.channel_layer.group_add(group, self.channel_name)
+        await self.send_json({'type': 'subscribed', 'trip': trip_id})
+
+    async def realtime_event(self, event):
+        await self.send_json({'type': event['event'], 'data': event['data']})
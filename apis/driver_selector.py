@@ -1,5 +1,6 @@
 # File: apis/driver_selector.py
 from math import radians, sin, cos, sqrt, asin
+from .locations import get_positions
 from .models import Driver
 
 def haversine_distance(lat1, lon1, lat2, lon2):
@@ -11,23 +12,29 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return 6371 * c
 
 def select_best_driver(requests, drivers):
+    # نقاط الطلبات تُحلّل مرة واحدة، ومواقع السائقين من مخزن المواقع بدلاً من where_location
+    try:
+        points = []
+        for req in requests:
+            points.append(tuple(map(float, req.from_location.split(','))))
+            points.append(tuple(map(float, req.to_location.split(','))))
+    except ValueError:
+        return None
+    return nearest_driver(points, drivers)
+
+def nearest_driver(points, drivers):
+    """السائق الأقل متوسط مسافة إلى النقاط points [(lat, lon)]، أو None."""
+    if not points:
+        return None
+
+    drivers = list(drivers)
+    positions = get_positions(driver.pk for driver in drivers)
     scored = []
     for driver in drivers:
-        try:
-            d_lat, d_lon = map(float, driver.where_location.split(','))
-            total_dist = 0.0
-            count = 0
-            for req in requests:
-                p_lat, p_lon = map(float, req.from_location.split(','))
-                d2_lat, d2_lon = map(float, req.to_location.split(','))
-                total_dist += haversine_distance(d_lat, d_lon, p_lat, p_lon)
-                total_dist += haversine_distance(d_lat, d_lon, d2_lat, d2_lon)
-                count += 2
-            avg_dist = total_dist / count if count > 0 else float('inf')
-        except Exception:
-            avg_dist = float('inf')
+        if driver.pk not in positions:
+            continue
+        d_lat, d_lon = positions[driver.pk]
+        avg_dist = sum(haversine_distance(d_lat, d_lon, lat, lon) for lat, lon in points) / len(points)
         scored.append((avg_dist, driver))
     scored.sort(key=lambda x: x[0])
-    return scored[0][1] if scored and scored[0][0] != float('inf') else None
-
-
+    return scored[0][1] if scored else None
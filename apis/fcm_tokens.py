@@ -0,0 +1,64 @@
+# File: apis/fcm_tokens.py
+"""
+تسجيل توكنات FCM دفعة واحدة وبشكل متكرر الأمان (idempotent).
+
+التطبيق يعيد تسجيل توكناته مع كل تشغيل، لذا:
+- قراءة واحدة للتوكنات الموجودة، ولا كتابة إطلاقاً إذا لم يتغير المالك أو بيانات الجهاز
+  وكان last_seen أحدث من FCM_TOKEN_TOUCH_INTERVAL.
+- وإلا INSERT ... ON CONFLICT (token) DO UPDATE واحد لكل الدفعة عبر bulk_create،
+  فلا يوجد سباق على القيد الفريد كما في update_or_create.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import FCMToken
+
+logger = logging.getLogger(__name__)
+
+MAX_TOKENS_PER_REQUEST = 20
+
+
+def register_tokens(user, tokens, device_info=None):
+    """
+    يسجّل tokens للمستخدم ويُرجع (created, updated, unchanged).
+    التوكن المسجل لمستخدم آخر يُنقل إلى هذا المستخدم (نفس الجهاز بحساب مختلف).
+    """
+    tokens = list(dict.fromkeys(t for t in tokens if t))
+    if not tokens:
+        return 0, 0, 0
+
+    now = timezone.now()
+    touch_before = now - timedelta(seconds=getattr(settings, 'FCM_TOKEN_TOUCH_INTERVAL', 24 * 60 * 60))
+    existing = {
+        row['token']: row
+        for row in FCMToken.objects.filter(token__in=tokens).values('token', 'user_id', 'device_info', 'last_seen')
+    }
+
+    changed = [
+        token for token in tokens
+        if token not in existing
+        or existing[token]['user_id'] != user.pk
+        or existing[token]['device_info'] != device_info
+        or existing[token]['last_seen'] < touch_before
+    ]
+    if changed:
+        FCMToken.objects.bulk_create(
+            [FCMToken(user=user, token=token, device_info=device_info, last_seen=now) for token in changed],
+            update_conflicts=True,
+            unique_fields=['token'],
+            update_fields=['user', 'device_info', 'last_seen'],
+        )
+
+    created = sum(1 for token in changed if token not in existing)
+    return created, len(changed) - created, len(tokens) - len(changed)
+
+
+def prune_stale_tokens(max_age=timedelta(days=270)):
+    """يحذف التوكنات التي لم يُعِد أي جهاز تسجيلها منذ max_age (يعتبرها FCM منتهية)."""
+    deleted, _ = FCMToken.objects.filter(last_seen__lt=timezone.now() - max_age).delete()
+    if deleted:
+        logger.info(f"🧹 تم حذف {deleted} توكن FCM قديم")
+    return deleted
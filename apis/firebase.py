@@ -1,10 +1,25 @@
 import os
-import firebase_admin
-from firebase_admin import credentials
+import threading
+
+from django.conf import settings
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 FIREBASE_KEY_PATH = os.path.join(BASE_DIR, 'apis', 'firebase_admin_sdk.json')
 
-if not firebase_admin._apps:
-    cred = credentials.Certificate(FIREBASE_KEY_PATH)
-    firebase_admin.initialize_app(cred)
+_lock = threading.Lock()
+
+
+def get_app():
+    """
+    يهيئ تطبيق Firebase عند أول استخدام فقط: firebase_admin يسحب grpc وحزم google-cloud،
+    فلا تدفع كلفتها العمليات التي لا ترسل إشعارات (migrate، عمال الويب، ...).
+    """
+    import firebase_admin
+    from firebase_admin import credentials
+
+    with _lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(FIREBASE_KEY_PATH)
+            # مهلة لطلبات Firebase حتى لا يعلق الإرسال إذا أبطأ الخادم
+            firebase_admin.initialize_app(cred, {'httpTimeout': settings.PUSH_TIMEOUT})
+    return firebase_admin.get_app()
@@ -0,0 +1,67 @@
+# File: apis/geohash.py
+"""
+ترميز geohash للبحث المكاني دون PostGIS.
+
+كل نقطة تُخزَّن كنص geohash بدقة GEOHASH_PRECISION، والنقاط القريبة تشترك في بادئة واحدة،
+فيصبح البحث في نصف قطر معيّن استعلامات LIKE 'prefix%' على فهرس B-tree (varchar_pattern_ops)
+للخلايا التي تغطي المربع المحيط بالدائرة.
+"""
+from math import cos, floor, radians
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+KM_PER_DEGREE = 111.32
+MAX_CELLS = 32
+
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(ارتفاع, عرض) الخلية بالدرجات عند الدقة precision."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def covering_cells(lat, lon, radius_km):
+    """
+    بادئات geohash التي تغطي المربع المحيط بدائرة نصف قطرها radius_km حول (lat, lon)،
+    بأعلى دقة لا يتجاوز فيها عدد الخلايا MAX_CELLS: خلايا أصغر تعني مرشحين أقل خارج الدائرة.
+    """
+    d_lat = radius_km / KM_PER_DEGREE
+    d_lon = min(180.0, radius_km / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01)))
+    south, north = max(-90.0, lat - d_lat), min(90.0 - 1e-9, lat + d_lat)
+    west, east = lon - d_lon, lon + d_lon
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        first_row, last_row = floor((south + 90) / height), floor((north + 90) / height)
+        first_col, last_col = floor((west + 180) / width), floor((east + 180) / width)
+        if (last_row - first_row + 1) * (last_col - first_col + 1) <= MAX_CELLS:
+            break
+
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        cell_lat = -90 + (row + 0.5) * height
+        for col in range(first_col, last_col + 1):
+            cell_lon = (-180 + (col + 0.5) * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat, cell_lon, precision))
+    return sorted(cells)
@@ -0,0 +1,348 @@
+# File: apis/ledger.py
+"""
+خدمة دفتر الأستاذ للمحافظ.
+
+كل تغيير على الرصيد يُنفّذ كاستعلام UPDATE واحد مشروط على مستوى قاعدة البيانات
+(balance = balance ± x WHERE balance >= x) بدلاً من القراءة ثم الحساب في بايثون ثم الحفظ،
+وبذلك لا تضيع أي تحديثات عند التزامن.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, DecimalField, F, Max, Sum, Value, When
+from django.utils.translation import gettext_lazy as _
+
+from .models import Transaction, Wallet, WalletSnapshot
+
+logger = logging.getLogger(__name__)
+
+# اتجاه أثر كل نوع عملية على الرصيد؛ عمليات التحويل تحمل اتجاهها في metadata['direction']
+CREDIT_TYPES = ('charge', 'refund')
+DEBIT_TYPES = ('withdraw', 'payment')
+# العمليات الفاشلة أو الملغاة لا تدخل في حساب الرصيد
+EXCLUDED_STATUSES = (Transaction.Status.FAILED, Transaction.Status.CANCELLED)
+# أقصى انتظار لانتهاء المعاملات التي تُدرج عمليات قبل أخذ حد اللقطات؛ بعدها تُؤجل اللقطة للجولة التالية
+SNAPSHOT_LOCK_TIMEOUT_MS = 2000
+
+
+def _to_amount(amount):
+    return amount if isinstance(amount, Decimal) else Decimal(str(amount))
+
+
+def credit(wallet_id, amount):
+    """
+    يضيف المبلغ إلى المحفظة باستعلام واحد.
+    يُرجع True إذا تم التحديث، وتُتجاهل المبالغ غير الموجبة كما في Wallet.credit سابقاً.
+    """
+    amount = _to_amount(amount)
+    if amount <= 0:
+        return False
+    return Wallet.objects.filter(pk=wallet_id).update(balance=F('balance') + amount) == 1
+
+
+def credit_user(user_id, amount):
+    """نفس credit لكن بالاعتماد على معرّف المستخدم بدل معرّف المحفظة."""
+    amount = _to_amount(amount)
+    if amount <= 0:
+        return False
+    return Wallet.objects.filter(user_id=user_id).update(balance=F('balance') + amount) == 1
+
+
+def debit(wallet_id, amount):
+    """
+    يخصم المبلغ فقط إذا كان الرصيد كافياً، في استعلام UPDATE واحد مشروط.
+    يرفع ValueError إذا كان المبلغ غير موجب أو الرصيد غير كافٍ.
+    """
+    amount = _to_amount(amount)
+    if amount <= 0:
+        raise ValueError(_("رصيد غير كافٍ."))
+    updated = Wallet.objects.filter(pk=wallet_id, balance__gte=amount).update(
+        balance=F('balance') - amount
+    )
+    if updated != 1:
+        raise ValueError(_("رصيد غير كافٍ."))
+    return True
+
+
+def transfer(from_wallet_id, to_wallet_id, amount):
+    """
+    تحويل ذري بين محفظتين.
+    تُقفل المحفظتان بترتيب ثابت (حسب المعرّف) لتجنّب الجمود (deadlock)
+    عندما يحوّل طرفان لبعضهما في الوقت نفسه.
+    """
+    amount = _to_amount(amount)
+    if from_wallet_id == to_wallet_id:
+        raise ValueError(_("لا يمكن التحويل إلى نفس المحفظة."))
+
+    with transaction.atomic():
+        locked = list(
+            Wallet.objects.select_for_update()
+            .filter(pk__in=[from_wallet_id, to_wallet_id])
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        if len(locked) != 2:
+            raise Wallet.DoesNotExist(_("المحفظة غير موجودة."))
+        debit(from_wallet_id, amount)
+        credit(to_wallet_id, amount)
+    return True
+
+
+# ============================
+# سجل العمليات (Journal) واللقطات
+# ============================
+
+def new_reference():
+    return uuid.uuid4().hex.upper()
+
+
+def signed_amount(transaction_type, amount, metadata=None):
+    """أثر العملية على الرصيد: موجب للإيداع، سالب للخصم، وصفر لما لا يؤثر."""
+    amount = _to_amount(amount)
+    if transaction_type in CREDIT_TYPES:
+        return amount
+    if transaction_type in DEBIT_TYPES:
+        return -amount
+    if transaction_type == 'transfer':
+        direction = (metadata or {}).get('direction')
+        if direction == 'in':
+            return amount
+        if direction == 'out':
+            return -amount
+    return Decimal('0')
+
+
+def signed_amount_expression():
+    """نفس منطق signed_amount لكن كتعبير SQL لاستخدامه داخل Sum."""
+    return Case(
+        When(transaction_type__in=CREDIT_TYPES, then=F('amount')),
+        When(transaction_type__in=DEBIT_TYPES, then=-F('amount')),
+        When(transaction_type='transfer', metadata__direction='in', then=F('amount')),
+        When(transaction_type='transfer', metadata__direction='out', then=-F('amount')),
+        default=Value(Decimal('0')),
+        output_field=DecimalField(max_digits=15, decimal_places=2),
+    )
+
+
+def apply_transaction(instance):
+    """
+    يطبّق عملية مسجّلة على رصيد محفظتها باستعلام واحد.
+    إذا فشل الخصم تُعلَّم العملية كفاشلة حتى لا تدخل في إعادة بناء الأرصدة.
+    """
+    delta = signed_amount(instance.transaction_type, instance.amount, instance.metadata)
+    if delta > 0:
+        credit(instance.wallet_id, delta)
+    elif delta < 0:
+        try:
+            debit(instance.wallet_id, -delta)
+        except ValueError:
+            Transaction.objects.filter(pk=instance.pk).update(status=Transaction.Status.FAILED)
+            raise
+
+
+def journal(entries):
+    """
+    يضيف قيوداً إلى سجل العمليات دفعة واحدة دون إطلاق إشارة post_save،
+    ويُستخدم عندما يكون الرصيد قد طُبّق مسبقاً عبر الدفتر.
+    entries: قائمة من القواميس تحوي wallet_id و transaction_type و amount وما يلزم.
+    """
+    rows = [
+        Transaction(
+            status=Transaction.Status.COMPLETED,
+            reference_number=new_reference(),
+            **entry
+        )
+        for entry in entries
+    ]
+    return Transaction.objects.bulk_create(rows, batch_size=1000)
+
+
+def ingest_transactions(entries):
+    """
+    إدخال مجمّع للعمليات: إدراج كل الصفوف باستعلام bulk_create
+    ثم تطبيق صافي الأثر لكل محفظة مرة واحدة، وكل ذلك ضمن معاملة واحدة.
+    يرفع ValueError ويتراجع عن الدفعة كاملة إذا كان صافي أي محفظة يتجاوز رصيدها.
+    """
+    deltas = defaultdict(Decimal)
+    for entry in entries:
+        deltas[entry['wallet_id']] += signed_amount(
+            entry['transaction_type'], entry['amount'], entry.get('metadata')
+        )
+
+    with transaction.atomic():
+        created = journal(entries)
+        for wallet_id in sorted(deltas):
+            delta = deltas[wallet_id]
+            if delta > 0:
+                credit(wallet_id, delta)
+            elif delta < 0:
+                debit(wallet_id, -delta)
+    return created
+
+
+def get_balance(wallet_id):
+    """قراءة O(1) للرصيد المُجسَّد في المحفظة."""
+    return Wallet.objects.filter(pk=wallet_id).values_list('balance', flat=True).first()
+
+
+def opening_snapshots():
+    """
+    أقدم لقطة لكل محفظة: اللقطة الافتتاحية التي أنشأها ترحيل 0002 برصيد المحفظة قبل بدء السجل،
+    أو أول لقطة لمحفظة أُنشئت بعده. إعادة البناء الكاملة تبدأ منها لا من الصفر.
+    """
+    return (
+        WalletSnapshot.objects.order_by('wallet_id', 'last_transaction_id')
+        .distinct('wallet_id')
+    )
+
+
+def journal_balance(wallet_id, until=None):
+    """
+    الرصيد كما يُحسب من السجل (للتدقيق): آخر لقطة + مجموع العمليات اللاحقة لها،
+    وحتى العملية until (شاملة) إن حُددت. العمليات السابقة للّقطة الافتتاحية مشمولة في رصيدها.
+    """
+    snapshots = WalletSnapshot.objects.filter(wallet_id=wallet_id)
+    transactions = Transaction.objects.filter(wallet_id=wallet_id).exclude(status__in=EXCLUDED_STATUSES)
+    if until is not None:
+        snapshots = snapshots.filter(last_transaction_id__lte=until)
+        transactions = transactions.filter(id__lte=until)
+
+    snapshot = snapshots.order_by('-last_transaction_id').first()
+    if snapshot:
+        transactions = transactions.filter(id__gt=snapshot.last_transaction_id)
+    delta = transactions.aggregate(total=Sum(signed_amount_expression()))['total']
+    return (snapshot.balance if snapshot else Decimal('0')) + (delta or Decimal('0'))
+
+
+def lock_transactions(cursor):
+    """
+    يأخذ قفل SHARE على جدول العمليات: ينتظر انتهاء كل معاملة أدرجت فيه ويمنع الإدراج حتى نهاية
+    المعاملة الحالية، فكل المعرفات حتى max(id) بعده مثبتة أو ملغاة ولن تظهر عملية بمعرّف أصغر لاحقاً.
+    يرفع OperationalError إذا لم يُحصل عليه خلال SNAPSHOT_LOCK_TIMEOUT_MS.
+    """
+    cursor.execute(f"SET LOCAL lock_timeout = '{SNAPSHOT_LOCK_TIMEOUT_MS}ms'")
+    cursor.execute(f"LOCK TABLE {connection.ops.quote_name(Transaction._meta.db_table)} IN SHARE MODE")
+
+
+def committed_watermark():
+    """
+    أكبر معرّف عملية يمكن أن تشمله لقطة: المعرفات تُحجز عند الإدراج وقد تُثبَّت بغير ترتيبها،
+    فلا يكفي max(id) المرئي ولا مهلة زمنية. يُرجع None إذا بقيت معاملة طويلة تُدرج عمليات.
+    """
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            lock_transactions(cursor)
+            return Transaction.objects.aggregate(m=Max('id'))['m']
+    except OperationalError:
+        logger.warning("⏳ تأجيل لقطات الأرصدة: معاملة تُدرج عمليات لم تنتهِ بعد")
+        return None
+
+
+def take_snapshots():
+    """
+    لقطة تزايدية لكل محفظة تغيّرت منذ اللقطة السابقة:
+    أحدث لقطة لها + صافي عملياتها في الفترة، باستعلامين تجميعيين فقط.
+    تُرجع عدد اللقطات المنشأة.
+    """
+    watermark = committed_watermark()
+    previous = WalletSnapshot.objects.aggregate(m=Max('last_transaction_id'))['m'] or 0
+    if not watermark or watermark <= previous:
+        return 0
+
+    deltas = (
+        Transaction.objects.filter(id__gt=previous, id__lte=watermark)
+        .exclude(status__in=EXCLUDED_STATUSES)
+        .values('wallet_id')
+        .annotate(delta=Sum(signed_amount_expression()))
+    )
+    deltas = {row['wallet_id']: row['delta'] for row in deltas}
+    # كل محفظة لها عمليات قبل previous أُخذت لها لقطة في جولة سابقة، فأحدث لقطة تكفي كأساس
+    bases = dict(
+        WalletSnapshot.objects.filter(wallet_id__in=deltas)
+        .order_by('wallet_id', '-last_transaction_id')
+        .distinct('wallet_id')
+        .values_list('wallet_id', 'balance')
+    )
+
+    snapshots = [
+        WalletSnapshot(
+            wallet_id=wallet_id,
+            balance=bases.get(wallet_id, Decimal('0')) + delta,
+            last_transaction_id=watermark,
+        )
+        for wallet_id, delta in deltas.items()
+    ]
+    WalletSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    logger.info(f"📸 تم إنشاء {len(snapshots)} لقطة رصيد حتى العملية {watermark}")
+    return len(snapshots)
+
+
+# ============================
+# الإيداع المجمّع
+# ============================
+
+BULK_UPDATE_CHUNK = 1000
+
+
+def _bulk_apply_credits(totals):
+    """
+    يطبّق إيداعات عدة محافظ باستعلام UPDATE ... FROM (VALUES ...) واحد لكل دفعة من 1000 محفظة.
+    totals: قاموس {wallet_id: amount}.
+    """
+    table = connection.ops.quote_name(Wallet._meta.db_table)
+    items = sorted(totals.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), BULK_UPDATE_CHUNK):
+            chunk = items[start:start + BULK_UPDATE_CHUNK]
+            values = ', '.join(['(%s, %s::numeric)'] * len(chunk))
+            params = [p for wallet_id, amount in chunk for p in (wallet_id, amount)]
+            cursor.execute(
+                f"UPDATE {table} AS w SET balance = w.balance + v.amount "
+                f"FROM (VALUES {values}) AS v(id, amount) WHERE w.id = v.id",
+                params,
+            )
+
+
+def bulk_credit(entries, transaction_type='charge', description=None):
+    """
+    إيداع مجمّع لقائمة (user_id, amount[, metadata]):
+    تُجمع المبالغ حسب المحفظة وتُطبّق باستعلامات مجمّعة، ثم تُسجّل عملية لكل سطر عبر bulk_create.
+    يُرجع (العمليات المنشأة، معرّفات المستخدمين بلا محفظة).
+    """
+    entries = [
+        (user_id, _to_amount(amount), rest[0] if rest else {})
+        for user_id, amount, *rest in entries
+    ]
+    if any(not amount.is_finite() or amount <= 0 for _, amount, _ in entries):
+        raise ValueError(_("يجب أن تكون المبالغ موجبة."))
+
+    wallet_ids = dict(
+        Wallet.objects.filter(user_id__in={user_id for user_id, _, _ in entries})
+        .values_list('user_id', 'pk')
+    )
+    missing = sorted({user_id for user_id, _, _ in entries if user_id not in wallet_ids})
+
+    totals = defaultdict(Decimal)
+    journal_entries = []
+    for user_id, amount, metadata in entries:
+        wallet_id = wallet_ids.get(user_id)
+        if wallet_id is None:
+            continue
+        totals[wallet_id] += amount
+        journal_entries.append({
+            'wallet_id': wallet_id,
+            'transaction_type': transaction_type,
+            'amount': amount,
+            'description': description,
+            'metadata': metadata,
+        })
+
+    with transaction.atomic():
+        _bulk_apply_credits(totals)
+        created = journal(journal_entries)
+
+    logger.info(f"💸 إيداع مجمّع: {len(created)} عملية على {len(totals)} محفظة")
+    return created, missing
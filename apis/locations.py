@@ -0,0 +1,185 @@
+# File: apis/locations.py
+"""
+مخزن آخر موقع لكل سائق.
+
+تطبيق السائق يرسل نقاط GPS على دفعات كل بضع ثوانٍ، فلا تُكتب كل نقطة في جدول السائقين:
+يُحفظ أحدث موقع لكل سائق في مخزن سريع، وتُرحَّل المواقع المتغيرة إلى Postgres دفعة واحدة كل
+DRIVER_LOCATION_FLUSH_INTERVAL ثانية. المجدول يقرأ المواقع من المخزن، ويرجع إلى أعمدة
+latitude/longitude لمن لا يوجد له موقع فيه.
+
+المخزن Redis (GEO + hash لأوقات المواقع) إذا ضُبط DRIVER_LOCATION_REDIS_URL، وإلا قاموس في
+ذاكرة العملية يصلح للتطوير والاختبارات (كل عملية ترى مواقعها فقط حتى الترحيل). مخزن الذاكرة
+يُرحَّل من عملية الويب التي استقبلت المواقع نفسها، لأن عامل Celery لا يرى ذاكرتها؛ فالترحيل في
+reconcile_availability ومهمة flush_driver_locations الدورية لا يجدان فيه شيئاً، ونبضات السائقين
+تتأخر في Postgres حتى أول دفعة مواقع بعد انقضاء الفترة. في الإنتاج (عدة عمال أو Celery) اضبط Redis.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from .models import Driver
+from .side_effects import dispatch, side_effect
+
+logger = logging.getLogger(__name__)
+
+GEO_KEY = 'driver_locations'
+TS_KEY = 'driver_locations:ts'
+DIRTY_KEY = 'driver_locations:dirty'
+FLUSH_KEY = 'driver_locations:flush'
+
+# يحدّث الموقع فقط إذا كانت النقطة أحدث من المخزنة، حتى لا تغلب دفعة متأخرة دفعة أحدث منها
+UPDATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[2], ARGV[1])
+if current and tonumber(current) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('GEOADD', KEYS[1], ARGV[3], ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[4])
+redis.call('SADD', KEYS[3], ARGV[1])
+return 1
+"""
+
+
+class MemoryLocationStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._dirty = set()
+        self._last_flush = time.monotonic()
+
+    def update(self, driver_id, lat, lon, ts):
+        with self._lock:
+            current = self._positions.get(driver_id)
+            if current and current[2] >= ts:
+                return False
+            self._positions[driver_id] = (lat, lon, ts)
+            self._dirty.add(driver_id)
+            return True
+
+    def get_many(self, driver_ids):
+        with self._lock:
+            return {i: self._positions[i] for i in driver_ids if i in self._positions}
+
+    def pop_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return {i: self._positions[i] for i in dirty}
+
+    def flush_due(self, interval):
+        with self._lock:
+            if time.monotonic() - self._last_flush < interval:
+                return False
+            self._last_flush = time.monotonic()
+            return True
+
+
+class RedisLocationStore:
+    def __init__(self, url):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self._update = self.redis.register_script(UPDATE_SCRIPT)
+
+    def update(self, driver_id, lat, lon, ts):
+        return bool(self._update(keys=[GEO_KEY, TS_KEY, DIRTY_KEY], args=[driver_id, lat, lon, ts]))
+
+    def _read(self, driver_ids):
+        if not driver_ids:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.geopos(GEO_KEY, *driver_ids)
+        pipe.hmget(TS_KEY, driver_ids)
+        positions, stamps = pipe.execute()
+        return {
+            int(driver_id): (position[1], position[0], float(ts))
+            for driver_id, position, ts in zip(driver_ids, positions, stamps)
+            if position and ts
+        }
+
+    def get_many(self, driver_ids):
+        return self._read(list(driver_ids))
+
+    def pop_dirty(self):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.smembers(DIRTY_KEY)
+        pipe.delete(DIRTY_KEY)
+        dirty, _ = pipe.execute()
+        return self._read([int(i) for i in dirty])
+
+    def flush_due(self, interval):
+        # عملية واحدة فقط من عمال الويب تأخذ دور الترحيل في كل فترة
+        return bool(self.redis.set(FLUSH_KEY, 1, nx=True, ex=max(int(interval), 1)))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                url = getattr(settings, 'DRIVER_LOCATION_REDIS_URL', '')
+                _store = RedisLocationStore(url) if url else MemoryLocationStore()
+    return _store
+
+
+def record_points(driver_id, points):
+    """
+    يحفظ أحدث نقطة من الدفعة points (قواميس lat و lon و ts اختياري كـ datetime) ويُرجعها،
+    أو None إذا كان في المخزن موقع أحدث منها. يطلب الترحيل إلى Postgres إذا حان وقته.
+    """
+    now = time.time()
+    latest = max(points, key=lambda p: p['ts'].timestamp() if p.get('ts') else now)
+    # لا نثق بساعة الجهاز إذا سبقت ساعة الخادم
+    ts = min(latest['ts'].timestamp(), now) if latest.get('ts') else now
+
+    store = get_store()
+    accepted = store.update(driver_id, latest['lat'], latest['lon'], ts)
+    if store.flush_due(settings.DRIVER_LOCATION_FLUSH_INTERVAL):
+        if isinstance(store, MemoryLocationStore):
+            # المواقع في ذاكرة هذه العملية فقط، فلا يُرسل ترحيلها إلى Celery
+            flush_driver_locations()
+        else:
+            dispatch('flush_driver_locations')
+    return (latest['lat'], latest['lon'], ts) if accepted else None
+
+
+def get_positions(driver_ids):
+    """{driver_id: (lat, lon)} من المخزن، ومن أعمدة السائق لمن لا يوجد له موقع في المخزن."""
+    driver_ids = list(driver_ids)
+    positions = {i: (lat, lon) for i, (lat, lon, _ts) in get_store().get_many(driver_ids).items()}
+    missing = [i for i in driver_ids if i not in positions]
+    if missing:
+        rows = Driver.objects.filter(
+            pk__in=missing, latitude__isnull=False, longitude__isnull=False
+        ).values_list('pk', 'latitude', 'longitude')
+        positions.update((pk, (lat, lon)) for pk, lat, lon in rows)
+    return positions
+
+
+@side_effect
+def flush_driver_locations():
+    """يرحّل المواقع التي تغيّرت منذ آخر ترحيل إلى جدول السائقين بتحديث جماعي واحد."""
+    dirty = get_store().pop_dirty()
+    if not dirty:
+        return 0
+    drivers = [
+        Driver(
+            pk=driver_id,
+            latitude=lat,
+            longitude=lon,
+            where_location=f"{lat:.6f},{lon:.6f}",
+            location_updated_at=datetime.fromtimestamp(ts, tz=dt_timezone.utc),
+        )
+        for driver_id, (lat, lon, ts) in dirty.items()
+    ]
+    Driver.objects.bulk_update(
+        drivers, ['latitude', 'longitude', 'where_location', 'location_updated_at'], batch_size=500
+    )
+    logger.info(f"📍 تم ترحيل مواقع {len(drivers)} سائق")
+    return len(drivers)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apis.ratings import backfill_driver_ratings
+
+
+class Command(BaseCommand):
+    help = '⭐ إعادة حساب عدّادات ومتوسط تقييم كل السائقين من جدول التقييمات باستعلام تجميعي واحد.'
+
+    def handle(self, *args, **options):
+        updated = backfill_driver_ratings()
+        self.stdout.write(self.style.SUCCESS(f"✅ تم تحديث تقييم {updated} سائق."))
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+
+def _request(fresh):
+    """يحاكي طلباً واحداً: استعلام ثم نهاية الطلب كما يفعلها Django."""
+    started = time.perf_counter()
+    if fresh:
+        # اتصال مباشر بالمشغّل متجاوزاً المجمّع، كما كان كل طلب يفعل دون CONN_MAX_AGE
+        params = connection.get_connection_params()
+        params.pop('pool', None)
+        raw = connection.Database.connect(**params)
+        with raw.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        raw.close()
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        # نفس ما يُنفَّذ مع request_finished: يحترم CONN_MAX_AGE والمجمّع
+        close_old_connections()
+    return time.perf_counter() - started
+
+
+def _worker(requests, fresh):
+    try:
+        return [_request(fresh) for _ in range(requests)]
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = '⏱️ قياس كلفة إنشاء اتصال قاعدة البيانات لكل طلب مقارنة بإعداد الاتصالات الحالي.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='عدد الطلبات لكل خيط')
+        parser.add_argument('--threads', type=int, default=4)
+
+    def _run(self, label, fresh, requests, threads):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            timings = sorted(t for batch in executor.map(lambda _: _worker(requests, fresh), range(threads)) for t in batch)
+        elapsed = time.perf_counter() - started
+        avg_ms = sum(timings) / len(timings) * 1000
+        p95_ms = timings[int(len(timings) * 0.95) - 1] * 1000
+        self.stdout.write(
+            f"{label:<28} {len(timings) / elapsed:>9.0f} طلب/ث   متوسط {avg_ms:.2f} ms   p95 {p95_ms:.2f} ms"
+        )
+        return avg_ms
+
+    def handle(self, *args, **options):
+        requests, threads = options['requests'], options['threads']
+        db = settings.DATABASES['default']
+        self.stdout.write(self.style.NOTICE(
+            f"🔌 الوضع: {settings.DB_CONNECTION_MODE}  CONN_MAX_AGE={db.get('CONN_MAX_AGE', 0)}  "
+            f"pool={'pool' in db.get('OPTIONS', {})}  ({threads} خيوط × {requests} طلب)"
+        ))
+
+        fresh = self._run('اتصال جديد لكل طلب', True, requests, threads)
+        current = self._run(f'الإعداد الحالي ({settings.DB_CONNECTION_MODE})', False, requests, threads)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ كلفة إنشاء الاتصال ≈ {fresh - current:.2f} ms لكل طلب"
+        ))
@@ -0,0 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from apis.push import PROVIDERS
+
+
+class Command(BaseCommand):
+    help = '⏱️ قياس سرعة إرسال الإشعارات عبر مزود HTTP (يُستخدم مع fake_push_server).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--provider', default='fcm_http', choices=['fcm_http', 'onesignal'])
+        parser.add_argument('--url', default='http://127.0.0.1:8765/', help='عنوان المزود أو الخادم الوهمي')
+        parser.add_argument('--users', type=int, default=500, help='عدد المستخدمين (إشعار لكل مستخدم)')
+        parser.add_argument('--tokens', type=int, default=2, help='عدد الأجهزة لكل مستخدم')
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        provider = PROVIDERS[options['provider']](url=options['url'])
+        users, per_user = options['users'], options['tokens']
+
+        def send(user):
+            started = time.perf_counter()
+            result = provider.send([f"token-{user}-{i}" for i in range(per_user)], 'اختبار', 'قياس سرعة الإرسال')
+            return time.perf_counter() - started, result
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            results = list(executor.map(send, range(users)))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(t for t, _ in results)
+        success = sum(r['success'] for _, r in results)
+        failure = sum(r['failure'] for _, r in results)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {provider.name}: {users} طلب في {elapsed:.2f} ث = {users / elapsed:.0f} طلب/ث، "
+            f"{success / elapsed:.0f} إشعار/ث   p50 {timings[len(timings) // 2] * 1000:.1f} ms   "
+            f"p95 {timings[int(len(timings) * 0.95) - 1] * 1000:.1f} ms   فشل {failure}"
+        ))
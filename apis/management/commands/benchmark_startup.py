@@ -0,0 +1,89 @@
+import os
+import re
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+# ما تحمّله كل عملية عند الإقلاع
+PROFILES = {
+    'manage': "import django; django.setup()",
+    'web': (
+        "from backend.asgi import application\n"
+        "from django.urls import get_resolver; get_resolver().url_patterns"
+    ),
+    'worker': "from backend.celery import app; app.loader.import_default_modules()",
+}
+
+# السلوك القديم: تهيئة Firebase وتحميل مكتبات الجدولة عند الإقلاع
+EAGER = """
+for name in ('firebase_admin.messaging', 'sklearn.preprocessing', 'hdbscan'):
+    try:
+        __import__(name)
+    except ImportError:
+        pass
+import apis.firebase
+apis.firebase.get_app()
+"""
+
+REPORT = """
+import resource
+print('RSS', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def _measure(code):
+    """يشغّل code في عملية جديدة ويُرجع (زمن الإقلاع ms، زمن الاستيراد ms، RSS MB، أثقل الحزم)."""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'}
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code + REPORT],
+        capture_output=True, text=True, env=env,
+    )
+    wall = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+
+    total, packages = 0, {}
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        own, cumulative, indent, name = match.groups()
+        total += int(own)
+        if not indent:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + int(cumulative)
+    rss = int(re.search(r'^RSS (\d+)$', proc.stdout, re.M).group(1)) / 1024
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return wall, total / 1000, rss, heaviest
+
+
+class Command(BaseCommand):
+    help = '⏱️ قياس زمن الإقلاع والذاكرة (RSS) لعمليات الويب و Celery و manage.py عبر python -X importtime.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=list(PROFILES), action='append',
+                            help='العملية المراد قياسها (الافتراضي: الكل)')
+        parser.add_argument('--eager', action='store_true',
+                            help='قياس إضافي مع تحميل Firebase و sklearn و hdbscan مسبقاً للمقارنة')
+        parser.add_argument('--top', type=int, default=8, help='عدد أثقل الحزم المعروضة')
+        parser.add_argument('--runs', type=int, default=3, help='عدد التشغيلات (يُعرض أفضلها)')
+
+    def _report(self, label, code, runs, top):
+        results = [_measure(code) for _ in range(runs)]
+        wall, imports, rss, heaviest = min(results, key=lambda result: result[0])
+        self.stdout.write(f"{label:<16} إقلاع {wall:>7.0f} ms   استيراد {imports:>7.0f} ms   RSS {rss:>6.1f} MB")
+        if top:
+            self.stdout.write('    ' + '  '.join(f"{name} {ms / 1000:.0f}ms" for name, ms in heaviest[:top]))
+        return rss
+
+    def handle(self, *args, **options):
+        for name in options['profile'] or list(PROFILES):
+            lazy = self._report(name, PROFILES[name], options['runs'], options['top'])
+            if options['eager']:
+                eager = self._report(f"{name} (eager)", PROFILES[name] + EAGER, options['runs'], options['top'])
+                self.stdout.write(self.style.SUCCESS(f"    ✅ التحميل الكسول يوفّر {eager - lazy:.1f} MB لكل عملية"))
@@ -0,0 +1,45 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apis import ledger
+from apis.models import Bonus
+from apis.payouts import award_bonuses, read_credit_csv
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = '💸 إيداع أو منح مكافآت جماعية من ملف CSV بعمودين (user, amount) في عملية دفتر مجمّعة واحدة.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help='مسار ملف CSV؛ user معرّف رقمي أو اسم مستخدم')
+        parser.add_argument('--bonus', action='store_true', help='إنشاء سجلات مكافأة لكل سطر')
+        parser.add_argument('--reason', default='other',
+                            choices=[choice for choice, _ in Bonus._meta.get_field('reason').choices])
+        parser.add_argument('--description', default=None, help='وصف العمليات عند الإيداع بدون مكافآت')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['csv_path'], 'rb') as f:
+                entries = read_credit_csv(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        if not entries:
+            self.stdout.write(self.style.WARNING("🚫 الملف لا يحتوي على أسطر."))
+            return
+
+        try:
+            if options['bonus']:
+                bonuses = award_bonuses(entries, reason=options['reason'])
+                self.stdout.write(self.style.SUCCESS(f"✅ تم منح {len(bonuses)} مكافأة."))
+                return
+
+            created, missing = ledger.bulk_credit(entries, description=options['description'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if missing:
+            self.stdout.write(self.style.WARNING(f"⚠️ مستخدمون بلا محفظة تم تخطيهم: {missing[:20]}"))
+        self.stdout.write(self.style.SUCCESS(f"✅ تم تنفيذ {len(created)} عملية إيداع."))
@@ -4,21 +4,25 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 import logging
 import time
 import numpy as np
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
 from django.db import transaction
 from django.contrib.auth import get_user_model
-from sklearn.preprocessing import StandardScaler
-import hdbscan
 
 from apis.models import (
     CasheBooking, Booking,
     CasheItemDelivery, ItemDelivery,
-    Driver, Trip, Notification
+    Trip, Notification
 )
-from apis.driver_selector import haversine_distance, select_best_driver
+from apis.availability import available_drivers
+from apis.driver_selector import nearest_driver
 from apis.route_optimizer import nearest_neighbor_route
-from apis.retry_queue import add_to_retry_queue
+from apis.retry_queue import add_id_to_retry_queue, add_to_retry_queue
+from apis.priority import load_queue, wait_metrics
+from apis.request_batch import BOOKING
+from apis.scheduling import Listener, request_run, round_lock
+from apis.trip_search import closest_open_trip
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -46,92 +50,144 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--min_cluster_size', type=int, default=3)
-        parser.add_argument('--interval', type=int, default=20,
-                            help='زمن الانتظار بالثواني بين كل جولة جدولية')
+        parser.add_argument('--interval', type=int, default=None,
+                            help='زمن الانتظار بالثواني بين كل جولة جدولية (مع --listen: الجولة الاحتياطية عند الخمول، افتراضياً 300)')
+        parser.add_argument('--once', action='store_true',
+                            help='تنفيذ جولة واحدة ثم الخروج (تستخدمه مهمة Celery)')
+        parser.add_argument('--listen', action='store_true',
+                            help='تنفيذ جولة عند إنشاء طلبات جديدة (Postgres LISTEN/NOTIFY) بدلاً من النوم الثابت')
 
     def handle(self, *args, **options):
-        interval = options['interval']
+        if options['once']:
+            self.run_round(options)
+            return
+        if options['listen']:
+            self.listen(options)
+            return
+
+        interval = options['interval'] or 20
         self.stdout.write(self.style.NOTICE("🔄 بدء البث الدوري لجدولة الرحلات..."))
         while True:
-            start_ts = now()
-            self.stdout.write(self.style.NOTICE(f"🔁 بدء الجولة في {start_ts}"))
-            try:
-                self.run_scheduler(options)
-                self.stdout.write(self.style.SUCCESS("✅ انتهت الجولة بنجاح."))
-            except Exception:
-                logger.exception("⚠️ فشل الجولة الجدولية.")
+            self.run_round(options)
             self.stdout.write(self.style.NOTICE(f"⏱️ النوم لـ {interval} ثانية..."))
             time.sleep(interval)
 
-    def find_pending_trip(self, from_loc, to_loc, min_capacity=1, max_distance_km=3):
+    def listen(self, options):
+        interval = options['interval'] or 300
+        listener = Listener()
+        self.stdout.write(self.style.NOTICE(
+            f"👂 بانتظار الطلبات الجديدة (تجميع {settings.TRIP_SCHEDULER_MIN_WAIT}-{settings.TRIP_SCHEDULER_MAX_WAIT} ث، "
+            f"جولة احتياطية كل {interval} ث)..."
+        ))
         try:
-            from_lat, from_lon = map(float, from_loc.split(','))
-            to_lat, to_lon = map(float, to_loc.split(','))
-        except ValueError:
-            logger.warning(f"⚠️ إحداثيات غير صالحة: {from_loc} - {to_loc}")
-            return None
-
-        trips = Trip.objects.filter(
-            status__in=[Trip.Status.PENDING, Trip.Status.IN_PROGRESS],
-            available_seats__gte=min_capacity
-        )
+            # الطلبات التي وصلت قبل بدء الاستماع
+            self.run_round(options)
+            while True:
+                listener.wait_for_batch(interval)
+                self.run_round(options)
+        finally:
+            listener.close()
 
-        for trip in trips:
+    def run_round(self, options):
+        start_ts = now()
+        with round_lock() as acquired:
+            if not acquired:
+                self.stdout.write(self.style.WARNING("⏭️ جولة أخرى قيد التنفيذ، تم التخطي."))
+                return
+            self.stdout.write(self.style.NOTICE(f"🔁 بدء الجولة في {start_ts}"))
             try:
-                t_from_lat, t_from_lon = map(float, trip.from_location.split(','))
-                t_to_lat, t_to_lon     = map(float, trip.to_location.split(','))
-                if (haversine_distance(from_lat, from_lon, t_from_lat, t_from_lon) <= max_distance_km and
-                    haversine_distance(to_lat,   to_lon,   t_to_lat,   t_to_lon)   <= max_distance_km):
-                    return trip
-            except Exception as e:
-                logger.warning(f"⚠️ فشل في حساب مسافة الرحلة {trip.id}: {e}")
-        return None
+                self.run_scheduler(options)
+                elapsed = (now() - start_ts).total_seconds()
+                self.stdout.write(self.style.SUCCESS(f"✅ انتهت الجولة بنجاح في {elapsed:.1f} ث."))
+            except Exception:
+                logger.exception("⚠️ فشل الجولة الجدولية.")
+
+    def find_pending_trip(self, coords, min_capacity=1, max_distance_km=3):
+        from_lat, from_lon, to_lat, to_lon = coords.tolist()
+        # عبر فهرس geohash بدلاً من المرور على كل الرحلات المفتوحة لكل عنقود
+        return closest_open_trip(from_lat, from_lon, to_lat, to_lon, radius=max_distance_km, seats=min_capacity)
 
     def run_scheduler(self, options):
-        # 1. جمع الطلبات المعلقة
-        bookings  = list(CasheBooking.objects.filter(status=CasheBooking.Status.PENDING))
-        deliveries = list(CasheItemDelivery.objects.filter(status=CasheItemDelivery.Status.PENDING))
-        requests = bookings + deliveries
-
-        # 2. استخراج الإحداثيات
-        coords, items = [], []
-        for req in requests:
-            try:
-                f_lat, f_lon = map(float, req.from_location.split(','))
-                t_lat, t_lon = map(float, req.to_location.split(','))
-                coords.append([f_lat, f_lon, t_lat, t_lon])
-                items.append(req)
-            except Exception as e:
-                logger.warning(f"⚠️ طلب {req.id} إحداثيات غير صالحة: {e}")
-                add_to_retry_queue(req)
-
-        if not coords:
+        deadline = time.monotonic() + settings.TRIP_SCHEDULER_ROUND_SECONDS
+        # 1. جمع الطلبات المعلقة بترتيب الأولوية (العاجل والأقدم أولاً) ضمن ميزانية الجولة، كأعمدة NumPy
+        batch, remaining = load_queue(settings.TRIP_SCHEDULER_ROUND_BUDGET)
+        for line in wait_metrics(batch):
+            self.stdout.write(line)
+        if remaining:
+            self.stdout.write(self.style.WARNING(f"⏳ {remaining} طلب مؤجل للجولة التالية"))
+
+        # 2. الإحداثيات محللة مسبقاً في الاستعلام؛ غير الصالحة NaN
+        invalid = np.flatnonzero(~batch.valid).tolist()
+        for index in invalid:
+            logger.warning(f"⚠️ طلب {batch.rows['id'][index]} إحداثيات غير صالحة")
+            add_id_to_retry_queue(int(batch.rows['id'][index]))
+        indexes = np.flatnonzero(batch.valid)
+
+        assigned, attempted, carried = 0, invalid, 0
+        if not len(indexes):
             self.stdout.write(self.style.WARNING("🚫 لا توجد طلبات صالحه للمعالجة."))
-            return
+        else:
+            clusters, force_notify = self.build_clusters(batch, indexes, options)
+            assigned, processed = self.process_clusters(batch, clusters, deadline, force_notify)
+            attempted = attempted + processed
+            carried = len(indexes) - len(processed)
 
+        # ما بقي معلقاً مما حاولته الجولة يغيب عن الجولات حتى TRIP_SCHEDULER_RETRY_BACKOFF،
+        # أما ما لم تصل إليه قبل انتهاء مدتها فيبقى في رأس الطابور
+        batch.mark_attempted(attempted)
+        if (remaining or carried) and assigned:
+            # ما تبقى يُعالج في جولة قريبة فقط إذا تقدمت هذه الجولة؛ وإلا تكفيه الجولة الدورية
+            request_run()
+
+    def build_clusters(self, batch, indexes, options):
+        """يُرجع (العناقيد كقوائم أرقام صفوف، هل تُعالج فردياً مع إشعار الانتظار)."""
         # 3. ضبط العتبة وتجنب return مبكر حتى يصدر إشعار
-        scaled = StandardScaler().fit_transform(np.array(coords))
+        # مكتبات التجميع ثقيلة، فتُحمّل عند أول جولة فيها طلبات فقط
+        from sklearn.preprocessing import StandardScaler
+
+        scaled = StandardScaler().fit_transform(batch.coords[indexes])
         required = max(2, options['min_cluster_size'])  # خفّضنا العتبة للتأكد من المعالجة حتى عند نقطتين
         if len(scaled) < required:
             self.stdout.write(self.style.WARNING(
                 f"🚫 عدد النقاط ({len(scaled)}) أقل من الحد ({required}) — سيتم المعالجة فردياً مع إشعارات"
             ))
-            for item in items:
-                self.process_cluster([item], force_notify=True)
-            return
+            return [[index] for index in indexes.tolist()], True
+
+        import hdbscan
 
         labels = hdbscan.HDBSCAN(min_cluster_size=options['min_cluster_size']).fit_predict(scaled)
-        for cid in set(labels):
-            cluster_items = [items[i] for i, lbl in enumerate(labels) if lbl == cid]
-            self.process_cluster(cluster_items, force_notify=False)
+        # العناقيد بترتيب أعلى طلب أولوية فيها
+        return [indexes[labels == cid].tolist() for cid in dict.fromkeys(labels.tolist())], False
 
-    def process_cluster(self, cluster_items, force_notify=False):
+    def process_clusters(self, batch, clusters, deadline, force_notify):
         """
-        إذا force_notify=True، نرسل إشعار "في الانتظار" لكل طلب.
+        يعالج العناقيد بالترتيب حتى تنتهي مدة الجولة؛ ما لم يُعالج يبقى معلقاً للجولة التالية،
+        فلا تطول جولة واحدة مهما كبر التراكم. يُرجع (عدد العناقيد التي أُسندت، الصفوف التي عولجت).
+        """
+        assigned, processed = 0, []
+        for index, rows in enumerate(clusters):
+            if time.monotonic() >= deadline:
+                carried = sum(len(c) for c in clusters[index:])
+                self.stdout.write(self.style.WARNING(
+                    f"⏱️ انتهت مدة الجولة، {carried} طلب مؤجل للجولة التالية"
+                ))
+                break
+            if self.process_cluster(batch, rows, force_notify=force_notify):
+                assigned += 1
+            processed.extend(rows)
+        return assigned, processed
+
+    def process_cluster(self, batch, rows, force_notify=False):
+        """
+        rows أرقام صفوف العنقود في batch. إذا force_notify=True، نرسل إشعار "في الانتظار" لكل طلب.
+        يُرجع True إذا أُسند طلب واحد على الأقل إلى رحلة.
         """
         # لإشعار المستخدمين بأن طلبهم في الانتظار
         if force_notify:
-            for r in cluster_items:
+            # مرة واحدة لكل طلب، لا في كل جولة يُعاد فيها
+            for r in batch.instances(rows):
+                if r.last_attempt_at is not None:
+                    continue
                 user = getattr(r, 'user', getattr(r.user, 'user', None))
                 if isinstance(user, User):
                     send_notification(
@@ -142,33 +198,40 @@ class Command(BaseCommand):
                         related_object_id=r.id
                     )
 
-        bookings   = [r for r in cluster_items if hasattr(r, 'passengers')]
-        deliveries = [r for r in cluster_items if hasattr(r, 'weight')]
-        group      = cluster_items
-
-        from_loc = group[0].from_location
-        to_loc   = group[0].to_location
-        total_p  = sum(b.passengers for b in bookings)
+        data   = batch.rows[rows]
+        coords = batch.coords[rows]
+        total_p = int(data['load'][data['kind'] == BOOKING].sum())
 
         # بحث عن رحلة قائمة
-        trip = self.find_pending_trip(from_loc, to_loc, min_capacity=max(1, total_p))
+        trip = self.find_pending_trip(coords[0], min_capacity=max(1, total_p))
 
         # تجهيز المسارات
-        pickups = [list(map(float, r.from_location.split(','))) for r in group]
-        drops   = [list(map(float, r.to_location.split(',')))   for r in group]
+        pickups = coords[:, :2].tolist()
+        drops   = coords[:, 2:].tolist()
         route   = {
             'pickup':  nearest_neighbor_route(pickups),
             'dropoff': nearest_neighbor_route(drops)
         }
 
         with transaction.atomic():
-            # إذا لا توجد رحلة، ننشئ رحلة جديدة
             if not trip:
-                driver = select_best_driver(group, Driver.objects.filter(is_available=True))
+                driver = nearest_driver(pickups + drops, available_drivers())
                 if not driver or not driver.vehicles.first():
-                    for r in group:
-                        add_to_retry_queue(r)
-                    return
+                    for request_id in data['id'].tolist():
+                        add_id_to_retry_queue(request_id)
+                    return False
+
+            # كائنات الطلبات تُنشأ فقط للعناقيد التي وجدت رحلة أو سائقاً، ولما بقي منها معلقاً
+            group = batch.instances(rows)
+            if not group:
+                return False
+            bookings   = [r for r in group if isinstance(r, CasheBooking)]
+            deliveries = [r for r in group if isinstance(r, CasheItemDelivery)]
+            from_loc = group[0].from_location
+            to_loc   = group[0].to_location
+
+            # إذا لا توجد رحلة، ننشئ رحلة جديدة
+            if not trip:
                 vehicle = driver.vehicles.first()
                 trip = Trip.objects.create(
                     from_location=from_loc,
@@ -191,8 +254,8 @@ class Command(BaseCommand):
                     related_object_id=trip.id
                 )
 
-            # إضافة الحجوزات
-            seats_used = trip.vehicle.capacity - trip.available_seats
+            # إضافة الحجوزات (كل حجز يحدّث عدّاد مقاعد الرحلة ذرياً عند حفظه)
+            seats_used = trip.booked_seats
             added = False
 
             for b in bookings:
@@ -246,11 +309,9 @@ class Command(BaseCommand):
                 except Exception:
                     add_to_retry_queue(d)
 
-            # تحديث حالة الرحلة
+            # تحديث حالة الرحلة؛ المقاعد وحالة الامتلاء يضبطها العدّاد
             if added:
-                trip.available_seats = trip.vehicle.capacity - seats_used
-                trip.status = (
-                    Trip.Status.FULL
-                    if trip.available_seats <= 0 else Trip.Status.IN_PROGRESS
+                Trip.objects.filter(pk=trip.pk, status=Trip.Status.PENDING).update(
+                    status=Trip.Status.IN_PROGRESS
                 )
-                trip.save(update_fields=['available_seats', 'status'])
+        return added
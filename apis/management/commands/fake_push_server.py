@@ -0,0 +1,107 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.notifications = 0
+
+    def add(self, notifications):
+        with self.lock:
+            self.requests += 1
+            self.notifications += notifications
+
+    def take(self):
+        with self.lock:
+            snapshot = (self.requests, self.notifications)
+            self.requests = self.notifications = 0
+        return snapshot
+
+
+def _response(payload):
+    """رد بصيغة FCM HTTP إذا وُجد registration_ids، وإلا بصيغة OneSignal. التوكن الذي يبدأ بـ invalid يُرفض."""
+    if 'registration_ids' in payload:
+        tokens = payload['registration_ids']
+        results = [
+            {'error': 'NotRegistered'} if token.startswith('invalid') else {'message_id': uuid.uuid4().hex}
+            for token in tokens
+        ]
+        failure = sum(1 for item in results if 'error' in item)
+        return len(tokens), {
+            'multicast_id': random.getrandbits(53),
+            'success': len(tokens) - failure,
+            'failure': failure,
+            'results': results,
+        }
+
+    tokens = payload.get('include_subscription_ids') or []
+    invalid = [token for token in tokens if token.startswith('invalid')]
+    body = {'id': str(uuid.uuid4()), 'recipients': len(tokens) - len(invalid)}
+    if invalid:
+        body['errors'] = {'invalid_player_ids': invalid}
+    return max(len(tokens), 1), body
+
+
+class Command(BaseCommand):
+    help = '📡 خادم إشعارات وهمي محلي يحاكي FCM HTTP و OneSignal لقياس سرعة الإرسال دون الاتصال بالمزود الحقيقي.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=20, help='زمن الرد بالميلي ثانية')
+        parser.add_argument('--error-rate', type=float, default=0, help='نسبة الطلبات التي تُرد بـ 503 (0 إلى 1)')
+
+    def handle(self, *args, **options):
+        stats = _Stats()
+        latency = options['latency'] / 1000
+        error_rate = options['error_rate']
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive حتى يظهر أثر مجمّع الاتصالات عند العميل
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                time.sleep(latency)
+                if random.random() < error_rate:
+                    status, body, count = 503, {'error': 'Unavailable'}, 0
+                else:
+                    count, body = _response(payload)
+                    status = 200
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                stats.add(count)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((options['host'], options['port']), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://{options['host']}:{options['port']}/"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ الخادم الوهمي يعمل على {url} (زمن الرد {options['latency']:.0f} ms)\n"
+            f"   FCM_HTTP_URL={url} أو ONESIGNAL_API_URL={url}"
+        ))
+
+        try:
+            while True:
+                time.sleep(5)
+                requests, notifications = stats.take()
+                if requests:
+                    self.stdout.write(f"📈 {requests / 5:.0f} طلب/ث   {notifications / 5:.0f} إشعار/ث")
+        except KeyboardInterrupt:
+            self.stdout.write("👋 إيقاف الخادم")
+        finally:
+            server.shutdown()
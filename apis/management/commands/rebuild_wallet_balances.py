@@ -0,0 +1,101 @@
+import logging
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from apis.ledger import EXCLUDED_STATUSES, lock_transactions, opening_snapshots, signed_amount_expression
+from apis.models import Transaction, Wallet, WalletSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def _take(rows, pending, wallet_id):
+    """يتقدم في تيار (wallet_id, value) المرتب حتى wallet_id؛ يُرجع (قيمة المحفظة أو None، الصف التالي)."""
+    while pending and pending[0] < wallet_id:
+        pending = next(rows, None)
+    if pending and pending[0] == wallet_id:
+        return pending[1], next(rows, None)
+    return None, pending
+
+
+class Command(BaseCommand):
+    help = '🧾 إعادة بناء أرصدة المحافظ من سجل العمليات في مرور واحد ومقارنتها بالأرصدة المخزنة.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true',
+                            help='تصحيح أرصدة المحافظ المختلفة عن السجل')
+        parser.add_argument('--snapshot', action='store_true',
+                            help='حفظ لقطة رصيد لكل محفظة عند آخر عملية مقروءة '
+                                 '(يمنع إدراج عمليات جديدة طوال الفحص حتى لا تفوت اللقطة عملية لم تُثبَّت)')
+        parser.add_argument('--chunk_size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        # كل القراءات ضمن لقطة واحدة متسقة من قاعدة البيانات
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                if options['snapshot']:
+                    # قبل أول قراءة، حتى تشمل لقطة القراءة كل عملية معرّفها حتى الحد
+                    try:
+                        lock_transactions(cursor)
+                    except OperationalError:
+                        raise CommandError("⏳ معاملة تُدرج عمليات لم تنتهِ بعد، أعد المحاولة لاحقاً")
+            watermark = Transaction.objects.aggregate(m=Max('id'))['m'] or 0
+
+            # كل محفظة تبدأ من لقطتها الافتتاحية (رصيدها قبل بدء السجل) وتُجمع العمليات اللاحقة لها فقط
+            opening_id = opening_snapshots().filter(wallet_id=OuterRef('wallet_id')).values('last_transaction_id')[:1]
+            openings = (
+                opening_snapshots().values_list('wallet_id', 'balance').iterator(chunk_size=chunk_size)
+            )
+            totals = (
+                Transaction.objects.filter(id__lte=watermark, id__gt=Coalesce(Subquery(opening_id), 0))
+                .exclude(status__in=EXCLUDED_STATUSES)
+                .order_by('wallet_id')
+                .values_list('wallet_id')
+                .annotate(total=Sum(signed_amount_expression()))
+                .iterator(chunk_size=chunk_size)
+            )
+            wallets = Wallet.objects.order_by('pk').values_list('pk', 'balance').iterator(chunk_size=chunk_size)
+
+            drift, snapshots, scanned = [], [], 0
+            pending_total, pending_opening = next(totals, None), next(openings, None)
+            for wallet_id, balance in wallets:
+                scanned += 1
+                # دمج تسلسلي للتيارات الثلاثة المرتبة حسب معرّف المحفظة
+                opening, pending_opening = _take(openings, pending_opening, wallet_id)
+                total, pending_total = _take(totals, pending_total, wallet_id)
+                rebuilt = (opening or Decimal('0')) + (total or Decimal('0'))
+
+                if rebuilt != balance:
+                    drift.append((wallet_id, balance, rebuilt))
+                if options['snapshot']:
+                    snapshots.append(WalletSnapshot(
+                        wallet_id=wallet_id, balance=rebuilt, last_transaction_id=watermark
+                    ))
+                    if len(snapshots) >= chunk_size:
+                        WalletSnapshot.objects.bulk_create(snapshots)
+                        snapshots = []
+
+            if snapshots:
+                WalletSnapshot.objects.bulk_create(snapshots)
+
+        self.stdout.write(self.style.NOTICE(
+            f"🔎 تم فحص {scanned} محفظة حتى العملية {watermark}، والمختلفة: {len(drift)}"
+        ))
+        for wallet_id, balance, rebuilt in drift[:50]:
+            self.stdout.write(f"  المحفظة {wallet_id}: المخزن {balance} ≠ السجل {rebuilt}")
+
+        if not options['apply'] or not drift:
+            return
+
+        fixed = 0
+        for wallet_id, balance, rebuilt in drift:
+            # لا نصحح إلا إذا لم يتغير الرصيد منذ القراءة، حتى لا نمحو عملية حية
+            fixed += Wallet.objects.filter(pk=wallet_id, balance=balance).update(balance=rebuilt)
+        logger.info(f"🧾 تم تصحيح {fixed} من {len(drift)} محفظة من سجل العمليات")
+        self.stdout.write(self.style.SUCCESS(f"✅ تم تصحيح {fixed} من {len(drift)} محفظة."))
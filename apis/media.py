@@ -0,0 +1,179 @@
+# File: apis/media.py
+"""
+خدمة ملفات الوسائط والملفات الثابتة بدعم الطلبات الجزئية والطلبات الشرطية.
+
+- ETag و Last-Modified مع 304 عند عدم التغيير.
+- Range بصيغة bytes=a-b (نطاق واحد) مع 206، حتى يعمل تقديم/تأخير ملفات mp4/mp3؛
+  النطاقات المتعددة تُتجاهل ويُرسل الملف كاملاً.
+- الملفات المعنونة بالمحتوى (البصمة في الاسم) تُرسل مع Cache-Control طويل و immutable.
+- إذا ضُبط MEDIA_ACCEL_REDIRECT_PREFIX يسلّم Django الملف إلى nginx عبر X-Accel-Redirect
+  فيتولى nginx الإرسال بـ sendfile ولا يبقى عامل التطبيق مشغولاً طوال التحميل، وهذا هو المسار
+  المقصود في الإنتاج. بدونه يُرسل FileResponse الملف: تحت daphne (ASGI) لا يوجد sendfile، فيُقرأ
+  الملف على كتل FILE_BLOCK_SIZE تمر كل منها عبر حلقة الأحداث؛ و sendfile عبر wsgi.file_wrapper
+  متاح فقط عند التشغيل تحت خادم WSGI مثل gunicorn.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+DEFAULT_MAX_AGE = 60 * 60
+# كتل أكبر من 4 KB الافتراضية تقلل التنقل بين خيط القراءة وحلقة الأحداث تحت ASGI
+FILE_BLOCK_SIZE = 512 * 1024
+
+# اسم فيه بصمة: ملفات collectstatic (name.0123456789ab.css) أو المرفقات حسب SHA-256
+HASHED_NAME_RE = re.compile(r'(\.[0-9a-f]{12}\.[^/.]+$)|(/[0-9a-f]{64}(\.[^/.]+)?$)')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# نطاق صحيح الصيغة لكنه يبدأ بعد نهاية الملف: يُرد عليه بـ 416
+UNSATISFIABLE = object()
+
+
+class _RangeFile:
+    """
+    يقيّد القراءة من ملف مفتوح بعدد بايتات محدد بدءاً من موضعه الحالي.
+    يبقي fileno() حتى يستطيع خادم WSGI إرسال النطاق بـ sendfile دون نسخه إلى الذاكرة.
+    """
+
+    def __init__(self, fh, length):
+        self._fh = fh
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fh.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self._fh.fileno()
+
+    def close(self):
+        self._fh.close()
+
+
+def _etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _parse_range(header, size):
+    """
+    يُرجع (start, end) شاملاً، أو UNSATISFIABLE إذا وقع النطاق كله خارج الملف.
+    الصيغة غير المفهومة والنطاقات المتعددة (bytes=0-1,5-9) تُرجع None فيُتجاهل Range ويُرسل الملف كاملاً.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # آخر N بايت
+        length = int(end)
+        if length == 0 or size == 0:
+            return UNSATISFIABLE
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        return UNSATISFIABLE
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(mtime) <= since
+
+
+def serve_file(request, root, path, accel_location):
+    """
+    يخدم path من داخل root مع دعم Range والطلبات الشرطية وترويسات التخزين المؤقت.
+    accel_location اسم المجلد تحت MEDIA_ACCEL_REDIRECT_PREFIX الذي يقابل root في إعداد nginx.
+    """
+    try:
+        full_path = safe_join(root, path)
+    except (SuspiciousFileOperation, ValueError):
+        raise Http404
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+
+    etag = _etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+            if HASHED_NAME_RE.search('/' + path)
+            else f"public, max-age={DEFAULT_MAX_AGE}"
+        ),
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '')
+    if prefix:
+        # nginx يتولى Range و sendfile من مساره الداخلي
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = '/'.join(
+            (prefix.rstrip('/'), accel_location, quote(os.path.relpath(full_path, root)))
+        )
+        for key, value in headers.items():
+            response[key] = value
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is UNSATISFIABLE:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+    fh = open(full_path, 'rb')
+    if byte_range:
+        start, end = byte_range
+        fh.seek(start)
+        response = FileResponse(_RangeFile(fh, end - start + 1), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = end - start + 1
+    else:
+        response = FileResponse(fh, content_type=content_type)
+    response.block_size = FILE_BLOCK_SIZE
+    for key, value in headers.items():
+        response[key] = value
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    return serve_file(request, settings.MEDIA_ROOT, path, 'media')
+
+
+@require_safe
+def serve_static(request, path):
+    return serve_file(request, settings.STATIC_ROOT, path, 'static')
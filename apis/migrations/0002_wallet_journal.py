@@ -0,0 +1,62 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def seed_opening_snapshots(apps, schema_editor):
+    """
+    الأرصدة الحالية غيّرتها إشارات التحويل والمكافآت دون قيود في السجل، فتُحفظ لكل محفظة لقطة افتتاحية
+    برصيدها الحالي حتى آخر عملية موجودة، ويُحسب السجل بعدها من هذه اللقطة لا من الصفر.
+    """
+    Transaction = apps.get_model('apis', 'Transaction')
+    Wallet = apps.get_model('apis', 'Wallet')
+    WalletSnapshot = apps.get_model('apis', 'WalletSnapshot')
+
+    last_transaction_id = Transaction.objects.aggregate(m=Max('id'))['m'] or 0
+    WalletSnapshot.objects.bulk_create(
+        (
+            WalletSnapshot(wallet_id=wallet_id, balance=balance, last_transaction_id=last_transaction_id)
+            for wallet_id, balance in Wallet.objects.values_list('pk', 'balance').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='الرصيد')),
+                ('last_transaction_id', models.BigIntegerField(verbose_name='آخر عملية مشمولة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+            ],
+            options={
+                'verbose_name': 'لقطة رصيد',
+                'verbose_name_plural': 'لقطات الأرصدة',
+                'ordering': ['-last_transaction_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['wallet', 'id'], name='apis_transa_wallet__d03ffd_idx'),
+        ),
+        migrations.AddField(
+            model_name='walletsnapshot',
+            name='wallet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='apis.wallet', verbose_name='المحفظة'),
+        ),
+        migrations.AddIndex(
+            model_name='walletsnapshot',
+            index=models.Index(fields=['wallet', '-last_transaction_id'], name='apis_wallet_wallet__f542c9_idx'),
+        ),
+        migrations.RunPython(seed_opening_snapshots, migrations.RunPython.noop),
+    ]
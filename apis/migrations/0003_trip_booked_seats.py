@@ -0,0 +1,32 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0002_wallet_journal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='booked_seats',
+            field=models.PositiveIntegerField(default=0, verbose_name='عدد المقاعد المحجوزة'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE apis_trip AS t SET booked_seats = b.total
+                FROM (
+                    SELECT trip_id, SUM(
+                        CASE WHEN status <> 'cancelled' AND jsonb_typeof(seats) = 'array'
+                             THEN jsonb_array_length(seats) ELSE 0 END
+                    ) AS total
+                    FROM apis_booking GROUP BY trip_id
+                ) AS b
+                WHERE b.trip_id = t.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0003_trip_booked_seats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='عدد التقييمات'),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, verbose_name='مجموع التقييمات'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE apis_driver AS d
+                SET rating_sum = r.total, rating_count = r.cnt, rating = ROUND(r.total::numeric / r.cnt, 2)
+                FROM (
+                    SELECT driver_id, SUM(rating) AS total, COUNT(*) AS cnt
+                    FROM apis_rating GROUP BY driver_id
+                ) AS r
+                WHERE r.driver_id = d.id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0004_driver_rating_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0, verbose_name='آخر رسالة مقروءة')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='غير المقروءة')),
+            ],
+            options={
+                'verbose_name': 'مؤشر قراءة',
+                'verbose_name_plural': 'مؤشرات القراءة',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'id'], name='apis_messag_chat_id_1a63fc_idx'),
+        ),
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='chat',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='apis.chat', verbose_name='المحادثة'),
+        ),
+        migrations.AddField(
+            model_name='chatreadcursor',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_read_cursors', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم'),
+        ),
+        migrations.AddIndex(
+            model_name='chatreadcursor',
+            index=models.Index(fields=['user', 'chat'], name='apis_chatre_user_id_4d5aab_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatreadcursor',
+            constraint=models.UniqueConstraint(fields=('chat', 'user'), name='unique_chat_read_cursor'),
+        ),
+        migrations.RunSQL(
+            sql="""
+                INSERT INTO apis_chatreadcursor (chat_id, user_id, last_read_message_id, unread_count)
+                SELECT p.chat_id, p.user_id,
+                    COALESCE((
+                        SELECT MAX(m.id) FROM apis_message m
+                        WHERE m.chat_id = p.chat_id AND (m.is_read OR m.sender_id = p.user_id)
+                    ), 0),
+                    (
+                        SELECT COUNT(*) FROM apis_message m
+                        WHERE m.chat_id = p.chat_id AND NOT m.is_read AND m.sender_id <> p.user_id
+                    )
+                FROM apis_chat_participants p
+                ON CONFLICT DO NOTHING
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
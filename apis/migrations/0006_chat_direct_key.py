@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0005_chat_read_cursors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='direct_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunSQL(
+            # المحادثات ذات المشاركَين؛ عند التكرار يأخذ المفتاحَ أقدمُها
+            sql="""
+                UPDATE apis_chat AS c SET direct_key = p.pair_key
+                FROM (
+                    SELECT DISTINCT ON (pair_key) chat_id, pair_key
+                    FROM (
+                        SELECT chat_id, MIN(user_id) || ':' || MAX(user_id) AS pair_key
+                        FROM apis_chat_participants
+                        GROUP BY chat_id
+                        HAVING COUNT(*) = 2
+                    ) AS pairs
+                    ORDER BY pair_key, chat_id
+                ) AS p
+                WHERE c.id = p.chat_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:46
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0006_chat_direct_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='البصمة')),
+                ('file', models.FileField(max_length=255, upload_to='', verbose_name='الملف')),
+                ('size', models.BigIntegerField(verbose_name='الحجم')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='نوع المحتوى')),
+                ('thumbnail', models.FileField(blank=True, max_length=255, upload_to='', verbose_name='الصورة المصغرة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+            ],
+            options={
+                'verbose_name': 'محتوى مرفق',
+                'verbose_name_plural': 'محتويات المرفقات',
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='apis.attachmentblob', verbose_name='المرفق'),
+        ),
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاريخ التحديث')),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255, verbose_name='اسم الملف')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='نوع المحتوى')),
+                ('total_size', models.BigIntegerField(verbose_name='الحجم الكلي')),
+                ('received_bytes', models.BigIntegerField(default=0, verbose_name='المستلم')),
+                ('status', models.CharField(choices=[('uploading', 'قيد الرفع'), ('complete', 'مكتمل')], default='uploading', max_length=20, verbose_name='الحالة')),
+                ('blob', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to='apis.attachmentblob', verbose_name='المحتوى')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to=settings.AUTH_USER_MODEL, verbose_name='المستخدم')),
+            ],
+            options={
+                'verbose_name': 'رفع مرفق',
+                'verbose_name_plural': 'رفع المرفقات',
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='apis_attach_status_97e836_idx')],
+            },
+        ),
+    ]
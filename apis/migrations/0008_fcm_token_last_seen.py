@@ -0,0 +1,25 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:52
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0007_attachment_uploads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fcmtoken',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last Seen'),
+        ),
+        migrations.AddIndex(
+            model_name='fcmtoken',
+            index=models.Index(fields=['last_seen'], name='apis_fcmtok_last_se_62a519_idx'),
+        ),
+    ]
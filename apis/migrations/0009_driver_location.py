@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0008_fcm_token_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='driver',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='خط العرض'),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='وقت آخر موقع'),
+        ),
+        migrations.AddField(
+            model_name='driver',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='خط الطول'),
+        ),
+        migrations.RunSQL(
+            # السائقون الذين يحمل where_location لديهم إحداثيات بصيغة "lat,lon"
+            sql="""
+                UPDATE apis_driver
+                SET latitude = split_part(where_location, ',', 1)::double precision,
+                    longitude = split_part(where_location, ',', 2)::double precision
+                WHERE where_location ~ '^\\s*-?\\d+(\\.\\d+)?\\s*,\\s*-?\\d+(\\.\\d+)?\\s*$';
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
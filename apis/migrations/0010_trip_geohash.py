@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:01
+
+from django.db import migrations, models
+
+
+def backfill_trip_geohash(apps, schema_editor):
+    from apis.geohash import encode
+
+    Trip = apps.get_model('apis', 'Trip')
+    batch = []
+    for trip in Trip.objects.only('pk', 'from_location', 'to_location').iterator(chunk_size=2000):
+        for prefix in ('from', 'to'):
+            try:
+                lat, lon = map(float, getattr(trip, f'{prefix}_location').split(','))
+            except ValueError:
+                continue
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                setattr(trip, f'{prefix}_lat', lat)
+                setattr(trip, f'{prefix}_lon', lon)
+                setattr(trip, f'{prefix}_geohash', encode(lat, lon))
+        batch.append(trip)
+        if len(batch) >= 2000:
+            Trip.objects.bulk_update(batch, ['from_lat', 'from_lon', 'from_geohash', 'to_lat', 'to_lon', 'to_geohash'])
+            batch = []
+    if batch:
+        Trip.objects.bulk_update(batch, ['from_lat', 'from_lon', 'from_geohash', 'to_lat', 'to_lon', 'to_geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0009_driver_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='from_geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='from_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='from_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='to_geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='to_lat',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='to_lon',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['from_geohash'], name='trip_from_geohash_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.RunPython(backfill_trip_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:06
+
+import datetime
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0010_trip_geohash'),
+    ]
+
+    operations = [
+        # الطلبات الموجودة قبل الحقل ينتظر بعضها منذ زمن غير معروف، فتُعطى تاريخاً قديماً ثابتاً
+        # لتُعامل كأقدم الطلبات في apis.priority بدل أن يبدأ عمر انتظارها من لحظة الترحيل
+        migrations.AddField(
+            model_name='cashebooking',
+            name='created_at',
+            field=models.DateTimeField(
+                auto_now_add=True,
+                default=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc),
+                verbose_name='تاريخ الإنشاء',
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='cashebooking',
+            index=models.Index(fields=['status', 'created_at'], name='apis_casheb_status_e12932_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='casheitemdelivery',
+            index=models.Index(fields=['status', 'urgent', 'created_at'], name='apis_cashei_status_7bfe0b_idx'),
+        ),
+    ]
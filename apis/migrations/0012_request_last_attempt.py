@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apis', '0011_request_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cashebooking',
+            name='last_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر محاولة جدولة'),
+        ),
+        migrations.AddField(
+            model_name='casheitemdelivery',
+            name='last_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر محاولة جدولة'),
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator, RegexValidator, FileExtensionValidator
 from django.core.exceptions import ValidationError
 from django.db.models.signals import post_delete
@@ -79,16 +81,18 @@ class Wallet(BaseModel):
     is_locked = models.BooleanField(default=False, verbose_name=_("محظورة"))
 
     def credit(self, amount):
-        if amount > 0:
-            self.balance += amount
-            self.save(update_fields=['balance'])
+        from .ledger import credit
+        if credit(self.pk, amount):
+            self._expire_balance()
 
     def debit(self, amount):
-        if amount > 0 and self.balance >= amount:
-            self.balance -= amount
-            self.save(update_fields=['balance'])
-        else:
-            raise ValueError(_("رصيد غير كافٍ."))
+        from .ledger import debit
+        debit(self.pk, amount)
+        self._expire_balance()
+
+    def _expire_balance(self):
+        # الرصيد تغيّر في قاعدة البيانات مباشرة، فنحذف القيمة المحلية ليُعاد تحميلها عند الحاجة فقط
+        self.__dict__.pop('balance', None)
 
     def __str__(self):
         return f"{self.user.username} - {self.balance} {self.currency}"
@@ -127,10 +131,17 @@ class Transaction(BaseModel):
     metadata = models.JSONField(default=dict, blank=True, verbose_name=_("بيانات إضافية"))
 
     def save(self, *args, **kwargs):
+        if self.pk and settings.WALLET_LEDGER_MODE == 'journal':
+            raise ValidationError(_("سجل العمليات للإضافة فقط ولا يمكن تعديل عملية محفوظة."))
         if not self.reference_number:
             self.reference_number = str(uuid.uuid4()).split('-')[0].upper()
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        if settings.WALLET_LEDGER_MODE == 'journal':
+            raise ValidationError(_("سجل العمليات للإضافة فقط ولا يمكن حذف عملية."))
+        return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount} {self.wallet.currency}"
 
@@ -141,8 +152,31 @@ class Transaction(BaseModel):
         indexes = [
             models.Index(fields=['transaction_type']),
             models.Index(fields=['status']),
+            models.Index(fields=['wallet', 'id']),
+        ]
+
+
+class WalletSnapshot(models.Model):
+    """
+    لقطة دورية لرصيد المحفظة محسوبة من سجل العمليات حتى العملية last_transaction_id.
+    الرصيد الفعلي = آخر لقطة + مجموع العمليات اللاحقة لها.
+    """
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='snapshots', verbose_name=_("المحفظة"))
+    balance = models.DecimalField(max_digits=15, decimal_places=2, verbose_name=_("الرصيد"))
+    last_transaction_id = models.BigIntegerField(verbose_name=_("آخر عملية مشمولة"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("تاريخ الإنشاء"))
+
+    class Meta:
+        verbose_name = _("لقطة رصيد")
+        verbose_name_plural = _("لقطات الأرصدة")
+        ordering = ['-last_transaction_id']
+        indexes = [
+            models.Index(fields=['wallet', '-last_transaction_id']),
         ]
 
+    def __str__(self):
+        return f"{self.wallet_id} - {self.balance} @ {self.last_transaction_id}"
+
 # ============================
 # نموذج المركبة
 # ============================
@@ -224,6 +258,10 @@ class Driver(BaseModel):
         ]
     )
     where_location = models.CharField(max_length=255, verbose_name=_("وين"))
+    # آخر موقع مُرحَّل من مخزن المواقع (apis/locations.py)؛ الموقع الأحدث يكون في المخزن نفسه
+    latitude = models.FloatField(null=True, blank=True, verbose_name=_("خط العرض"))
+    longitude = models.FloatField(null=True, blank=True, verbose_name=_("خط الطول"))
+    location_updated_at = models.DateTimeField(null=True, blank=True, verbose_name=_("وقت آخر موقع"))
     license_number = models.CharField(
         max_length=100,
         unique=True,
@@ -239,6 +277,8 @@ class Driver(BaseModel):
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0)],
         verbose_name=_("التقييم")
     )
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name=_("مجموع التقييمات"))
+    rating_count = models.PositiveIntegerField(default=0, verbose_name=_("عدد التقييمات"))
     total_trips = models.IntegerField(default=0, verbose_name=_("إجمالي الرحلات"))
     is_available = models.BooleanField(default=True, verbose_name=_("متاح للرحلات"))
 
@@ -253,16 +293,57 @@ class Driver(BaseModel):
     def __str__(self):
         return f"{self.user.username} - {self.license_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_where_location = instance.__dict__.get('where_location')
+        return instance
+
+    def set_coordinates(self):
+        """
+        يحلّل where_location بصيغة "lat,lon" إلى latitude/longitude مثل Trip.set_coordinates، ويُرجع
+        أسماء الحقول المحدّثة. الموقع النصي الذي لا يحمل إحداثيات يترك آخر موقع معروف كما هو.
+        """
+        try:
+            lat, lon = map(float, self.where_location.split(','))
+        except (AttributeError, ValueError):
+            return []
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return []
+        self.latitude, self.longitude, self.location_updated_at = lat, lon, timezone.now()
+        return ['latitude', 'longitude', 'location_updated_at']
+
+    def save(self, *args, **kwargs):
+        # تعديل where_location من الواجهة أو لوحة الإدارة يحدّث الإحداثيات كما تفعل دفعات المواقع
+        update_fields = kwargs.get('update_fields')
+        derived = []
+        if (
+            'where_location' in self.__dict__
+            and self.where_location != getattr(self, '_loaded_where_location', None)
+            and (update_fields is None or 'where_location' in update_fields)
+        ):
+            derived = self.set_coordinates()
+            if derived and update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+        self._loaded_where_location = self.where_location
+        if derived:
+            from .locations import get_store
+
+            # مخزن المواقع هو المرجع للمجدول، فيُسجَّل فيه الموقع الجديد بعد تثبيته
+            position = (self.pk, self.latitude, self.longitude, self.location_updated_at.timestamp())
+            transaction.on_commit(lambda: get_store().update(*position))
+
     def update_rating(self):
         """
-        تحديث التقييم بناءً على متوسط التقييمات المتلقاة.
-        يجب استدعاء هذه الدالة بعد إضافة تقييم جديد.
+        إعادة حساب عدّادات التقييم ومتوسطه من جدول التقييمات باستعلام تجميعي واحد.
+        التقييمات الجديدة تحدّث العدّادات تلقائياً، وهذه الدالة لإصلاح الانحراف فقط.
         """
-        ratings = self.ratings.all()
-        if ratings.exists():
-            avg = sum(r.rating for r in ratings) / ratings.count()
-            self.rating = round(avg, 2)
-            self.save()
+        stats = self.ratings.aggregate(total=models.Sum('rating'), count=models.Count('pk'))
+        self.rating_sum = stats['total'] or 0
+        self.rating_count = stats['count']
+        self.rating = round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0.0
+        self.save(update_fields=['rating_sum', 'rating_count', 'rating'])
 
 
 # ============================
@@ -292,6 +373,7 @@ class Trip(models.Model):
         max_digits=10, decimal_places=2, null=True, blank=True, verbose_name=_("المسافة (كم)")
     )
     available_seats = models.IntegerField(default=0, verbose_name=_("عدد المقاعد المتاحة"))
+    booked_seats = models.PositiveIntegerField(default=0, verbose_name=_("عدد المقاعد المحجوزة"))
     price_per_seat = models.DecimalField(
         max_digits=10, decimal_places=2, null=True, blank=True, verbose_name=_("السعر لكل مقعد")
     )
@@ -317,6 +399,13 @@ class Trip(models.Model):
         verbose_name=_("إحداثيات المسار"),
         help_text=_("تنسيق JSON لإحداثيات المسار (خط الطول والعرض)")
     )
+    # تُحسب من from_location/to_location عند الحفظ للبحث عن الرحلات القريبة (apis/geohash.py)
+    from_lat = models.FloatField(null=True, blank=True, editable=False)
+    from_lon = models.FloatField(null=True, blank=True, editable=False)
+    to_lat = models.FloatField(null=True, blank=True, editable=False)
+    to_lon = models.FloatField(null=True, blank=True, editable=False)
+    from_geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
+    to_geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
 
     class Meta:
         verbose_name = _("رحلة")
@@ -324,27 +413,36 @@ class Trip(models.Model):
         indexes = [
             models.Index(fields=['departure_time']),
             models.Index(fields=['status']),
+            # varchar_pattern_ops حتى يستخدم LIKE 'prefix%' الفهرس مهما كان ترتيب قاعدة البيانات
+            models.Index(fields=['from_geohash'], name='trip_from_geohash_idx', opclasses=['varchar_pattern_ops']),
         ]
         ordering = ['-departure_time']
 
-    def update_availability(self):
-        """تحديث عدد المقاعد المتاحة وحالة الرحلة."""
-        total_booked = sum(
-            len(booking.seats) if isinstance(booking.seats, list) else 0
-            for booking in self.bookings.all()
-        )
-        vehicle = self.driver.vehicles.first() if self.driver else None
-        if vehicle:
-            self.available_seats = vehicle.capacity - total_booked
-        else:
-            self.available_seats = 0  # إذا لم يوجد مركبة
+    # حقول يملكها عدّاد المقاعد (apis.seats) ولا يكتبها الحفظ العادي لنسخة موجودة
+    COUNTER_FIELDS = ('booked_seats', 'available_seats', 'status')
 
-        if self.available_seats <= 0 and self.status != self.Status.FULL:
-            self.status = self.Status.FULL
-        elif self.available_seats > 0 and self.status == self.Status.FULL:
-            self.status = self.Status.PENDING
+    def set_coordinates(self):
+        """يحلّل from_location/to_location بصيغة "lat,lon" ويحدّث الإحداثيات و geohash."""
+        from .geohash import encode
 
-        self.save(update_fields=['available_seats', 'status'])
+        for prefix in ('from', 'to'):
+            try:
+                lat, lon = map(float, getattr(self, f'{prefix}_location').split(','))
+            except (AttributeError, ValueError):
+                lat = lon = None
+            geohash = encode(lat, lon) if lat is not None and -90 <= lat <= 90 and -180 <= lon <= 180 else ''
+            setattr(self, f'{prefix}_lat', lat if geohash else None)
+            setattr(self, f'{prefix}_lon', lon if geohash else None)
+            setattr(self, f'{prefix}_geohash', geohash)
+
+    def update_availability(self):
+        """
+        إعادة حساب المقاعد المتاحة وحالة الرحلة من الحجوزات الفعلية.
+        المسار المعتاد يحدّث العدّاد ذرياً عبر apis.seats، وهذه الدالة لإصلاح الانحراف فقط.
+        """
+        from .seats import reconcile_trip_seats
+        reconcile_trip_seats([self.pk])
+        self.refresh_from_db(fields=['booked_seats', 'available_seats', 'status'])
 
     def clean(self):
         """التحقق من صحة البيانات قبل الحفظ"""
@@ -361,11 +459,31 @@ class Trip(models.Model):
                 'price_per_seat': 'يجب أن يكون السعر قيمة موجبة'
             })
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
     def save(self, *args, **kwargs):
         """تجاوز دالة الحفظ لتطبيق القيود المنطقية قبل التخزين"""
         self.clean()
+        self.set_coordinates()
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # العدّادات يحدّثها apis.seats ذرياً، فلا يعيدها حفظ نسخة قديمة إلى قيمها المقروءة
+            # إلا إذا سمّاها المستدعي في update_fields، والحالة تُكتب فقط إذا غيّرها
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+                and field.name not in self.COUNTER_FIELDS
+            ]
+            if 'status' in self.__dict__ and self.status != getattr(self, '_loaded_status', None):
+                update_fields.append('status')
+            kwargs['update_fields'] = update_fields
         # تم إزالة منع التعديل أثناء التنفيذ للسماح بتعديل البيانات
         super().save(*args, **kwargs)
+        self._loaded_status = self.status
 
 class TripLog(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
@@ -432,6 +550,49 @@ class Booking(models.Model):
     def __str__(self):
         return f"{self.customer.user.username} - {self.trip} ({len(self.seats)} مقاعد)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_seats()
+        return instance
+
+    def _remember_seats(self):
+        from .seats import booking_seat_count
+        # ما يشغله الحجز حالياً في عدّاد الرحلة، لحساب الفرق عند الحفظ أو الحذف
+        if {'trip_id', 'seats', 'status'} <= self.__dict__.keys():
+            self._counted = (self.trip_id, booking_seat_count(self.seats, self.status))
+
+    def _stored_count(self):
+        """ما يشغله الحجز كما هو محفوظ، لنسخة حُمّلت بحقول مؤجلة (only/defer) فلم يُحسب لها _counted."""
+        from .seats import booking_seat_count
+
+        row = (
+            Booking.objects.select_for_update().filter(pk=self.pk)
+            .values_list('trip_id', 'seats', 'status').first()
+        )
+        return (row[0], booking_seat_count(row[1], row[2])) if row else (None, 0)
+
+    def save(self, *args, **kwargs):
+        """حفظ الحجز وتعديل عدّاد مقاعد الرحلة في نفس المعاملة."""
+        from .seats import booking_seat_count, release_seats, reserve_seats
+
+        new_count = booking_seat_count(self.seats, self.status)
+        with transaction.atomic():
+            counted = getattr(self, '_counted', None)
+            if counted is None and not self._state.adding:
+                counted = self._stored_count()
+            old_trip_id, old_count = counted or (None, 0)
+            super().save(*args, **kwargs)
+            if old_trip_id != self.trip_id:
+                if old_trip_id:
+                    release_seats(old_trip_id, old_count)
+                reserve_seats(self.trip_id, new_count)
+            elif new_count > old_count:
+                reserve_seats(self.trip_id, new_count - old_count)
+            elif new_count < old_count:
+                release_seats(self.trip_id, old_count - new_count)
+        self._counted = (self.trip_id, new_count)
+
 
 # ============================
 # نموذج تقييم الرحلة
@@ -487,6 +648,37 @@ class Rating(BaseModel):
     def __str__(self):
         return f"{self.rated_by.user.username} → {self.driver.user.username} ({self.rating}/5)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'driver_id', 'rating'} <= instance.__dict__.keys():
+            instance._counted = (instance.driver_id, instance.rating)
+        return instance
+
+    def _stored_count(self):
+        """السائق والتقييم كما هما محفوظان، لنسخة حُمّلت بحقول مؤجلة فلم يُحسب لها _counted."""
+        row = Rating.objects.select_for_update().filter(pk=self.pk).values_list('driver_id', 'rating').first()
+        return row or (None, 0)
+
+    def save(self, *args, **kwargs):
+        """حفظ التقييم وتحديث عدّادات السائق في نفس المعاملة."""
+        from .ratings import apply_rating_change
+
+        with transaction.atomic():
+            counted = getattr(self, '_counted', None)
+            if counted is None and not self._state.adding:
+                counted = self._stored_count()
+            old_driver_id, old_rating = counted or (None, 0)
+            super().save(*args, **kwargs)
+            if old_driver_id and old_driver_id != self.driver_id:
+                apply_rating_change(old_driver_id, -old_rating, -1)
+                apply_rating_change(self.driver_id, self.rating, 1)
+            elif old_driver_id:
+                apply_rating_change(self.driver_id, self.rating - old_rating, 0)
+            else:
+                apply_rating_change(self.driver_id, self.rating, 1)
+        self._counted = (self.driver_id, self.rating)
+
 
 # ============================
 # نموذج المحادثة والدردشة
@@ -507,6 +699,8 @@ class Chat(BaseModel):
         on_delete=models.SET_NULL,
         related_name='+'
     )
+    # مفتاح المحادثة الثنائية "<أصغر معرّف>:<أكبر معرّف>"، فريد ومفهرس؛ فارغ لغير الثنائية
+    direct_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = "محادثة"
@@ -520,8 +714,17 @@ class Chat(BaseModel):
         other = self.participants.exclude(id=self.last_message.sender.id if self.last_message else None).first()
         return f"محادثة مع {other.username if other else '...'}"
 
+    @staticmethod
+    def direct_key_for(user_id, other_user_id):
+        low, high = sorted((int(user_id), int(other_user_id)))
+        return f"{low}:{high}"
+
     def update_last_message(self):
-        last_msg = self.messages.order_by('-created_at').first()
+        """
+        إعادة حساب آخر رسالة من السجل؛ تُستخدم عند حذف آخر رسالة فقط،
+        أما الإرسال فيضبطها مباشرة في Message.save.
+        """
+        last_msg = self.messages.order_by('-id').first()
         Chat.objects.filter(id=self.id).update(
             last_message=last_msg,
             updated_at=last_msg.created_at if last_msg else self.updated_at
@@ -548,10 +751,28 @@ class Message(BaseModel):
         blank=True
     )
     is_read = models.BooleanField(default=False)
+    blob = models.ForeignKey(
+        'AttachmentBlob',
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='messages',
+        verbose_name=_("المرفق")
+    )
+
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=['chat', 'id']),
+        ]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.chat.update_last_message()
+        from .chats import record_message
+
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if created:
+                record_message(self)
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:30] if self.content else '📎 مرفق'}"
@@ -560,6 +781,103 @@ class Message(BaseModel):
     def __str__(self):
         return f"{self.user.username} Profile"
 
+
+class ChatReadCursor(models.Model):
+    """
+    مؤشر قراءة لكل (محادثة، مستخدم): آخر رسالة قرأها المستخدم وعدد الرسائل غير المقروءة بعدها.
+    يُحدَّث العدّاد عند الإرسال ويُصفَّر عند القراءة، فلا نعدّ الرسائل عند عرض قائمة المحادثات.
+    """
+    chat = models.ForeignKey(
+        Chat,
+        on_delete=models.CASCADE,
+        related_name='read_cursors',
+        verbose_name=_("المحادثة")
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='chat_read_cursors',
+        verbose_name=_("المستخدم")
+    )
+    last_read_message_id = models.BigIntegerField(default=0, verbose_name=_("آخر رسالة مقروءة"))
+    unread_count = models.PositiveIntegerField(default=0, verbose_name=_("غير المقروءة"))
+
+    class Meta:
+        verbose_name = _("مؤشر قراءة")
+        verbose_name_plural = _("مؤشرات القراءة")
+        constraints = [
+            models.UniqueConstraint(fields=['chat', 'user'], name='unique_chat_read_cursor'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'chat']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} @ {self.chat_id}: {self.unread_count}"
+
+
+class AttachmentBlob(models.Model):
+    """
+    محتوى مرفق مخزّن مرة واحدة حسب بصمته SHA-256؛ الرسائل التي ترسل نفس الملف تشير إلى نفس الصف.
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name=_("البصمة"))
+    file = models.FileField(max_length=255, verbose_name=_("الملف"))
+    size = models.BigIntegerField(verbose_name=_("الحجم"))
+    content_type = models.CharField(max_length=100, blank=True, verbose_name=_("نوع المحتوى"))
+    thumbnail = models.FileField(max_length=255, blank=True, verbose_name=_("الصورة المصغرة"))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("تاريخ الإنشاء"))
+
+    class Meta:
+        verbose_name = _("محتوى مرفق")
+        verbose_name_plural = _("محتويات المرفقات")
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} B)"
+
+
+class AttachmentUpload(BaseModel):
+    """
+    رفع مرفق مجزأ قابل للاستئناف: تُلحق الأجزاء بملف مؤقت على القرص حتى يكتمل الحجم المعلن،
+    ثم يُنقل الملف إلى AttachmentBlob (أو يُربط بالموجود إن تطابقت البصمة).
+    """
+    class Status(models.TextChoices):
+        UPLOADING = 'uploading', _("قيد الرفع")
+        COMPLETE = 'complete', _("مكتمل")
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='attachment_uploads',
+        verbose_name=_("المستخدم")
+    )
+    filename = models.CharField(max_length=255, verbose_name=_("اسم الملف"))
+    content_type = models.CharField(max_length=100, blank=True, verbose_name=_("نوع المحتوى"))
+    total_size = models.BigIntegerField(verbose_name=_("الحجم الكلي"))
+    received_bytes = models.BigIntegerField(default=0, verbose_name=_("المستلم"))
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.UPLOADING, verbose_name=_("الحالة")
+    )
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='uploads',
+        verbose_name=_("المحتوى")
+    )
+
+    class Meta:
+        verbose_name = _("رفع مرفق")
+        verbose_name_plural = _("رفع المرفقات")
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.received_bytes}/{self.total_size})"
+
+
 # ============================
 # نموذج تذاكر الدعم الفني
 # ============================
@@ -644,6 +962,10 @@ class FCMToken(models.Model):
         blank=True,
         verbose_name=_("Device Information")
     )
+    last_seen = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Last Seen")
+    )
     
     class Meta:
         verbose_name = _("FCM Token")
@@ -651,6 +973,7 @@ class FCMToken(models.Model):
         indexes = [
             models.Index(fields=['created_at']),
             models.Index(fields=['user']),
+            models.Index(fields=['last_seen']),
         ]
         ordering = ['-created_at']
 
@@ -726,19 +1049,37 @@ class Transfer(BaseModel):
         super().save(*args, **kwargs)
 
     def process_transfer(self):
+        from .ledger import journal, transfer
+
         if self.status != self.Status.PENDING:
             raise ValueError(_("لا يمكن معالجة تحويل غير قيد الانتظار."))
 
-        if self.from_wallet.balance < self.amount:
-            self.status = self.Status.FAILED
-            self.save(update_fields=['status'])
+        with transaction.atomic():
+            # الانتقال من PENDING مشروط لمنع معالجة نفس التحويل مرتين
+            claimed = Transfer.objects.filter(pk=self.pk, status=self.Status.PENDING).update(
+                status=self.Status.COMPLETED
+            )
+            if not claimed:
+                raise ValueError(_("لا يمكن معالجة تحويل غير قيد الانتظار."))
+            try:
+                transfer(self.from_wallet_id, self.to_wallet_id, self.amount)
+                journal([
+                    {
+                        'wallet_id': wallet_id,
+                        'transaction_type': 'transfer',
+                        'amount': self.amount,
+                        'metadata': {'direction': direction, 'transfer_code': self.transfer_code},
+                    }
+                    for wallet_id, direction in ((self.from_wallet_id, 'out'), (self.to_wallet_id, 'in'))
+                ])
+                self.status = self.Status.COMPLETED
+            except ValueError:
+                Transfer.objects.filter(pk=self.pk).update(status=self.Status.FAILED)
+                self.status = self.Status.FAILED
+
+        if self.status == self.Status.FAILED:
             raise ValueError(_("رصيد المرسل غير كافٍ."))
 
-        self.from_wallet.debit(self.amount)
-        self.to_wallet.credit(self.amount)
-        self.status = self.Status.COMPLETED
-        self.save(update_fields=['status'])
-
     def __str__(self):
         return f"تحويل {self.amount} من {self.from_wallet.user.username} إلى {self.to_wallet.user.username}"
 
@@ -989,12 +1330,16 @@ class CasheBooking(models.Model):
         blank=True,
         verbose_name=_("ملاحظات إضافية")
     )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("تاريخ الإنشاء"))
+    # آخر جولة جدولة حاولت إسناده دون نجاح؛ لا يُعاد تحميله قبل TRIP_SCHEDULER_RETRY_BACKOFF
+    last_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name=_("آخر محاولة جدولة"))
 
     class Meta:
         verbose_name = _("حجز مسبق")
         verbose_name_plural = _("الحجوزات المسبقة")
         indexes = [
             models.Index(fields=['departure_time']),
+            models.Index(fields=['status', 'created_at']),
         ]
 
     def __str__(self):
@@ -1045,12 +1390,14 @@ class CasheItemDelivery(BaseModel):
         default=Status.PENDING,
         verbose_name=_("الحالة")
     )
+    last_attempt_at = models.DateTimeField(null=True, blank=True, verbose_name=_("آخر محاولة جدولة"))
 
     class Meta:
         verbose_name = _("طلب توصيل مسبق")
         verbose_name_plural = _("طلبات التوصيل المسبقة")
         indexes = [
             models.Index(fields=['urgent']),
+            models.Index(fields=['status', 'urgent', 'created_at']),
         ]
 
     def __str__(self):
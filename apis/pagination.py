@@ -0,0 +1,65 @@
+# File: apis/pagination.py
+"""
+ترقيم بالمفتاح (keyset) لسجل الرسائل.
+
+بدلاً من OFFSET أو إرجاع السجل كاملاً، تُقرأ نافذة ثابتة الحجم قبل معرّف أو بعده
+عبر فهرس (chat, id)، فتبقى كلفة فتح محادثة طويلة مساوية لكلفة محادثة قصيرة.
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+
+class MessageKeysetPagination(BasePagination):
+    """
+    ?before_id=<id>  الرسائل الأقدم من id (تصفح للخلف)
+    ?after_id=<id>   الرسائل الأحدث من id (جلب الجديد)
+    ?limit=<n>       حجم النافذة
+    النتائج دائماً من الأحدث إلى الأقدم.
+    """
+    default_limit = 50
+    max_limit = 100
+
+    def _int_param(self, request, name):
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: _("يجب أن يكون رقماً صحيحاً.")})
+        if value < 0:
+            raise ValidationError({name: _("يجب أن يكون رقماً موجباً.")})
+        return value
+
+    def paginate_queryset(self, queryset, request, view=None):
+        before_id = self._int_param(request, 'before_id')
+        after_id = self._int_param(request, 'after_id')
+        if before_id is not None and after_id is not None:
+            raise ValidationError(_("استخدم before_id أو after_id وليس كليهما."))
+        limit = min(self._int_param(request, 'limit') or self.default_limit, self.max_limit)
+
+        queryset = queryset.order_by()
+        if after_id is not None:
+            # أقدم limit رسالة بعد after_id، ثم نعكسها لتبقى من الأحدث إلى الأقدم
+            window = list(queryset.filter(id__gt=after_id).order_by('id')[:limit + 1])
+            self.has_more = len(window) > limit
+            window = window[:limit][::-1]
+        else:
+            if before_id is not None:
+                queryset = queryset.filter(id__lt=before_id)
+            window = list(queryset.order_by('-id')[:limit + 1])
+            self.has_more = len(window) > limit
+            window = window[:limit]
+
+        self.window = window
+        return window
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'has_more': self.has_more,
+            'newest_id': self.window[0].pk if self.window else None,
+            'oldest_id': self.window[-1].pk if self.window else None,
+        })
@@ -0,0 +1,95 @@
+# File: apis/payouts.py
+"""
+دفعات المكافآت والإيداعات الجماعية عبر عملية دفتر مجمّعة واحدة.
+"""
+import csv
+import io
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from . import ledger
+from .models import Bonus
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+def parse_credit_rows(rows):
+    """
+    يحوّل أسطر (user, amount) إلى قائمة (user_id, Decimal).
+    يقبل user كمعرّف رقمي أو اسم مستخدم، ويحلّ أسماء المستخدمين باستعلام واحد.
+    """
+    parsed, usernames = [], set()
+    for index, row in enumerate(rows, start=1):
+        if not row or not str(row[0]).strip():
+            continue
+        user, amount = str(row[0]).strip(), str(row[1]).strip() if len(row) > 1 else ''
+        try:
+            amount = Decimal(amount)
+        except InvalidOperation:
+            amount = None
+        # Decimal يقبل NaN و Infinity، ولا معنى لهما كمبلغ
+        if amount is None or not amount.is_finite():
+            raise ValueError(_("مبلغ غير صالح في السطر %(line)s.") % {'line': index})
+        if not user.isdigit():
+            usernames.add(user)
+        parsed.append((user, amount))
+
+    ids_by_username = dict(User.objects.filter(username__in=usernames).values_list('username', 'pk'))
+    unknown = sorted(usernames - set(ids_by_username))
+    if unknown:
+        raise ValueError(_("مستخدمون غير موجودين: %(users)s") % {'users': ', '.join(unknown[:20])})
+
+    return [
+        (int(user) if user.isdigit() else ids_by_username[user], amount)
+        for user, amount in parsed
+    ]
+
+
+def read_credit_csv(fileobj):
+    """يقرأ ملف CSV بعمودين (user, amount) مع تجاهل سطر العناوين إن وُجد."""
+    content = fileobj.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    rows = list(csv.reader(io.StringIO(content)))
+    if rows and rows[0] and rows[0][0].strip().lower() in ('user', 'user_id', 'username'):
+        rows = rows[1:]
+    return parse_credit_rows(rows)
+
+
+def award_bonuses(entries, reason='other', expiration_date=None):
+    """
+    يمنح مكافآت لقائمة (user_id, amount) دفعة واحدة:
+    bulk_create لصفوف Bonus معلَّمة كمعالجة، ثم إيداع مجمّع واحد مع عملية لكل مكافأة.
+    لا تمر هذه المكافآت بإشارة handle_bonus_creation لأن bulk_create لا يطلقها.
+    """
+    entries = list(entries)
+    with transaction.atomic():
+        bonuses = Bonus.objects.bulk_create(
+            [
+                Bonus(
+                    user_id=user_id,
+                    amount=amount,
+                    reason=reason,
+                    expiration_date=expiration_date,
+                    processed=True,
+                )
+                for user_id, amount in entries
+            ],
+            batch_size=1000,
+        )
+        created, missing = ledger.bulk_credit(
+            [(b.user_id, b.amount, {'bonus_id': b.pk}) for b in bonuses],
+            description=str(dict(Bonus._meta.get_field('reason').choices).get(reason, reason)),
+        )
+        if missing:
+            # لا نترك مكافآت معلَّمة كمعالجة دون إيداع
+            raise ValueError(_("مستخدمون بلا محفظة: %(users)s") % {'users': ', '.join(map(str, missing[:20]))})
+
+    logger.info(f"🎁 تم منح {len(bonuses)} مكافأة ({reason})")
+    return bonuses
+
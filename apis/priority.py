@@ -0,0 +1,83 @@
+# File: apis/priority.py
+"""
+ترتيب طلبات الجدولة حسب الأولوية.
+
+الأولوية (الأصغر أولاً) = (الفئة، وقت الإنشاء):
+    urgent  شحنة عاجلة، أو أي طلب تجاوز انتظاره TRIP_SCHEDULER_AGING_SECONDS حتى لا يُحرم طويلاً
+    normal  باقي الطلبات
+داخل الفئة الأقدم أولاً. كل جولة تأخذ من رأس الطابور حتى TRIP_SCHEDULER_ROUND_BUDGET طلباً فقط،
+والباقي ينتظر الجولة التالية. الطلب الذي حاولت جولة إسناده ولم تنجح يغيب عن الطابور لمدة
+TRIP_SCHEDULER_RETRY_BACKOFF، فلا تعيد الجولات اختيار نفس الطلبات القديمة بينما تنتظر الأحدث منها.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import CasheBooking, CasheItemDelivery
+from .request_batch import BOOKING, DELIVERY, RequestBatch, fetch
+from .stale_requests import booking_cutoff
+
+URGENT, NORMAL = 0, 1
+CLASS_NAMES = {URGENT: 'urgent', NORMAL: 'normal'}
+
+
+def _ordered(queryset, cutoff, has_urgent=False):
+    urgent = Q(created_at__lte=cutoff)
+    if has_urgent:
+        urgent |= Q(urgent=True)
+    return queryset.annotate(
+        priority=Case(
+            When(urgent, then=Value(URGENT)),
+            default=Value(NORMAL),
+            output_field=IntegerField(),
+        )
+    ).order_by('priority', 'created_at')
+
+
+def load_queue(budget):
+    """
+    يُرجع (batch، remaining): batch دفعة RequestBatch بحد أقصى budget طلب مرتبة حسب الأولوية،
+    و remaining عدد ما بقي للجولات التالية.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.TRIP_SCHEDULER_AGING_SECONDS)
+    retry = Q(last_attempt_at__isnull=True) | Q(
+        last_attempt_at__lt=now - timedelta(seconds=settings.TRIP_SCHEDULER_RETRY_BACKOFF)
+    )
+    # الحجوزات التي فات وقتها تنتظر منظّف الطلبات المنتهية ولا تدخل الجولات
+    bookings = CasheBooking.objects.filter(
+        retry, status=CasheBooking.Status.PENDING, departure_time__gte=booking_cutoff(now)
+    )
+    deliveries = CasheItemDelivery.objects.filter(retry, status=CasheItemDelivery.Status.PENDING)
+    # نفس ترتيب الجولة في SQL، فلا يُقرأ من كل جدول إلا ما قد يدخلها؛ وطلب زائد ليُعرف إن بقي شيء
+    rows = np.concatenate([
+        fetch(_ordered(bookings, cutoff), BOOKING, budget + 1),
+        fetch(_ordered(deliveries, cutoff, has_urgent=True), DELIVERY, budget + 1),
+    ])
+    order = np.lexsort((rows['created'], rows['priority']))
+    remaining = 0
+    if len(order) > budget:
+        remaining = bookings.count() + deliveries.count() - budget
+    return RequestBatch(rows[order[:budget]]), remaining
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct))]
+
+
+def wait_metrics(batch, now=None):
+    """
+    سطر لكل فئة أولوية: عدد الطلبات المأخوذة في الجولة ووقت انتظارها في الطابور (p50/p95/أقصى).
+    """
+    now = (now or timezone.now()).timestamp()
+    lines = []
+    for cls in np.unique(batch.rows['priority']).tolist():
+        values = np.sort(now - batch.rows['created'][batch.rows['priority'] == cls])
+        lines.append(
+            f"📊 [{CLASS_NAMES[cls]}] {len(values)} طلب، الانتظار p50 {_percentile(values, 0.5):.0f}ث "
+            f"p95 {_percentile(values, 0.95):.0f}ث أقصى {values[-1]:.0f}ث"
+        )
+    return lines
@@ -0,0 +1,246 @@
+# File: apis/push.py
+"""
+طبقة موحّدة لإرسال الإشعارات الفورية إلى الأجهزة.
+
+المزود يُختار من settings.PUSH_PROVIDER:
+    'fcm_admin'  Firebase Admin SDK (send_each_for_multicast، حتى 500 توكن في الدفعة)
+    'fcm_http'   واجهة FCM عبر HTTP بمفتاح الخادم (حتى 1000 توكن في الدفعة)
+    'onesignal'  OneSignal، والتوكنات المخزنة هي معرّفات اشتراك OneSignal
+كل مزود HTTP يملك جلسة واحدة بمجمّع اتصالات keep-alive، مع مهلة لكل طلب وعدد محاولات محدود،
+فأقصى زمن للدفعة معروف مسبقاً ولا يعلق من ينتظرها مهما أبطأ المزود.
+التوكنات التي يرفضها المزود نهائياً تُحذف من FCMToken.
+"""
+import logging
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import FCMToken
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _clean_data(data):
+    # FCM يقبل قيماً نصية فقط في data
+    return {key: str(value) for key, value in (data or {}).items() if value is not None}
+
+
+class PushProvider:
+    """الواجهة المشتركة؛ كل مزود ينفّذ _send_batch لدفعة لا تتجاوز max_batch."""
+
+    name = None
+    max_batch = 500
+
+    def send(self, tokens, title, body, data=None):
+        """
+        يرسل الإشعار إلى tokens على دفعات ويُرجع
+        {'success': عدد, 'failure': عدد, 'invalid_tokens': [توكنات يجب حذفها]}.
+        فشل دفعة لا يوقف الدفعات التالية.
+        """
+        result = {'success': 0, 'failure': 0, 'invalid_tokens': []}
+        data = _clean_data(data)
+        for batch in _chunks(list(tokens), self.max_batch):
+            try:
+                success, failure, invalid = self._send_batch(batch, title, body, data)
+            except Exception:
+                logger.exception(f"❌ فشل إرسال دفعة من {len(batch)} إشعار عبر {self.name}")
+                success, failure, invalid = 0, len(batch), []
+            result['success'] += success
+            result['failure'] += failure
+            result['invalid_tokens'].extend(invalid)
+        return result
+
+    def _send_batch(self, tokens, title, body, data):
+        raise NotImplementedError
+
+
+class HTTPPushProvider(PushProvider):
+    """أساس المزودين عبر HTTP: جلسة requests مشتركة بين الخيوط بمجمّع اتصالات ومحاولات محدودة."""
+
+    url = None
+
+    def __init__(self, url=None):
+        if url:
+            self.url = url
+        self.timeout = settings.PUSH_TIMEOUT
+        self.session = requests.Session()
+        self.session.headers.update(self.headers())
+        retry = Retry(
+            total=settings.PUSH_MAX_RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'POST'}),
+            # Retry-After قد يطلب انتظاراً طويلاً؛ نلتزم بالتراجع القصير حتى يبقى الزمن محدوداً
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.PUSH_POOL_SIZE,
+            max_retries=retry,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def headers(self):
+        return {'Content-Type': 'application/json'}
+
+    def post(self, payload):
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class FCMAdminProvider(PushProvider):
+    name = 'fcm_admin'
+    max_batch = 500
+
+    def _send_batch(self, tokens, title, body, data):
+        from firebase_admin import messaging
+        from .firebase import get_app
+
+        response = messaging.send_each_for_multicast(messaging.MulticastMessage(
+            tokens=tokens,
+            notification=messaging.Notification(title=title, body=body),
+            data=data,
+        ), app=get_app())
+        invalid = [
+            token for token, item in zip(tokens, response.responses)
+            if not item.success
+            and isinstance(item.exception, (messaging.UnregisteredError, messaging.SenderIdMismatchError))
+        ]
+        return response.success_count, response.failure_count, invalid
+
+
+class FCMHTTPProvider(HTTPPushProvider):
+    name = 'fcm_http'
+    max_batch = 1000
+    INVALID_ERRORS = ('NotRegistered', 'InvalidRegistration', 'MismatchSenderId')
+
+    def __init__(self, url=None):
+        self.url = settings.FCM_HTTP_URL
+        super().__init__(url)
+
+    def headers(self):
+        return {**super().headers(), 'Authorization': f"key={settings.FCM_SERVER_KEY}"}
+
+    def _send_batch(self, tokens, title, body, data):
+        result = self.post({
+            'registration_ids': tokens,
+            'notification': {'title': title, 'body': body},
+            'data': data,
+        })
+        invalid = [
+            token for token, item in zip(tokens, result.get('results', []))
+            if item.get('error') in self.INVALID_ERRORS
+        ]
+        return result.get('success', 0), result.get('failure', 0), invalid
+
+
+class OneSignalProvider(HTTPPushProvider):
+    name = 'onesignal'
+    max_batch = 2000
+
+    def __init__(self, url=None):
+        self.url = settings.ONESIGNAL_API_URL
+        super().__init__(url)
+
+    def headers(self):
+        return {**super().headers(), 'Authorization': f"Basic {settings.ONESIGNAL_API_KEY}"}
+
+    def payload(self, title, body, **target):
+        return {
+            'app_id': settings.ONESIGNAL_APP_ID,
+            'headings': {'en': title, 'ar': title},
+            'contents': {'en': body, 'ar': body},
+            **target,
+        }
+
+    def _send_batch(self, tokens, title, body, data):
+        result = self.post(self.payload(title, body, include_subscription_ids=tokens, data=data))
+        errors = result.get('errors')
+        invalid = errors.get('invalid_player_ids', []) if isinstance(errors, dict) else []
+        return len(tokens) - len(invalid), len(invalid), invalid
+
+    def broadcast(self, title, body, segments):
+        """إشعار عام لشرائح OneSignal؛ يُرجع رد OneSignal أو {'error': ...}."""
+        try:
+            return self.post(self.payload(title, body, included_segments=segments))
+        except requests.exceptions.RequestException as e:
+            return {'error': str(e)}
+
+    async def abroadcast(self, title, body, segments):
+        """
+        نفس broadcast دون حجز خيط أثناء انتظار OneSignal.
+        الإرسال العام نادر، فيُفتح عميل لكل استدعاء ويُغلق معه بدل عميل يبقى بلا إغلاق.
+        """
+        import httpx
+
+        transport = httpx.AsyncHTTPTransport(retries=settings.PUSH_MAX_RETRIES)
+        try:
+            async with httpx.AsyncClient(headers=self.headers(), timeout=self.timeout, transport=transport) as client:
+                response = await client.post(self.url, json=self.payload(title, body, included_segments=segments))
+                response.raise_for_status()
+                return response.json()
+        except httpx.HTTPError as e:
+            return {'error': str(e)}
+
+
+PROVIDERS = {
+    provider.name: provider
+    for provider in (FCMAdminProvider, FCMHTTPProvider, OneSignalProvider)
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name=None):
+    """نسخة واحدة لكل مزود في العملية حتى تُعاد استخدام اتصالاته."""
+    name = name or settings.PUSH_PROVIDER
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                provider = _providers[name] = PROVIDERS[name]()
+    return provider
+
+
+def _send(tokens, title, message, data, target):
+    provider = get_provider()
+    result = provider.send(tokens, title, message, data)
+    if result['invalid_tokens']:
+        FCMToken.objects.filter(token__in=result['invalid_tokens']).delete()
+    logger.info(
+        f"📬 {provider.name}: {result['success']} نجح، {result['failure']} فشل، "
+        f"{len(result['invalid_tokens'])} توكن محذوف لـ {target}"
+    )
+    return result
+
+
+def send_to_user(user, title, message, data=None):
+    """يرسل إشعاراً إلى كل أجهزة المستخدم ويحذف التوكنات التي رفضها المزود."""
+    tokens = list(FCMToken.objects.filter(user=user).values_list('token', flat=True))
+    if not tokens:
+        logger.info(f"🚫 لا توجد توكنات إشعارات للمستخدم {user}")
+        return None
+    return _send(tokens, title, message, data, f"المستخدم {user}")
+
+
+def send_to_users(user_ids, title, message, data=None):
+    """نفس الإشعار لعدة مستخدمين في دفعات multicast مشتركة بدلاً من طلب لكل مستخدم."""
+    tokens = list(FCMToken.objects.filter(user_id__in=user_ids).values_list('token', flat=True))
+    if not tokens:
+        return None
+    return _send(tokens, title, message, data, f"{len(user_ids)} مستخدم")
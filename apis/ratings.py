@@ -0,0 +1,41 @@
+# File: apis/ratings.py
+"""
+تقييم السائق كمتوسط تراكمي.
+
+يحتفظ السائق بمجموع التقييمات وعددها، ويُحدَّث الاثنان والمتوسط معاً
+باستعلام UPDATE واحد عند إضافة تقييم أو تعديله أو حذفه.
+"""
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .models import Driver, Rating
+
+
+def apply_rating_change(driver_id, delta_sum, delta_count):
+    """يضيف فرق المجموع والعدد إلى عدّادات السائق ويعيد حساب المتوسط في نفس الاستعلام."""
+    if not delta_sum and not delta_count:
+        return
+    new_sum = F('rating_sum') + delta_sum
+    new_count = F('rating_count') + delta_count
+    Driver.objects.filter(pk=driver_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        rating=Case(
+            When(rating_count__gt=-delta_count, then=Round(Cast(new_sum, FloatField()) / new_count, 2)),
+            default=Value(0.0),
+        ),
+    )
+
+
+def backfill_driver_ratings():
+    """يعيد حساب عدّادات ومتوسط كل السائقين من جدول التقييمات باستعلام UPDATE واحد."""
+    ratings = Rating.objects.filter(driver=OuterRef('pk')).order_by().values('driver')
+    return Driver.objects.update(
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(ratings.annotate(total=Count('pk')).values('total')), 0),
+        rating=Coalesce(
+            Subquery(ratings.annotate(avg=Round(Avg('rating'), 2)).values('avg')),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
@@ -0,0 +1,72 @@
+# File: apis/realtime.py
+"""
+دفع التحديثات الحية عبر طبقة القنوات (Channels) بدلاً من استطلاع الواجهات.
+
+كل مستخدم متصل ينضم إلى مجموعة user_<id> لاستقبال رسائله وإشعاراته،
+ويمكنه الاشتراك في مجموعة trip_<id> لاستقبال تغيّر حالة الرحلة ومقاعدها.
+البث يتم كأثر جانبي بعد نجاح المعاملة (انظر side_effects)، فلا يُرسل تحديث لبيانات تراجعت.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .models import Chat, Message, Notification, Trip
+from .side_effects import side_effect
+
+logger = logging.getLogger(__name__)
+
+EVENT_HANDLER = 'realtime.event'
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+def trip_group(trip_id):
+    return f"trip_{trip_id}"
+
+
+def broadcast(groups, event, data):
+    """يرسل الحدث event إلى كل مجموعة في groups؛ لا يفعل شيئاً إذا لم تُضبط طبقة قنوات."""
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    send = async_to_sync(layer.group_send)
+    for group in groups:
+        send(group, {'type': EVENT_HANDLER, 'event': event, 'data': data})
+
+
+@side_effect
+def broadcast_message(message_id):
+    from .serializers import MessageSerializer
+
+    message = Message.objects.select_related('sender').filter(pk=message_id).first()
+    if not message:
+        return
+    participant_ids = Chat.participants.through.objects.filter(
+        chat_id=message.chat_id
+    ).values_list('user_id', flat=True)
+    broadcast(
+        [user_group(user_id) for user_id in participant_ids],
+        'message.new',
+        MessageSerializer(message).data,
+    )
+
+
+@side_effect
+def broadcast_notification(notification_id):
+    from .serializers import NotificationSerializer
+
+    notification = Notification.objects.filter(pk=notification_id).first()
+    if not notification:
+        return
+    broadcast([user_group(notification.user_id)], 'notification.new', NotificationSerializer(notification).data)
+
+
+@side_effect
+def broadcast_trip(trip_id):
+    trip = Trip.objects.filter(pk=trip_id).values('id', 'status', 'available_seats', 'booked_seats').first()
+    if not trip:
+        return
+    broadcast([trip_group(trip_id)], 'trip.updated', trip)
@@ -0,0 +1,135 @@
+# File: apis/request_batch.py
+"""
+تحميل الطلبات المعلقة للمجدول على شكل أعمدة NumPy بدلاً من كائنات النماذج.
+
+كل صف يحمل فقط ما يحتاجه التجميع والترتيب: المعرف، نوع الطلب، إحداثيات الركوب والوصول،
+الحمولة (الركاب أو الوزن)، وقت الإنشاء (epoch) وفئة الأولوية. الإحداثيات تُحلَّل في Postgres،
+والقيمة غير الصالحة تصبح NaN. القراءة حسب settings.TRIP_SCHEDULER_FETCH:
+    'values'  values_list بمؤشر من جهة الخادم، يُكتب صفاً صفاً في مصفوفة محجوزة مسبقاً
+    'copy'    COPY ... TO STDOUT بالصيغة الثنائية؛ كل الأعمدة ثابتة الطول وغير فارغة،
+              فتُقرأ الدفعة كاملة بـ np.frombuffer دون حلقة Python
+كائنات النماذج تُنشأ لاحقاً عبر instances() للطلبات التي تصل إلى الإسناد فقط.
+"""
+import io
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import BigIntegerField, Case, F, FloatField, Func, IntegerField, Value, When
+from django.db.models.functions import Cast, Extract
+from django.utils import timezone
+
+from .models import CasheBooking, CasheItemDelivery
+
+BOOKING, DELIVERY = 0, 1
+MODELS = {BOOKING: CasheBooking, DELIVERY: CasheItemDelivery}
+LOAD_FIELDS = {BOOKING: 'passengers', DELIVERY: 'weight'}
+
+COORD_RE = r'^\s*[-+]?\d+(\.\d*)?\s*,\s*[-+]?\d+(\.\d*)?\s*$'
+COORD_COLUMNS = ('from_lat', 'from_lon', 'to_lat', 'to_lon')
+COLUMNS = ('id', 'kind') + COORD_COLUMNS + ('load', 'created', 'priority')
+ROW_DTYPE = np.dtype([
+    ('id', 'i8'), ('kind', 'i4'),
+    ('from_lat', 'f8'), ('from_lon', 'f8'), ('to_lat', 'f8'), ('to_lon', 'f8'),
+    ('load', 'f8'), ('created', 'f8'), ('priority', 'i4'),
+])
+
+# الصيغة الثنائية لـ COPY: ترويسة 19 بايت، ثم لكل صف عدد الأعمدة (int16) ولكل عمود طوله (int32)
+# وقيمته بترتيب big-endian، ثم -1 (int16) في النهاية
+COPY_HEADER = 19
+COPY_DTYPE = np.dtype(
+    [('count', '>i2')]
+    + [pair for name in COLUMNS for pair in ((f'{name}_len', '>i4'), (name, '>' + ROW_DTYPE[name].str[1:]))]
+)
+
+
+def _coordinate(field, index):
+    return Case(
+        When(**{f'{field}__regex': COORD_RE}, then=Cast(
+            Func(F(field), Value(','), Value(index), function='split_part'), FloatField()
+        )),
+        default=Value(float('nan')),
+        output_field=FloatField(),
+    )
+
+
+def columnar(queryset, kind):
+    """يحوّل queryset الطلبات (مرتباً ومقطوعاً) إلى values_list بأعمدة ROW_DTYPE فقط."""
+    return queryset.annotate(
+        kind=Value(kind, output_field=IntegerField()),
+        from_lat=_coordinate('from_location', 1),
+        from_lon=_coordinate('from_location', 2),
+        to_lat=_coordinate('to_location', 1),
+        to_lon=_coordinate('to_location', 2),
+        load=Cast(LOAD_FIELDS[kind], FloatField()),
+        created=Cast(Extract('created_at', 'epoch'), FloatField()),
+        row_id=Cast('id', BigIntegerField()),
+    ).values_list('row_id', *COLUMNS[1:])
+
+
+def _fetch_values(rows, limit):
+    array = np.empty(limit, dtype=ROW_DTYPE)
+    count = 0
+    for count, row in enumerate(rows.iterator(chunk_size=max(limit, 1)), start=1):
+        array[count - 1] = row
+    return array[:count]
+
+
+def _fetch_copy(rows):
+    sql, params = rows.query.sql_with_params()
+    buffer = io.BytesIO()
+    with connection.cursor() as cursor:
+        query = f"COPY ({cursor.mogrify(sql, params).decode()}) TO STDOUT WITH (FORMAT binary)"
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(query, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(query) as copy:
+                for block in copy:
+                    buffer.write(block)
+    body = buffer.getbuffer()[COPY_HEADER:-2]
+    return np.frombuffer(body, dtype=COPY_DTYPE)[list(COLUMNS)].astype(ROW_DTYPE)
+
+
+def fetch(queryset, kind, limit):
+    """مصفوفة ROW_DTYPE لأول limit طلب من queryset المرتب."""
+    rows = columnar(queryset, kind)[:limit]
+    if settings.TRIP_SCHEDULER_FETCH == 'copy':
+        return _fetch_copy(rows)
+    return _fetch_values(rows, limit)
+
+
+class RequestBatch:
+    """طلبات جولة واحدة كأعمدة متوازية؛ الصف i هو الطلب رقم i في ترتيب الأولوية."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.coords = np.column_stack([rows[name] for name in COORD_COLUMNS]) if len(rows) else np.empty((0, 4))
+        self.valid = ~np.isnan(self.coords).any(axis=1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def instances(self, indexes):
+        """كائنات النماذج للصفوف indexes بنفس ترتيبها، للطلبات التي ما زالت معلقة فقط."""
+        rows = self.rows[list(indexes)]
+        found = {}
+        for kind, model in MODELS.items():
+            ids = rows['id'][rows['kind'] == kind].tolist()
+            if ids:
+                objects = model.objects.select_related('user__user').filter(
+                    pk__in=ids, status=model.Status.PENDING
+                ).in_bulk(ids)
+                found.update(((kind, pk), obj) for pk, obj in objects.items())
+        return [found[key] for key in zip(rows['kind'].tolist(), rows['id'].tolist()) if key in found]
+
+    def mark_attempted(self, indexes, now=None):
+        """يسجّل محاولة الجولة على الصفوف indexes التي ما زالت معلقة، لتؤجَّل إعادة تحميلها."""
+        rows = self.rows[list(indexes)]
+        for kind, model in MODELS.items():
+            ids = rows['id'][rows['kind'] == kind].tolist()
+            if ids:
+                model.objects.filter(pk__in=ids, status=model.Status.PENDING).update(
+                    last_attempt_at=now or timezone.now()
+                )
@@ -9,14 +9,17 @@ retry_registry = {}
 RETRY_TIMEOUT_MINUTES = 60
 
 def add_to_retry_queue(item):
+    add_id_to_retry_queue(item.id)
+
+def add_id_to_retry_queue(item_id):
     now_time = now()
-    last_retry = retry_registry.get(item.id)
+    last_retry = retry_registry.get(item_id)
     if last_retry and (now_time - last_retry).total_seconds() < RETRY_TIMEOUT_MINUTES * 60:
         return
 
-    retry_registry[item.id] = now_time
+    retry_registry[item_id] = now_time
     try:
-        logger.info(f"🔁 إضافة العنصر {item.id} إلى قائمة المحاولات.")
+        logger.info(f"🔁 إضافة العنصر {item_id} إلى قائمة المحاولات.")
     except Exception as e:
-        logger.error(f"❌ فشل إضافة العنصر {item.id} إلى قائمة المحاولات: {e}")
+        logger.error(f"❌ فشل إضافة العنصر {item_id} إلى قائمة المحاولات: {e}")
 
@@ -0,0 +1,111 @@
+# File: apis/scheduling.py
+"""
+تشغيل مجدول الرحلات عند وصول طلبات جديدة بدلاً من الاستطلاع كل 20 ثانية.
+
+إنشاء CasheBooking أو CasheItemDelivery يطلب جولة جدولة حسب settings.TRIP_SCHEDULER_TRIGGER:
+    'celery'  (الافتراضي) بعد نجاح المعاملة تُرسل مهمة run_trip_scheduler مؤجلة بـ TRIP_SCHEDULER_MIN_WAIT،
+              ومفتاح في الكاش يمنع جدولة أكثر من جولة معلقة واحدة. المنع يشمل كل العمليات فقط إذا
+              ضُبط CACHE_REDIS_URL؛ مع كاش الذاكرة الافتراضي يكون لكل عملية، ويبقى قفل الجولة يمنع
+              تداخل الجولات فلا يكلّف التكرار أكثر من جولة فارغة.
+    'listen'  NOTIFY على قناة Postgres داخل نفس المعاملة (يُسلَّم فقط إذا نجحت)، ويستقبله
+              `manage.py dbscan_clustering --listen` فيجمع الطلبات المتقاربة في جولة واحدة:
+              ينتظر هدوءاً لمدة TRIP_SCHEDULER_MIN_WAIT، ولا يؤخر أول طلب أكثر من TRIP_SCHEDULER_MAX_WAIT.
+              يحتاج تشغيل المستمع كعملية دائمة بجانب الويب.
+في الحالتين تبقى الجولة الدورية (TRIP_SCHEDULER_SWEEP_INTERVAL) لإعادة محاولة الطلبات التي لم تُعالج.
+"""
+import logging
+import select
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'trip_scheduler'
+# مفتاح القفل الاستشاري الذي يمنع تداخل جولتين (المستمع وCelery مثلاً) على نفس الطلبات
+ROUND_LOCK_KEY = 745101
+PENDING_KEY = 'trip_scheduler:pending'
+
+
+def request_run():
+    """يُستدعى عند إنشاء طلب جديد ليطلب جولة جدولة قريبة."""
+    if settings.TRIP_SCHEDULER_TRIGGER == 'listen':
+        # NOTIFY جزء من المعاملة، وPostgres يدمج الإشعارات المتطابقة داخلها
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [CHANNEL])
+    elif settings.TRIP_SCHEDULER_TRIGGER == 'celery':
+        transaction.on_commit(_enqueue)
+
+
+def _enqueue():
+    if not cache.add(PENDING_KEY, 1, timeout=int(settings.TRIP_SCHEDULER_MAX_WAIT)):
+        return
+    from apis.tasks import run_trip_scheduler
+    try:
+        run_trip_scheduler.apply_async(countdown=settings.TRIP_SCHEDULER_MIN_WAIT)
+    except Exception:
+        cache.delete(PENDING_KEY)
+        logger.exception("⚠️ تعذّر إرسال جولة الجدولة إلى Celery")
+
+
+def clear_pending():
+    """تبدأ الجولة: الطلبات التي تصل بعد الآن تجدول جولة جديدة."""
+    cache.delete(PENDING_KEY)
+
+
+@contextmanager
+def round_lock():
+    """قفل Postgres استشاري على مستوى الجلسة؛ يُرجع False إذا كانت جولة أخرى تعمل."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [ROUND_LOCK_KEY])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [ROUND_LOCK_KEY])
+
+
+class Listener:
+    """اتصال مخصص يستمع لقناة المجدول؛ خارج اتصالات Django لأنه يبقى مفتوحاً ولا يدخل معاملات."""
+
+    def __init__(self):
+        params = connection.get_connection_params()
+        params.pop('pool', None)
+        self.conn = connection.Database.connect(**params)
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+
+    def wait(self, timeout):
+        """ينتظر حتى timeout ثانية ويُرجع عدد الإشعارات المستلمة (0 عند انتهاء المهلة)."""
+        if hasattr(self.conn, 'poll'):
+            # psycopg2
+            if not select.select([self.conn], [], [], max(timeout, 0))[0]:
+                return 0
+            self.conn.poll()
+            count = len(self.conn.notifies)
+            self.conn.notifies.clear()
+            return count
+        # psycopg 3
+        return sum(1 for _ in self.conn.notifies(timeout=max(timeout, 0), stop_after=1))
+
+    def wait_for_batch(self, idle_timeout):
+        """
+        ينتظر أول إشعار حتى idle_timeout (يُرجع False إذا لم يصل شيء)، ثم يستمر في التجميع
+        حتى يهدأ الطلب لمدة MIN_WAIT أو تمضي MAX_WAIT منذ أول إشعار.
+        """
+        if not self.wait(idle_timeout):
+            return False
+        first = time.monotonic()
+        while True:
+            remaining = settings.TRIP_SCHEDULER_MAX_WAIT - (time.monotonic() - first)
+            if remaining <= 0 or not self.wait(min(settings.TRIP_SCHEDULER_MIN_WAIT, remaining)):
+                return True
+
+    def close(self):
+        self.conn.close()
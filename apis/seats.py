@@ -0,0 +1,134 @@
+# File: apis/seats.py
+"""
+محاسبة مقاعد الرحلات بعدّاد ذري.
+
+كل حجز يزيد Trip.booked_seats أو ينقصه باستعلام UPDATE واحد بتعابير F()،
+مع تحقق متفائل من سعة المركبة داخل نفس الاستعلام، بدلاً من إعادة عدّ كل الحجوزات.
+"""
+import logging
+
+from django.db.models import Case, CharField, F, Func, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.utils.translation import gettext_lazy as _
+
+from .models import Booking, Trip, Vehicle
+from .side_effects import dispatch
+
+logger = logging.getLogger(__name__)
+
+# الرحلات التي ما زالت تقبل تغييرات على الحجوزات
+ACTIVE_TRIP_STATUSES = (Trip.Status.PENDING, Trip.Status.IN_PROGRESS, Trip.Status.FULL)
+# الحالات التي يجوز تحويلها إلى FULL أو منها تلقائياً
+OPEN_TRIP_STATUSES = (Trip.Status.PENDING, Trip.Status.IN_PROGRESS)
+
+
+def booking_seat_count(seats, status):
+    """عدد المقاعد التي يشغلها الحجز؛ الحجز الملغى لا يشغل مقاعد."""
+    if status == Booking.Status.CANCELLED or not isinstance(seats, list):
+        return 0
+    return len(seats)
+
+
+def booked_seats_expression():
+    """نفس منطق booking_seat_count كتعبير SQL على جدول الحجوزات."""
+    return Case(
+        When(
+            Q(status=Booking.Status.CANCELLED) | ~Q(seats_type='array'),
+            then=Value(0),
+        ),
+        default=Func(F('seats'), function='jsonb_array_length'),
+        output_field=IntegerField(),
+    )
+
+
+def _with_seats_type(queryset):
+    return queryset.annotate(seats_type=Func(F('seats'), function='jsonb_typeof', output_field=CharField()))
+
+
+def _vehicle_capacity():
+    return Subquery(Vehicle.objects.filter(pk=OuterRef('vehicle_id')).values('capacity')[:1])
+
+
+def reserve_seats(trip_id, count):
+    """
+    يحجز count مقعداً في الرحلة باستعلام واحد مشروط بألا يتجاوز المحجوز سعة المركبة.
+    يرفع ValueError إذا لم تكفِ المقاعد.
+    """
+    if count <= 0:
+        return
+    capacity = _vehicle_capacity()
+    updated = Trip.objects.filter(
+        pk=trip_id,
+        booked_seats__lte=capacity - count,
+    ).update(
+        booked_seats=F('booked_seats') + count,
+        available_seats=capacity - F('booked_seats') - count,
+        status=Case(
+            When(
+                booked_seats__gte=capacity - count,
+                status__in=OPEN_TRIP_STATUSES,
+                then=Value(Trip.Status.FULL),
+            ),
+            default=F('status'),
+        ),
+    )
+    if not updated:
+        raise ValueError(_("لا توجد مقاعد كافية في الرحلة."))
+    dispatch('broadcast_trip', trip_id)
+
+
+def release_seats(trip_id, count):
+    """يحرّر count مقعداً ويعيد الرحلة الممتلئة إلى قيد الانتظار."""
+    if count <= 0:
+        return
+    Trip.objects.filter(pk=trip_id).update(
+        booked_seats=Case(
+            When(booked_seats__gte=count, then=F('booked_seats') - count),
+            default=Value(0),
+        ),
+        available_seats=F('available_seats') + count,
+        status=Case(
+            When(status=Trip.Status.FULL, then=Value(Trip.Status.PENDING)),
+            default=F('status'),
+        ),
+    )
+    dispatch('broadcast_trip', trip_id)
+
+
+def reconcile_trip_seats(trip_ids=None):
+    """
+    يصلح أي انحراف بين العدّاد والحجوزات الفعلية للرحلات النشطة
+    باستعلام تجميعي واحد ثم bulk_update للرحلات المختلفة فقط.
+    يُرجع عدد الرحلات المصححة.
+    """
+    trips = Trip.objects.filter(status__in=ACTIVE_TRIP_STATUSES)
+    if trip_ids is not None:
+        trips = trips.filter(pk__in=trip_ids)
+
+    actual = dict(
+        _with_seats_type(Booking.objects.filter(trip__in=trips))
+        .values('trip_id')
+        .annotate(total=Sum(booked_seats_expression()))
+        .values_list('trip_id', 'total')
+    )
+
+    drifted = []
+    for trip in trips.select_related('vehicle').only(
+        'id', 'booked_seats', 'available_seats', 'status', 'vehicle__capacity'
+    ).iterator(chunk_size=2000):
+        booked = actual.get(trip.pk) or 0
+        available = trip.vehicle.capacity - booked
+        status = trip.status
+        if available <= 0 and status in OPEN_TRIP_STATUSES:
+            status = Trip.Status.FULL
+        elif available > 0 and status == Trip.Status.FULL:
+            status = Trip.Status.PENDING
+        if (booked, available, status) != (trip.booked_seats, trip.available_seats, trip.status):
+            trip.booked_seats, trip.available_seats, trip.status = booked, available, status
+            drifted.append(trip)
+
+    Trip.objects.bulk_update(drifted, ['booked_seats', 'available_seats', 'status'], batch_size=1000)
+    for trip in drifted:
+        dispatch('broadcast_trip', trip.pk)
+    if drifted:
+        logger.info(f"🪑 تم تصحيح عدّاد المقاعد لـ {len(drifted)} رحلة")
+    return len(drifted)
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import *
 from django.contrib.auth import get_user_model
+from django.utils.translation import gettext_lazy as _
+from decimal import Decimal
 User = get_user_model()
 
 class UserSerializer(serializers.ModelSerializer):
@@ -38,11 +40,18 @@ class DriverSerializer(serializers.ModelSerializer):
     class Meta:
         model = Driver
         fields = '__all__'
+        read_only_fields = ['rating', 'rating_sum', 'rating_count', 'latitude', 'longitude', 'location_updated_at']
 
 class TripSerializer(serializers.ModelSerializer):
     class Meta:
         model = Trip
         fields = '__all__'
+        read_only_fields = ['booked_seats', 'available_seats']
+
+    def create(self, validated_data):
+        # المقاعد المتاحة يشتقها apis.seats من سعة المركبة، فتبدأ الرحلة الجديدة بكامل السعة
+        validated_data['available_seats'] = validated_data['vehicle'].capacity
+        return super().create(validated_data)
 
 class BookingSerializer(serializers.ModelSerializer):
     class Meta:
@@ -84,6 +93,21 @@ class BonusSerializer(serializers.ModelSerializer):
         model = Bonus
         fields = '__all__'
 
+class BulkCreditItemSerializer(serializers.Serializer):
+    user = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+
+class BulkCreditSerializer(serializers.Serializer):
+    items = BulkCreditItemSerializer(many=True, required=False)
+    file = serializers.FileField(required=False)
+    reason = serializers.ChoiceField(choices=Bonus._meta.get_field('reason').choices, default='other')
+    description = serializers.CharField(required=False, allow_blank=True)
+
+    def validate(self, attrs):
+        if not attrs.get('items') and not attrs.get('file'):
+            raise serializers.ValidationError(_("أرسل قائمة items أو ملف CSV."))
+        return attrs
+
 class TripStopSerializer(serializers.ModelSerializer):
     class Meta:
         model = TripStop
@@ -105,17 +129,80 @@ class CasheItemDeliverySerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class NearbyTripsQuerySerializer(serializers.Serializer):
+    from_lat = serializers.FloatField(min_value=-90, max_value=90)
+    from_lon = serializers.FloatField(min_value=-180, max_value=180)
+    to_lat = serializers.FloatField(min_value=-90, max_value=90)
+    to_lon = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=0.1, max_value=50, default=3)
+    seats = serializers.IntegerField(min_value=1, default=1)
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+
+class DriverLocationPointSerializer(serializers.Serializer):
+    # حدود Redis GEO لخط العرض
+    lat = serializers.FloatField(min_value=-85.05, max_value=85.05)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    ts = serializers.DateTimeField(required=False)
+
+
+class DriverLocationSerializer(serializers.Serializer):
+    points = serializers.ListField(
+        child=DriverLocationPointSerializer(),
+        min_length=1,
+        max_length=100,
+    )
+
+
+class FCMTokenBatchSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        min_length=1,
+        max_length=20,
+    )
+    device_info = serializers.JSONField(required=False, allow_null=True)
+
+
+class AttachmentBlobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AttachmentBlob
+        fields = ['id', 'file', 'thumbnail', 'size', 'content_type']
+
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    blob = AttachmentBlobSerializer(read_only=True)
+
+    class Meta:
+        model = AttachmentUpload
+        fields = ['id', 'filename', 'content_type', 'total_size', 'received_bytes', 'status', 'blob']
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    blob = AttachmentBlobSerializer(read_only=True)
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'chat', 'sender', 'content', 'attachment', 'is_read', 'created_at']
+        fields = ['id', 'chat', 'sender', 'content', 'attachment', 'blob', 'is_read', 'created_at']
+
+    def get_is_read(self, obj):
+        cursors = self.context.get('read_cursors')
+        if cursors is None:
+            return obj.is_read
+        # رسالة المستخدم تُعد مقروءة إذا تجاوزها مؤشر بقية المشاركين، ورسائلهم إذا تجاوزها مؤشره
+        until = cursors['peers'] if obj.sender_id == cursors['user_id'] else cursors['own']
+        return obj.is_read or obj.pk <= until
 
 class ChatSerializer(serializers.ModelSerializer):
     participants = UserSerializer(many=True, read_only=True)
     last_message = MessageSerializer(read_only=True)
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Chat
-        fields = ['id', 'title', 'is_group', 'participants', 'last_message', 'updated_at']
+        fields = ['id', 'participants', 'last_message', 'unread_count', 'updated_at']
+
+    def get_unread_count(self, obj):
+        return getattr(obj, 'unread_count', 0)
@@ -0,0 +1,89 @@
+# File: apis/side_effects.py
+"""
+موزّع الآثار الجانبية للإشارات.
+
+الإشارات تسجّل العمل الثقيل (إشعارات، محادثات، إعادة حساب) هنا بدل تنفيذه داخل معاملة الطلب،
+ويُحدَّد لكل أثر طريقة تنفيذه في settings.SIDE_EFFECTS:
+    'sync'      تنفيذ فوري داخل المعاملة (السلوك القديم)
+    'on_commit' تنفيذ في نفس الخيط بعد نجاح المعاملة
+    'thread'    تنفيذ بعد نجاح المعاملة في مجمّع خيوط خلفي
+    'celery'    إرسال مهمة Celery بعد نجاح المعاملة
+الوسائط يجب أن تكون قيماً بسيطة (معرّفات) لأنها قد تُرسل إلى Celery.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+MODES = ('sync', 'on_commit', 'thread', 'celery')
+
+registry = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def side_effect(func):
+    """يسجّل الدالة كأثر جانبي باسمها حتى يمكن استدعاؤها من dispatch أو من Celery."""
+    registry[func.__name__] = func
+    return func
+
+
+def get_mode(name):
+    mode = getattr(settings, 'SIDE_EFFECTS', {}).get(name, getattr(settings, 'SIDE_EFFECTS_DEFAULT', 'sync'))
+    if mode not in MODES:
+        logger.warning(f"⚠️ طريقة تنفيذ غير معروفة '{mode}' للأثر {name}، سيتم التنفيذ فوراً.")
+        return 'sync'
+    return mode
+
+
+def dispatch(name, *args):
+    """ينفّذ الأثر الجانبي name حسب الطريقة المحددة له في الإعدادات."""
+    mode = get_mode(name)
+    if mode == 'sync':
+        return registry[name](*args)
+    transaction.on_commit(lambda: _submit(mode, name, args))
+
+
+def _submit(mode, name, args):
+    if mode == 'on_commit':
+        return run(name, *args)
+    if mode == 'celery':
+        from apis.tasks import run_side_effect
+        try:
+            run_side_effect.delay(name, *args)
+            return
+        except Exception:
+            logger.exception(f"⚠️ تعذّر إرسال {name} إلى Celery، سيتم تنفيذه في خيط خلفي.")
+    _get_executor().submit(_run_in_thread, name, args)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'SIDE_EFFECT_THREADS', 4),
+                    thread_name_prefix='side-effects',
+                )
+    return _executor
+
+
+def _run_in_thread(name, args):
+    try:
+        run(name, *args)
+    finally:
+        # لكل خيط اتصاله الخاص بقاعدة البيانات، فنغلقه حسب CONN_MAX_AGE
+        close_old_connections()
+
+
+def run(name, *args):
+    """ينفّذ الأثر مباشرة ويسجّل أي خطأ دون رفعه (لا يوجد طلب ينتظر النتيجة)."""
+    try:
+        registry[name](*args)
+    except Exception:
+        logger.exception(f"❌ فشل تنفيذ الأثر الجانبي {name}")
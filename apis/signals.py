@@ -1,12 +1,18 @@
 import logging
 from django.db import transaction
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
 from django.conf import settings
-from apis.tasks import send_fcm_notification
-from .models import Booking, Chat, Transaction, Transfer, Bonus, Wallet, CasheBooking, Trip, Notification, FCMToken
+from apis.push import send_to_user, send_to_users
+from apis import ledger
+from apis.side_effects import dispatch, side_effect
+from apis.seats import release_seats
+from apis.ratings import apply_rating_change
+from apis.chats import ensure_cursors
+from apis import attachments, availability, locations, realtime, scheduling  # noqa: F401 تسجّل آثار البث الحي والصور المصغرة وترحيل المواقع وإتاحة السائقين
+from .models import Booking, Chat, ChatReadCursor, Driver, Message, Rating, Transaction, Transfer, Bonus, Wallet, CasheBooking, CasheItemDelivery, Trip, Notification, FCMToken
 
 logger = logging.getLogger(__name__)
 
@@ -20,29 +26,28 @@ def handle_bonus_creation(sender, instance, created, **kwargs):
     if not created or instance.processed:
         return
 
-    try:
-        with transaction.atomic():
-            wallet = Wallet.objects.select_for_update().get(user=instance.user)
-            wallet.credit(instance.amount)
-            instance.processed = True
-            instance.save(update_fields=['processed'])
-    except Wallet.DoesNotExist:
+    wallet_id = Wallet.objects.filter(user=instance.user).values_list('pk', flat=True).first()
+    if wallet_id is None:
         raise ObjectDoesNotExist(f"المستخدم {instance.user.username} ليس لديه محفظة")
 
+    with transaction.atomic():
+        if ledger.credit(wallet_id, instance.amount):
+            ledger.journal([{
+                'wallet_id': wallet_id,
+                'transaction_type': 'charge',
+                'amount': instance.amount,
+                'description': instance.get_reason_display(),
+                'metadata': {'bonus_id': instance.pk},
+            }])
+        instance.processed = True
+        instance.save(update_fields=['processed'])
+
 @receiver(post_save, sender=Transaction)
 def update_wallet_balance(sender, instance, created, **kwargs):
     if not created:
         return
 
-    wallet = instance.wallet
-    try:
-        with transaction.atomic():
-            if instance.transaction_type == 'charge':
-                wallet.credit(instance.amount)
-            elif instance.transaction_type in ['withdraw', 'payment']:
-                wallet.debit(instance.amount)
-    except Exception as e:
-        raise
+    ledger.apply_transaction(instance)
 
 @receiver(post_save, sender=Transfer)
 def auto_process_transfer(sender, instance, created, **kwargs):
@@ -52,38 +57,109 @@ def auto_process_transfer(sender, instance, created, **kwargs):
         except Exception as e:
             logger.error(f"فشل في معالجة التحويل {instance.id}: {e}")
 
-@receiver(post_save, sender=User)
-def create_user_chat(sender, instance, created, **kwargs):
-    """إنشاء محادثة تلقائية للمستخدم الجديد"""
-    if created:
-        try:
-            chat = Chat.objects.create(title=f"Chat for {instance.username}")
-            chat.participants.add(instance)
-            logger.info(f"تم إنشاء محادثة جديدة للمستخدم {instance.username}")
-        except Exception as e:
-            logger.error(f"فشل في إنشاء محادثة للمستخدم {instance.username}: {e}")
-
 @receiver(post_save, sender=Trip)
 def mark_driver_unavailable(sender, instance, created, **kwargs):
-    if created and instance.driver and instance.status != 'completed':
-        instance.driver.is_available = False
-        instance.driver.save(update_fields=['is_available'])
+    if created and instance.driver_id and instance.status != 'completed':
+        dispatch('mark_driver_busy', instance.driver_id)
 
 
 @receiver(post_save, sender=Notification)
 def on_notification_created(sender, instance, created, **kwargs):
     if created:
-        # ترسل الإشعار مباشرة بعد إنشاء السجل
-        send_fcm_notification(
-            user=instance.user,
-            title=instance.title,
-            message=instance.message,
-            data={
-                "notification_type": getattr(instance, "notification_type", ""),
-                "related_object_id": getattr(instance, "related_object_id", "")
-            }
-        )
-
-@receiver([post_save, post_delete], sender=Booking)
+        # ترسل الإشعار بعد نجاح المعاملة حتى لا ينتظر الطلب مزود الإشعارات
+        dispatch('push_notification', instance.pk)
+        dispatch('broadcast_notification', instance.pk)
+
+@receiver(post_save, sender=Message)
+def on_message_created(sender, instance, created, **kwargs):
+    if created:
+        dispatch('broadcast_message', instance.pk)
+
+@receiver(post_save, sender=Trip)
+def on_trip_saved(sender, instance, created, **kwargs):
+    if not created:
+        dispatch('broadcast_trip', instance.pk)
+        if instance.driver_id and instance.status in availability.CLOSED_TRIP_STATUSES:
+            dispatch('release_driver', instance.driver_id)
+
+@receiver(post_delete, sender=Trip)
+def release_driver_on_trip_delete(sender, instance, **kwargs):
+    if instance.driver_id:
+        dispatch('release_driver', instance.driver_id)
+
+@receiver(pre_delete, sender=Booking)
+@receiver(pre_delete, sender=Rating)
+def remember_counted_before_delete(sender, instance, **kwargs):
+    # نسخة بحقول مؤجلة لا يمكن قراءة حقولها بعد حذف صفها
+    if not hasattr(instance, '_counted'):
+        instance._counted = instance._stored_count()
+
+@receiver(post_delete, sender=Booking)
 def update_trip_availability(sender, instance, **kwargs):
-    instance.trip.update_availability()
\ No newline at end of file
+    # الحفظ يعدّل العدّاد داخل Booking.save، والحذف (بما فيه الحذف المجمّع) يحرّر المقاعد هنا
+    # وما يشغله الحجز سجّله remember_counted_before_delete قبل حذف صفه
+    release_seats(*instance._counted)
+
+@receiver(post_delete, sender=Rating)
+def remove_driver_rating(sender, instance, **kwargs):
+    driver_id, rating = instance._counted
+    apply_rating_change(driver_id, -rating, -1)
+
+@receiver(m2m_changed, sender=Chat.participants.through)
+def sync_chat_read_cursors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # reverse تعني التعديل من جهة المستخدم (user.chats.add)
+    owner = {'user': instance} if reverse else {'chat': instance}
+    if action == 'post_add':
+        ensure_cursors((pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set)
+    elif action == 'post_remove':
+        lookup = 'chat_id__in' if reverse else 'user_id__in'
+        ChatReadCursor.objects.filter(**owner, **{lookup: pk_set}).delete()
+    else:
+        ChatReadCursor.objects.filter(**owner).delete()
+
+@receiver(post_delete, sender=Message)
+def refresh_chat_last_message(sender, instance, **kwargs):
+    # SET_NULL يفرغ last_message قبل الحذف، فنعيد الحساب فقط إذا كانت المحذوفة آخر رسالة
+    chat = Chat.objects.filter(pk=instance.chat_id, last_message__isnull=True).first()
+    if chat:
+        chat.update_last_message()
+
+
+# ============================
+# الآثار الجانبية (تُنفّذ حسب settings.SIDE_EFFECTS)
+# ============================
+
+@side_effect
+def mark_driver_busy(driver_id):
+    Driver.objects.filter(pk=driver_id).update(is_available=False)
+
+@side_effect
+def push_notification(notification_id):
+    notification = Notification.objects.select_related('user').filter(pk=notification_id).first()
+    if not notification:
+        return
+    send_to_user(
+        user=notification.user,
+        title=notification.title,
+        message=notification.message,
+        data={
+            "notification_type": notification.notification_type,
+            "related_object_id": notification.related_object_id
+        }
+    )
+
+
+@side_effect
+def push_to_users(user_ids, title, message, data=None):
+    # إشعارات أُنشئت بـ bulk_create (لا تمر بـ post_save) وتشترك في نفس النص
+    send_to_users(user_ids, title, message, data)
+
+
+@receiver(post_save, sender=CasheBooking)
+@receiver(post_save, sender=CasheItemDelivery)
+def trigger_trip_scheduler(sender, instance, created, **kwargs):
+    # طلب جديد: جولة جدولة قريبة بدل انتظار الجولة الدورية
+    if created:
+        scheduling.request_run()
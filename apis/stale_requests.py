@@ -0,0 +1,79 @@
+# File: apis/stale_requests.py
+"""
+إنهاء الطلبات المعلقة التي لم يعد لها معنى حتى لا يعيد المجدول تحميلها وإشعار أصحابها كل جولة:
+    CasheBooking       فات وقت مغادرته بأكثر من STALE_BOOKING_GRACE_MINUTES  ← FAILED
+    CasheItemDelivery  معلق منذ أكثر من STALE_DELIVERY_HOURS                ← CANCELLED
+التحديث على دفعات من STALE_SWEEP_CHUNK صفاً (SKIP LOCKED حتى لا ينتظر جولة جدولة تعالج نفس الطلبات)،
+ولكل دفعة إشعارات بـ bulk_create وإرسال multicast واحد لأجهزة أصحابها بعد نجاح المعاملة.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CasheBooking, CasheItemDelivery, Notification
+from .side_effects import dispatch
+
+logger = logging.getLogger(__name__)
+
+
+def booking_cutoff(now=None):
+    """الحجوزات التي وقت مغادرتها قبل هذا الوقت منتهية."""
+    return (now or timezone.now()) - timedelta(minutes=settings.STALE_BOOKING_GRACE_MINUTES)
+
+
+def _expire(queryset, values, title, message, notification_type):
+    total = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                queryset.select_for_update(skip_locked=True, of=('self',))
+                .order_by()
+                .values_list('pk', 'user__user_id')[:settings.STALE_SWEEP_CHUNK]
+            )
+            if not rows:
+                break
+            queryset.model.objects.filter(pk__in=[pk for pk, _ in rows]).update(**values)
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=user_id,
+                    title=title,
+                    message=message,
+                    notification_type=notification_type,
+                    related_object_id=pk,
+                )
+                for pk, user_id in rows
+            ])
+            dispatch('push_to_users', sorted({user_id for _, user_id in rows}), title, message,
+                     {'notification_type': notification_type})
+        total += len(rows)
+        if len(rows) < settings.STALE_SWEEP_CHUNK:
+            break
+    return total
+
+
+def sweep_stale_requests(now=None):
+    """يُرجع (عدد الحجوزات المنتهية، عدد الشحنات الملغاة)."""
+    now = now or timezone.now()
+    bookings = _expire(
+        CasheBooking.objects.filter(status=CasheBooking.Status.PENDING, departure_time__lt=booking_cutoff(now)),
+        {'status': CasheBooking.Status.FAILED},
+        "انتهى وقت حجزك",
+        "لم نجد رحلة مناسبة قبل وقت المغادرة، يمكنك إنشاء حجز جديد.",
+        'booking',
+    )
+    deliveries = _expire(
+        CasheItemDelivery.objects.filter(
+            status=CasheItemDelivery.Status.PENDING,
+            created_at__lt=now - timedelta(hours=settings.STALE_DELIVERY_HOURS),
+        ),
+        {'status': CasheItemDelivery.Status.CANCELLED, 'updated_at': now},
+        "تم إلغاء طلب الشحن",
+        "لم نجد رحلة لشحنتك خلال المدة المحددة، يمكنك إنشاء طلب جديد.",
+        'delivery',
+    )
+    if bookings or deliveries:
+        logger.info(f"🧹 تم إنهاء {bookings} حجز و {deliveries} شحنة معلقة")
+    return bookings, deliveries
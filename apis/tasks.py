@@ -1,6 +1,10 @@
-from firebase_admin import messaging
-from apis.models import FCMToken
-import apis.firebase  # للتأكد من تهيئة Firebase
+from apis.ledger import take_snapshots
+from apis.side_effects import run
+from apis import seats
+from apis.attachments import purge_stale_uploads
+from apis.fcm_tokens import prune_stale_tokens
+from apis import availability, locations, scheduling
+from apis.stale_requests import sweep_stale_requests
 from celery import shared_task
 from django.core.management import call_command
 import logging
@@ -11,36 +15,69 @@ logger = logging.getLogger(__name__)
 def run_trip_scheduler():
     try:
         logger.info("🚀 Running intelligent trip scheduler via Celery...")
-        call_command('dbscan_clustering', '--min_cluster_size=3')
+        scheduling.clear_pending()
+        call_command('dbscan_clustering', '--min_cluster_size=3', '--once')
         logger.info("✅ Trip scheduler executed successfully.")
     except Exception as e:
         logger.exception("❌ Trip scheduler execution failed")
 
 
-def send_fcm_notification(user, title, message, data=None):
-    tokens = FCMToken.objects.filter(user=user).values_list('token', flat=True)
-    if not tokens:
-        print("🚫 لا توجد توكنات FCM للمستخدم.")
-        return
-
-    # جهّز dict للـ data مع تحويل القيم إلى نص واستبعاد None
-    clean_data = {}
-    if data:
-        for key, value in data.items():
-            if value is not None:
-                clean_data[key] = str(value)
-                for token in tokens:
-                    msg = messaging.Message(
-                        notification=messaging.Notification(
-                            title=title,
-                            body=message,
-                        ),
-                        token=token,
-                        data=clean_data    # الآن جميع القيم نصّيّة
-                    )
-                    try:
-                        print("🚀 إرسال إشعار عبر Firebase Admin SDK...")
-                        response = messaging.send(msg)
-                        print(f"✅ تم الإرسال: {response}")
-                    except Exception as e:
-                        print(f"❌ فشل إرسال الإشعار (خطأ غير متوقع): {e}")
+@shared_task
+def run_side_effect(name, *args):
+    run(name, *args)
+
+
+@shared_task
+def reconcile_trip_seats():
+    try:
+        seats.reconcile_trip_seats()
+    except Exception:
+        logger.exception("❌ Trip seat reconciliation failed")
+
+
+@shared_task
+def snapshot_wallet_balances():
+    try:
+        take_snapshots()
+    except Exception:
+        logger.exception("❌ Wallet snapshot failed")
+
+
+@shared_task
+def purge_stale_attachment_uploads():
+    try:
+        purge_stale_uploads()
+    except Exception:
+        logger.exception("❌ Purging stale attachment uploads failed")
+
+
+@shared_task
+def prune_stale_fcm_tokens():
+    try:
+        prune_stale_tokens()
+    except Exception:
+        logger.exception("❌ Pruning stale FCM tokens failed")
+
+
+@shared_task
+def flush_driver_locations():
+    try:
+        locations.flush_driver_locations()
+    except Exception:
+        logger.exception("❌ Flushing driver locations failed")
+
+
+@shared_task
+def sweep_stale_trip_requests():
+    try:
+        sweep_stale_requests()
+    except Exception:
+        logger.exception("❌ Sweeping stale trip requests failed")
+
+
+@shared_task
+def reconcile_driver_availability():
+    try:
+        availability.reconcile_availability()
+    except Exception:
+        logger.exception("❌ Reconciling driver availability failed")
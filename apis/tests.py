@@ -0,0 +1,1483 @@
+import importlib.util
+import io
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import numpy as np
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apis import (
+    attachments, availability, chats, firebase, geohash, ledger, locations, push, ratings, scheduling, seats,
+    side_effects, trip_search,
+)
+from apis.management.commands.dbscan_clustering import Command as SchedulerCommand
+from apis.management.commands.fake_push_server import _response as fake_push_response
+from apis.models import (
+    AttachmentUpload, Bonus, Booking, CasheBooking, CasheItemDelivery, Chat, ChatReadCursor, Client, Driver,
+    FCMToken, Message, Notification, Rating, Transaction, Trip, Vehicle, Wallet, WalletSnapshot,
+)
+from apis.fcm_tokens import prune_stale_tokens, register_tokens
+from apis.payouts import award_bonuses, parse_credit_rows, read_credit_csv
+from apis.priority import _ordered, load_queue
+from apis.request_batch import BOOKING, COPY_DTYPE, DELIVERY, fetch
+from apis.stale_requests import sweep_stale_requests
+from backend.asgi import application
+
+User = get_user_model()
+
+
+def run_in_threads(workers, target):
+    """يشغّل الدالة في عدة خيوط متزامنة تبدأ معاً، ويغلق اتصال كل خيط بعد انتهائه."""
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def _run(index):
+        try:
+            barrier.wait()
+            target(index)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=_run, args=(i,)) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+
+@override_settings(SIDE_EFFECTS={})
+class LedgerConcurrencyTests(TransactionTestCase):
+    WORKERS = 32
+    OPS_PER_WORKER = 25
+
+    def setUp(self):
+        self.wallet_a = User.objects.create(username='ledger_a').wallet
+        self.wallet_b = User.objects.create(username='ledger_b').wallet
+        Wallet.objects.filter(pk__in=[self.wallet_a.pk, self.wallet_b.pk]).update(balance=Decimal('1000.00'))
+
+    def test_concurrent_credits_are_not_lost(self):
+        errors = run_in_threads(
+            self.WORKERS,
+            lambda i: [ledger.credit(self.wallet_a.pk, Decimal('1.00')) for _ in range(self.OPS_PER_WORKER)],
+        )
+        self.assertEqual(errors, [])
+        self.wallet_a.refresh_from_db()
+        self.assertEqual(self.wallet_a.balance, Decimal('1000.00') + self.WORKERS * self.OPS_PER_WORKER)
+
+    def test_concurrent_debits_never_overdraw(self):
+        Wallet.objects.filter(pk=self.wallet_a.pk).update(balance=Decimal('100.00'))
+        succeeded = []
+
+        def _debit(i):
+            for _ in range(self.OPS_PER_WORKER):
+                try:
+                    ledger.debit(self.wallet_a.pk, Decimal('1.00'))
+                    succeeded.append(1)
+                except ValueError:
+                    pass
+
+        errors = run_in_threads(self.WORKERS, _debit)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(succeeded), 100)
+        self.wallet_a.refresh_from_db()
+        self.assertEqual(self.wallet_a.balance, Decimal('0.00'))
+
+    def test_opposite_transfers_conserve_total_without_deadlock(self):
+        def _transfer(i):
+            src, dst = (self.wallet_a, self.wallet_b) if i % 2 else (self.wallet_b, self.wallet_a)
+            for _ in range(self.OPS_PER_WORKER):
+                ledger.transfer(src.pk, dst.pk, Decimal('1.00'))
+
+        errors = run_in_threads(self.WORKERS, _transfer)
+        self.assertEqual(errors, [])
+        self.wallet_a.refresh_from_db()
+        self.wallet_b.refresh_from_db()
+        self.assertEqual(self.wallet_a.balance + self.wallet_b.balance, Decimal('2000.00'))
+        self.assertEqual(self.wallet_a.balance, Decimal('1000.00'))
+
+
+@override_settings(SIDE_EFFECTS={})
+class LedgerJournalTests(TransactionTestCase):
+    def setUp(self):
+        self.wallet = User.objects.create(username='journal_a').wallet
+
+    def record(self, transaction_type, amount, **fields):
+        fields.setdefault('status', Transaction.Status.COMPLETED)
+        return Transaction.objects.create(
+            wallet=self.wallet, transaction_type=transaction_type, amount=Decimal(amount), **fields
+        )
+
+    def test_journal_and_snapshots_agree_with_balance(self):
+        self.record('charge', '100.00')
+        self.record('payment', '30.00')
+        self.assertEqual(ledger.get_balance(self.wallet.pk), Decimal('70.00'))
+
+        self.assertEqual(ledger.take_snapshots(), 1)
+        self.assertEqual(ledger.take_snapshots(), 0)
+        self.record('transfer', '10.00', metadata={'direction': 'out'})
+        self.record('refund', '2.50')
+
+        self.assertEqual(ledger.journal_balance(self.wallet.pk), Decimal('62.50'))
+        self.assertEqual(ledger.take_snapshots(), 1)
+        snapshot = WalletSnapshot.objects.filter(wallet=self.wallet).first()
+        self.assertEqual(snapshot.balance, Decimal('62.50'))
+        self.assertEqual(ledger.journal_balance(self.wallet.pk), ledger.get_balance(self.wallet.pk))
+
+    def test_snapshot_never_skips_a_lower_id_committed_late(self):
+        inserted, release = threading.Event(), threading.Event()
+
+        def _slow_insert():
+            try:
+                with transaction.atomic():
+                    self.record('charge', '40.00')
+                    inserted.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        worker = threading.Thread(target=_slow_insert)
+        worker.start()
+        inserted.wait(10)
+        other = User.objects.create(username='journal_b').wallet
+        Transaction.objects.create(
+            wallet=other, transaction_type='charge', amount=Decimal('1.00'), status=Transaction.Status.COMPLETED
+        )
+
+        # العملية الأقدم معرّفاً لم تُثبَّت بعد، فتؤجَّل اللقطة بدل أن تتخطاها
+        with mock.patch.object(ledger, 'SNAPSHOT_LOCK_TIMEOUT_MS', 100):
+            self.assertEqual(ledger.take_snapshots(), 0)
+        release.set()
+        worker.join()
+
+        self.assertEqual(ledger.take_snapshots(), 2)
+        self.assertEqual(WalletSnapshot.objects.get(wallet=self.wallet).balance, Decimal('40.00'))
+        self.assertEqual(ledger.journal_balance(self.wallet.pk), Decimal('40.00'))
+
+    def test_rebuild_repairs_drift_and_snapshots(self):
+        self.record('charge', '20.00')
+        Wallet.objects.filter(pk=self.wallet.pk).update(balance=Decimal('999.00'))
+        out = io.StringIO()
+
+        call_command('rebuild_wallet_balances', stdout=out)
+        self.assertEqual(ledger.get_balance(self.wallet.pk), Decimal('999.00'))
+        self.assertIn('999.00', out.getvalue())
+
+        call_command('rebuild_wallet_balances', apply=True, snapshot=True, stdout=io.StringIO())
+        self.assertEqual(ledger.get_balance(self.wallet.pk), Decimal('20.00'))
+        self.assertEqual(WalletSnapshot.objects.get(wallet=self.wallet).balance, Decimal('20.00'))
+
+    def test_existing_balances_are_seeded_as_opening_snapshots(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('apis', '0001_initial')])
+        old_apps = executor.loader.project_state([('apis', '0001_initial')]).apps
+        owner = old_apps.get_model('auth', 'User').objects.create(username='journal_legacy')
+        legacy = old_apps.get_model('apis', 'Wallet').objects.create(user_id=owner.pk, balance=Decimal('75.00'))
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('apis'))
+
+        self.assertEqual(WalletSnapshot.objects.get(wallet_id=legacy.pk).balance, Decimal('75.00'))
+        self.assertEqual(ledger.journal_balance(legacy.pk), Decimal('75.00'))
+        Transaction.objects.create(
+            wallet_id=legacy.pk, transaction_type='charge', amount=Decimal('5.00'),
+            status=Transaction.Status.COMPLETED,
+        )
+        call_command('rebuild_wallet_balances', apply=True, stdout=io.StringIO())
+        self.assertEqual(ledger.get_balance(legacy.pk), Decimal('80.00'))
+        self.assertEqual(ledger.journal_balance(legacy.pk), Decimal('80.00'))
+
+
+@override_settings(SIDE_EFFECTS={})
+class BulkPayoutTests(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'payee_{i}') for i in range(3)]
+
+    def test_csv_rows_resolve_usernames_and_ids(self):
+        csv_file = io.BytesIO(
+            f"username,amount\npayee_0,10.50\n{self.users[1].pk},4\n\npayee_2, 0.25 \n".encode('utf-8-sig')
+        )
+        self.assertEqual(read_credit_csv(csv_file), [
+            (self.users[0].pk, Decimal('10.50')),
+            (self.users[1].pk, Decimal('4')),
+            (self.users[2].pk, Decimal('0.25')),
+        ])
+
+    def test_non_finite_amounts_are_rejected_per_line(self):
+        for amount in ('NaN', 'sNaN', 'Infinity', '-inf', 'abc', ''):
+            with self.subTest(amount=amount):
+                with self.assertRaisesMessage(ValueError, 'مبلغ غير صالح في السطر 2.'):
+                    parse_credit_rows([('payee_0', '1'), ('payee_1', amount)])
+        with self.assertRaises(ValueError):
+            ledger.bulk_credit([(self.users[0].pk, Decimal('NaN'))])
+
+    def test_award_bonuses_credits_once_per_line(self):
+        entries = [(self.users[0].pk, Decimal('5.00')), (self.users[0].pk, Decimal('2.50')),
+                   (self.users[1].pk, Decimal('1.00'))]
+        bonuses = award_bonuses(entries, reason='promotion')
+
+        self.assertEqual(len(bonuses), 3)
+        self.assertTrue(all(b.processed for b in Bonus.objects.all()))
+        self.assertEqual(ledger.get_balance(self.users[0].wallet.pk), Decimal('7.50'))
+        self.assertEqual(Transaction.objects.filter(wallet=self.users[0].wallet).count(), 2)
+        self.assertEqual(ledger.journal_balance(self.users[0].wallet.pk), Decimal('7.50'))
+
+    def test_missing_wallet_rolls_back_the_whole_batch(self):
+        Wallet.objects.filter(user=self.users[2]).delete()
+        with self.assertRaises(ValueError):
+            award_bonuses([(self.users[0].pk, Decimal('5.00')), (self.users[2].pk, Decimal('5.00'))])
+        self.assertFalse(Bonus.objects.exists())
+        self.assertEqual(ledger.get_balance(self.users[0].wallet.pk), Decimal('0.00'))
+
+        created, missing = ledger.bulk_credit([(self.users[0].pk, '3'), (self.users[2].pk, '3')])
+        self.assertEqual((len(created), missing), (1, [self.users[2].pk]))
+
+
+class SideEffectDispatchTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+        self.done = threading.Event()
+
+        def probe(value):
+            self.calls.append((value, threading.current_thread().name))
+            self.done.set()
+
+        registry = mock.patch.dict(side_effects.registry, {'probe': probe})
+        registry.start()
+        self.addCleanup(registry.stop)
+
+    def dispatch_in_transaction(self, mode, rollback=False):
+        with self.settings(SIDE_EFFECTS={'probe': mode}):
+            try:
+                with transaction.atomic():
+                    side_effects.dispatch('probe', 7)
+                    pending = list(self.calls)
+                    if rollback:
+                        raise RuntimeError
+            except RuntimeError:
+                pass
+        return pending
+
+    def test_sync_and_unknown_modes_run_inside_the_transaction(self):
+        self.assertEqual(self.dispatch_in_transaction('sync'), [(7, 'MainThread')])
+        self.assertEqual(len(self.dispatch_in_transaction('later')), 2)
+
+    def test_on_commit_runs_after_commit_and_never_after_rollback(self):
+        self.assertEqual(self.dispatch_in_transaction('on_commit'), [])
+        self.assertEqual(self.calls, [(7, 'MainThread')])
+        self.dispatch_in_transaction('on_commit', rollback=True)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_thread_mode_runs_in_the_background_pool(self):
+        self.assertEqual(self.dispatch_in_transaction('thread'), [])
+        self.assertTrue(self.done.wait(5))
+        self.assertTrue(self.calls[0][1].startswith('side-effects'))
+
+    def test_celery_mode_sends_a_task_and_falls_back_to_a_thread(self):
+        with mock.patch('apis.tasks.run_side_effect.delay') as delay:
+            self.dispatch_in_transaction('celery')
+        delay.assert_called_once_with('probe', 7)
+        self.assertEqual(self.calls, [])
+
+        with mock.patch('apis.tasks.run_side_effect.delay', side_effect=OSError('broker down')):
+            self.dispatch_in_transaction('celery')
+        self.assertTrue(self.done.wait(5))
+        self.assertTrue(self.calls[0][1].startswith('side-effects'))
+
+
+@override_settings(
+    SIDE_EFFECTS={},
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+)
+class RealtimeUpdatesTests(TransactionTestCase):
+    def setUp(self):
+        self.sender = User.objects.create(username='rt_sender')
+        self.receiver = User.objects.create(username='rt_receiver')
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.sender, self.receiver])
+
+        driver_user = User.objects.create(username='rt_driver')
+        self.driver = Driver.objects.create(
+            user=driver_user, phone_number='+966500000000', where_location='-', license_number='RT-1'
+        )
+        vehicle = Vehicle.objects.create(model='-', plate_number='RT-1', color='-', capacity=4)
+        self.trip = Trip.objects.create(
+            from_location='A', to_location='B', departure_time=timezone.now() + timedelta(hours=1),
+            available_seats=4, driver=self.driver, vehicle=vehicle,
+        )
+
+    async def connect(self, user=None):
+        path = '/ws/updates/'
+        if user:
+            path += f'?token={AccessToken.for_user(user)}'
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        return communicator, connected
+
+    async def test_anonymous_connection_is_rejected(self):
+        communicator, connected = await self.connect()
+        self.assertFalse(connected)
+
+    async def test_new_message_is_pushed_to_participants(self):
+        communicator, connected = await self.connect(self.receiver)
+        self.assertTrue(connected)
+
+        message = await database_sync_to_async(Message.objects.create)(
+            chat=self.chat, sender=self.sender, content='مرحبا'
+        )
+        event = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(event['type'], 'message.new')
+        self.assertEqual(event['data']['id'], message.pk)
+        self.assertEqual(event['data']['content'], 'مرحبا')
+        await communicator.disconnect()
+
+    async def test_trip_subscribers_receive_seat_changes(self):
+        communicator, connected = await self.connect(self.driver.user)
+        self.assertTrue(connected)
+        await communicator.send_json_to({'action': 'subscribe_trip', 'trip': self.trip.pk})
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['type'], 'subscribed')
+
+        await database_sync_to_async(seats.reserve_seats)(self.trip.pk, 3)
+        event = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(event['type'], 'trip.updated')
+        self.assertEqual(event['data']['booked_seats'], 3)
+        self.assertEqual(event['data']['available_seats'], 1)
+        await communicator.disconnect()
+
+    async def test_other_users_cannot_subscribe_to_trip(self):
+        await database_sync_to_async(Driver.objects.create)(
+            user=self.sender, phone_number='+966500000001', where_location='-', license_number='RT-2'
+        )
+        communicator, connected = await self.connect(self.sender)
+        await communicator.send_json_to({'action': 'subscribe_trip', 'trip': self.trip.pk})
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['type'], 'error')
+        await communicator.disconnect()
+
+
+@override_settings(SIDE_EFFECTS={})
+class ChatReadCursorTests(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'reader_{i}') for i in range(3)]
+        self.chat = Chat.objects.create()
+        self.chat.participants.set(self.users)
+
+    def send(self, sender, content='مرحبا'):
+        return Message.objects.create(chat=self.chat, sender=sender, content=content)
+
+    def unread(self, user):
+        return ChatReadCursor.objects.get(chat=self.chat, user=user).unread_count
+
+    def test_sending_counts_unread_for_the_other_participants(self):
+        self.send(self.users[0])
+        last = self.send(self.users[1])
+        # المرسل قرأ المحادثة حتى رسالته
+        self.assertEqual([self.unread(u) for u in self.users], [1, 0, 2])
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.last_message_id, last.pk)
+        listed = chats.chats_for_user(self.users[2]).get(pk=self.chat.pk)
+        self.assertEqual(listed.unread_count, 2)
+
+    def test_mark_read_only_moves_forward(self):
+        first = self.send(self.users[0])
+        self.send(self.users[0])
+        self.assertEqual(chats.mark_read(self.chat.pk, self.users[1].pk, first.pk), 1)
+        self.assertEqual(self.unread(self.users[1]), 1)
+        self.assertEqual(chats.mark_read(self.chat.pk, self.users[1].pk), 1)
+        self.assertEqual(self.unread(self.users[1]), 0)
+        self.assertEqual(chats.mark_read(self.chat.pk, self.users[1].pk, first.pk), 0)
+        self.assertEqual(self.unread(self.users[1]), 0)
+
+    def test_cursors_follow_participant_changes(self):
+        newcomer = User.objects.create(username='reader_new')
+        self.chat.participants.add(newcomer)
+        self.send(self.users[0])
+        self.assertEqual(self.unread(newcomer), 1)
+        self.chat.participants.remove(newcomer)
+        self.assertFalse(ChatReadCursor.objects.filter(chat=self.chat, user=newcomer).exists())
+        newcomer.chats.add(self.chat)
+        self.assertTrue(ChatReadCursor.objects.filter(chat=self.chat, user=newcomer).exists())
+
+
+@override_settings(SIDE_EFFECTS={})
+class MessageKeysetPagingTests(TransactionTestCase):
+    def setUp(self):
+        self.reader, sender = User.objects.create(username='pager_a'), User.objects.create(username='pager_b')
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.reader, sender])
+        self.ids = [Message.objects.create(chat=self.chat, sender=sender, content=str(i)).pk for i in range(7)]
+        self.api = APIClient()
+        self.api.force_authenticate(self.reader)
+
+    def page(self, **params):
+        response = self.api.get(f'/chats/{self.chat.pk}/messages/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_windows_page_back_and_catch_up(self):
+        first = self.page(limit=3)
+        self.assertEqual([m['id'] for m in first['results']], self.ids[:-4:-1])
+        self.assertTrue(first['has_more'])
+
+        older = self.page(limit=3, before_id=first['oldest_id'])
+        oldest = self.page(limit=3, before_id=older['oldest_id'])
+        self.assertEqual([m['id'] for m in older['results'] + oldest['results']], self.ids[3::-1])
+        self.assertFalse(oldest['has_more'])
+
+        newer = self.page(limit=2, after_id=self.ids[3])
+        self.assertEqual([m['id'] for m in newer['results']], [self.ids[5], self.ids[4]])
+        self.assertTrue(newer['has_more'])
+        self.assertEqual(self.page(after_id=self.ids[-1])['results'], [])
+
+    def test_invalid_parameters_are_rejected(self):
+        url = f'/chats/{self.chat.pk}/messages/'
+        for params in ({'before_id': 'x'}, {'limit': -1}, {'before_id': 1, 'after_id': 1}):
+            with self.subTest(params=params):
+                self.assertEqual(self.api.get(url, params).status_code, 400)
+        self.assertEqual(len(self.page(limit=1000)['results']), 7)
+
+    def test_reading_history_advances_the_cursor(self):
+        self.page(limit=1)
+        cursor = ChatReadCursor.objects.get(chat=self.chat, user=self.reader)
+        self.assertEqual((cursor.last_read_message_id, cursor.unread_count), (self.ids[-1], 0))
+
+
+@override_settings(SIDE_EFFECTS={})
+class DirectChatTests(TransactionTestCase):
+    def setUp(self):
+        self.a, self.b = User.objects.create(username='direct_a'), User.objects.create(username='direct_b')
+
+    def test_pair_key_is_order_independent(self):
+        chat, created = chats.get_or_create_direct_chat(self.b.pk, self.a.pk)
+        self.assertTrue(created)
+        self.assertEqual(chat.direct_key, f'{self.a.pk}:{self.b.pk}')
+        self.assertEqual(set(chat.participants.values_list('pk', flat=True)), {self.a.pk, self.b.pk})
+        self.assertEqual(chats.get_or_create_direct_chat(self.a.pk, self.b.pk), (chat, False))
+
+    def test_concurrent_requests_share_one_chat(self):
+        found = []
+        run_in_threads(6, lambda i: found.append(chats.get_or_create_direct_chat(self.a.pk, self.b.pk)[0].pk))
+        self.assertEqual(len(found), 6)
+        self.assertEqual(len(set(found)), 1)
+        self.assertEqual(Chat.objects.filter(direct_key__isnull=False).count(), 1)
+
+
+def make_driver(username, **fields):
+    user = User.objects.create(username=username)
+    return Driver.objects.create(
+        user=user, phone_number=f'+9665{user.pk:08d}', where_location='-', license_number=username, **fields
+    )
+
+
+@override_settings(SIDE_EFFECTS={})
+class SeatCounterTests(TransactionTestCase):
+    def setUp(self):
+        self.vehicle = Vehicle.objects.create(model='-', plate_number='ST-1', color='-', capacity=4)
+        self.trips = [
+            Trip.objects.create(
+                from_location='A', to_location='B', departure_time=timezone.now() + timedelta(hours=1),
+                available_seats=4, driver=make_driver(f'seat_driver_{i}'), vehicle=self.vehicle,
+            )
+            for i in range(2)
+        ]
+        self.customer = Client.objects.create(
+            user=User.objects.create(username='seat_customer'), phone_number='+966500000400', city='-'
+        )
+
+    def book(self, seats, trip=None):
+        return Booking.objects.create(
+            trip=trip or self.trips[0], customer=self.customer, seats=seats, total_price=Decimal('10.00')
+        )
+
+    def counter(self, trip=None):
+        trip = trip or self.trips[0]
+        trip.refresh_from_db()
+        return trip.booked_seats, trip.available_seats, trip.status
+
+    def test_counter_follows_create_update_cancel_and_delete(self):
+        booking = self.book([1, 2])
+        self.assertEqual(self.counter(), (2, 2, Trip.Status.PENDING))
+        booking.seats = [1, 2, 3, 4]
+        booking.save()
+        self.assertEqual(self.counter(), (4, 0, Trip.Status.FULL))
+        with self.assertRaises(ValueError):
+            self.book([5])
+
+        booking.status = Booking.Status.CANCELLED
+        booking.save()
+        self.assertEqual(self.counter(), (0, 4, Trip.Status.PENDING))
+        self.book([1]).delete()
+        self.assertEqual(self.counter(), (0, 4, Trip.Status.PENDING))
+
+    def test_deferred_fields_use_the_stored_row(self):
+        booking = self.book([1, 2])
+        deferred = Booking.objects.only('id', 'status').get(pk=booking.pk)
+        deferred.status = Booking.Status.CANCELLED
+        deferred.save()
+        self.assertEqual(self.counter(), (0, 4, Trip.Status.PENDING))
+
+        booking = self.book([1, 2, 3])
+        moved = Booking.objects.defer('trip', 'seats').get(pk=booking.pk)
+        moved.trip = self.trips[1]
+        moved.save()
+        self.assertEqual(self.counter(), (0, 4, Trip.Status.PENDING))
+        self.assertEqual(self.counter(self.trips[1])[0], 3)
+
+        Booking.objects.only('id').get(pk=booking.pk).delete()
+        self.assertEqual(self.counter(self.trips[1])[0], 0)
+
+    def test_reconcile_repairs_drift(self):
+        self.book([1, 2, 3, 4])
+        Trip.objects.filter(pk=self.trips[0].pk).update(booked_seats=1, available_seats=3, status=Trip.Status.PENDING)
+        self.assertEqual(seats.reconcile_trip_seats(), 1)
+        self.assertEqual(self.counter(), (4, 0, Trip.Status.FULL))
+        self.assertEqual(seats.reconcile_trip_seats(), 0)
+
+    def test_saving_a_stale_trip_keeps_the_counter(self):
+        stale = Trip.objects.get(pk=self.trips[0].pk)
+        self.book([1, 2, 3, 4])
+        stale.price_per_seat = Decimal('15.00')
+        stale.save()
+        self.assertEqual(self.counter(), (4, 0, Trip.Status.FULL))
+        self.assertEqual(self.trips[0].price_per_seat, Decimal('15.00'))
+
+        stale.status = Trip.Status.CANCELLED
+        stale.save()
+        self.assertEqual(self.counter(), (4, 0, Trip.Status.CANCELLED))
+
+
+@override_settings(SIDE_EFFECTS={})
+class DriverRatingTests(TransactionTestCase):
+    def setUp(self):
+        self.drivers = [make_driver(f'rated_driver_{i}') for i in range(2)]
+        vehicle = Vehicle.objects.create(model='-', plate_number='RA-1', color='-', capacity=4)
+        self.trip = Trip.objects.create(
+            from_location='A', to_location='B', departure_time=timezone.now() + timedelta(hours=1),
+            available_seats=4, driver=self.drivers[0], vehicle=vehicle,
+        )
+        self.clients = [
+            Client.objects.create(
+                user=User.objects.create(username=f'rater_{i}'), phone_number=f'+96650000050{i}', city='-'
+            )
+            for i in range(2)
+        ]
+
+    def rate(self, client, value, driver=None):
+        return Rating.objects.create(trip=self.trip, rated_by=client, driver=driver or self.drivers[0], rating=value)
+
+    def stats(self, driver=None):
+        driver = driver or self.drivers[0]
+        driver.refresh_from_db()
+        return driver.rating_sum, driver.rating_count, driver.rating
+
+    def test_average_follows_create_update_and_delete(self):
+        first = self.rate(self.clients[0], 5)
+        self.rate(self.clients[1], 2)
+        self.assertEqual(self.stats(), (7, 2, 3.5))
+
+        first.rating = 3
+        first.save()
+        self.assertEqual(self.stats(), (5, 2, 2.5))
+        first.driver = self.drivers[1]
+        first.save()
+        self.assertEqual(self.stats(), (2, 1, 2.0))
+        self.assertEqual(self.stats(self.drivers[1]), (3, 1, 3.0))
+
+        first.delete()
+        self.assertEqual(self.stats(self.drivers[1]), (0, 0, 0.0))
+
+    def test_deferred_fields_use_the_stored_row(self):
+        rating = self.rate(self.clients[0], 4)
+        deferred = Rating.objects.only('id', 'comment').get(pk=rating.pk)
+        deferred.comment = 'ممتاز'
+        deferred.save()
+        self.assertEqual(self.stats(), (4, 1, 4.0))
+
+        Rating.objects.only('id').get(pk=rating.pk).delete()
+        self.assertEqual(self.stats(), (0, 0, 0.0))
+
+    def test_backfill_recomputes_counters(self):
+        self.rate(self.clients[0], 5)
+        self.rate(self.clients[1], 4)
+        Driver.objects.update(rating_sum=0, rating_count=0, rating=0)
+        ratings.backfill_driver_ratings()
+        self.assertEqual(self.stats(), (9, 2, 4.5))
+        self.assertEqual(self.stats(self.drivers[1]), (0, 0, 0.0))
+
+
+@override_settings(SIDE_EFFECTS={}, DRIVER_HEARTBEAT_TIMEOUT=300)
+class DriverAvailabilityTests(TransactionTestCase):
+    def setUp(self):
+        self.vehicle = Vehicle.objects.create(model='-', plate_number='AV-1', color='-', capacity=4)
+
+    def make_trip(self, driver):
+        return Trip.objects.create(
+            from_location='A', to_location='B', departure_time=timezone.now() + timedelta(hours=1),
+            available_seats=4, driver=driver, vehicle=self.vehicle,
+        )
+
+    def available(self, driver):
+        driver.refresh_from_db()
+        return driver.is_available
+
+    def test_driver_without_pings_stays_available(self):
+        driver = make_driver('av_no_pings')
+        self.assertEqual(availability.reconcile_availability(), (0, 0))
+        self.assertTrue(self.available(driver))
+        self.assertIn(driver, availability.available_drivers())
+
+    def test_stale_heartbeat_withdraws_and_fresh_one_returns(self):
+        stale = make_driver('av_stale', location_updated_at=timezone.now() - timedelta(hours=1))
+        fresh = make_driver('av_fresh', location_updated_at=timezone.now(), is_available=False)
+        self.assertEqual(availability.reconcile_availability(), (1, 1))
+        self.assertFalse(self.available(stale))
+        self.assertTrue(self.available(fresh))
+        self.assertNotIn(stale, availability.available_drivers())
+
+    def test_heartbeat_expiry_can_be_disabled(self):
+        driver = make_driver('av_disabled', location_updated_at=timezone.now() - timedelta(days=1))
+        with self.settings(DRIVER_HEARTBEAT_TIMEOUT=0):
+            availability.reconcile_availability()
+            self.assertIn(driver, availability.available_drivers())
+        self.assertTrue(self.available(driver))
+
+    def test_driver_returns_when_last_open_trip_closes(self):
+        driver = make_driver('av_trips')
+        first, second = self.make_trip(driver), self.make_trip(driver)
+        self.assertFalse(self.available(driver))
+
+        first.status = Trip.Status.COMPLETED
+        first.save()
+        self.assertFalse(self.available(driver))
+        second.status = Trip.Status.CANCELLED
+        second.save()
+        self.assertTrue(self.available(driver))
+
+    def test_reconcile_fixes_bulk_status_updates(self):
+        driver = make_driver('av_bulk')
+        trip = self.make_trip(driver)
+        Driver.objects.filter(pk=driver.pk).update(is_available=True)
+        self.assertEqual(availability.reconcile_availability(), (0, 1))
+        self.assertFalse(self.available(driver))
+
+        Trip.objects.filter(pk=trip.pk).update(status=Trip.Status.COMPLETED)
+        self.assertEqual(availability.reconcile_availability(), (1, 0))
+        self.assertTrue(self.available(driver))
+
+
+@override_settings(SIDE_EFFECTS={}, DRIVER_LOCATION_FLUSH_INTERVAL=0)
+class DriverLocationTests(TransactionTestCase):
+    def setUp(self):
+        store = mock.patch.object(locations, '_store', locations.MemoryLocationStore())
+        store.start()
+        self.addCleanup(store.stop)
+        self.driver = make_driver('loc_driver')
+        self.api = APIClient()
+        self.api.force_authenticate(self.driver.user)
+
+    def ping(self, *points):
+        return self.api.post('/drivers/location/', {'points': list(points)}, format='json')
+
+    def test_newest_point_is_flushed_to_the_driver_row(self):
+        now = timezone.now()
+        response = self.ping(
+            {'lat': 24.1, 'lon': 46.1, 'ts': (now - timedelta(seconds=20)).isoformat()},
+            {'lat': 24.2, 'lon': 46.2, 'ts': (now - timedelta(seconds=10)).isoformat()},
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertTrue(response.data['accepted'])
+
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.latitude, self.driver.longitude), (24.2, 46.2))
+        self.assertAlmostEqual(
+            self.driver.location_updated_at.timestamp(), (now - timedelta(seconds=10)).timestamp(), places=3
+        )
+        self.assertEqual(locations.get_positions([self.driver.pk]), {self.driver.pk: (24.2, 46.2)})
+
+    def test_late_batch_does_not_override_a_newer_position(self):
+        now = timezone.now()
+        self.ping({'lat': 24.2, 'lon': 46.2, 'ts': now.isoformat()})
+        response = self.ping({'lat': 24.1, 'lon': 46.1, 'ts': (now - timedelta(minutes=1)).isoformat()})
+        self.assertFalse(response.data['accepted'])
+        self.assertEqual(locations.get_positions([self.driver.pk]), {self.driver.pk: (24.2, 46.2)})
+
+    def test_memory_store_flushes_in_the_receiving_process(self):
+        # عامل Celery لا يرى ذاكرة عملية الويب، فلا يُرسل إليه ترحيل مخزن الذاكرة
+        with self.settings(SIDE_EFFECTS={'flush_driver_locations': 'celery'}), \
+                mock.patch('apis.locations.dispatch') as dispatch:
+            self.ping({'lat': 24.3, 'lon': 46.3})
+            dispatch.assert_not_called()
+        self.driver.refresh_from_db()
+        self.assertEqual(self.driver.latitude, 24.3)
+
+    def test_other_accounts_cannot_ping(self):
+        self.api.force_authenticate(User.objects.create(username='loc_customer'))
+        self.assertEqual(self.ping({'lat': 24.3, 'lon': 46.3}).status_code, 403)
+
+    def test_editing_where_location_updates_the_coordinates(self):
+        response = self.api.patch(f'/drivers/{self.driver.pk}/', {'where_location': '24.5,46.5'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.latitude, self.driver.longitude), (24.5, 46.5))
+        self.assertIsNotNone(self.driver.location_updated_at)
+        self.assertEqual(locations.get_positions([self.driver.pk]), {self.driver.pk: (24.5, 46.5)})
+
+        # اسم مكان بلا إحداثيات لا يمحو آخر موقع معروف
+        self.driver.where_location = 'حي النرجس'
+        self.driver.save()
+        self.driver.refresh_from_db()
+        self.assertEqual((self.driver.latitude, self.driver.longitude), (24.5, 46.5))
+
+
+@override_settings(SIDE_EFFECTS={})
+class NearbyTripSearchTests(TransactionTestCase):
+    PICKUP, DROPOFF = (24.7136, 46.6753), (21.4858, 39.1925)
+
+    def setUp(self):
+        self.vehicle = Vehicle.objects.create(model='-', plate_number='NB-1', color='-', capacity=4)
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create(username='searcher'))
+
+    def trip(self, name, start, end, hours=2, **fields):
+        fields.setdefault('available_seats', 4)
+        return Trip.objects.create(
+            from_location='%s,%s' % start, to_location='%s,%s' % end,
+            departure_time=timezone.now() + timedelta(hours=hours),
+            driver=make_driver(name), vehicle=self.vehicle, **fields
+        )
+
+    def search(self, **params):
+        query = dict(zip(('from_lat', 'from_lon', 'to_lat', 'to_lon'), self.PICKUP + self.DROPOFF), **params)
+        response = self.api.get('/trips/nearby/', query)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_geohash_matches_the_reference_encoding(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        trip = self.trip('nb_plain', self.PICKUP, self.DROPOFF)
+        self.assertEqual(trip.from_geohash, geohash.encode(*self.PICKUP))
+        broken = self.trip('nb_broken', ('x', 'y'), self.DROPOFF)
+        self.assertEqual((broken.from_geohash, broken.from_lat), ('', None))
+
+    def test_results_are_filtered_and_ranked_by_distance(self):
+        near = self.trip('nb_near', (24.7140, 46.6760), (21.4860, 39.1930))
+        nearer = self.trip('nb_nearer', (24.7137, 46.6754), self.DROPOFF)
+        self.trip('nb_far_pickup', (24.80, 46.80), self.DROPOFF)
+        self.trip('nb_far_dropoff', self.PICKUP, (21.60, 39.30))
+        self.trip('nb_full', self.PICKUP, self.DROPOFF, available_seats=1)
+        self.trip('nb_later', self.PICKUP, self.DROPOFF, hours=48)
+        self.trip('nb_done', self.PICKUP, self.DROPOFF, status=Trip.Status.COMPLETED)
+
+        self.assertEqual(self.search(seats=2), [nearer.pk, near.pk])
+        self.assertEqual(len(self.search(seats=2, radius=30)), 4)
+
+    def test_search_crosses_geohash_cell_edges(self):
+        # نقطتان على جانبي حد خلية بدقة 5 تقريباً، وبينهما أقل من كيلومتر
+        lat, lon = 24.697265625, 46.669921875
+        trip = self.trip('nb_edge', (lat + 0.002, lon + 0.002), self.DROPOFF)
+        self.assertNotEqual(trip.from_geohash[:5], geohash.encode(lat - 0.002, lon - 0.002)[:5])
+        self.assertEqual(
+            [t.pk for t, *_ in trip_search.nearby_trips(lat - 0.002, lon - 0.002, *self.DROPOFF, radius=1)],
+            [trip.pk],
+        )
+        self.assertEqual(trip_search.closest_open_trip(lat - 0.002, lon - 0.002, *self.DROPOFF, radius=1), trip)
+
+
+class SchedulerRequestsMixin:
+    def setUp(self):
+        self.customer = Client.objects.create(
+            user=User.objects.create(username='sched_customer'), phone_number='+966500000300', city='-'
+        )
+
+    def age(self, model, pk, minutes):
+        model.objects.filter(pk=pk).update(created_at=timezone.now() - timedelta(minutes=minutes))
+        return pk
+
+    def booking(self, minutes=0, from_location='24.71,46.67', **fields):
+        booking = CasheBooking.objects.create(
+            user=self.customer, from_location=from_location, to_location='24.80,46.70',
+            departure_time=timezone.now() + timedelta(hours=2), passengers=1, **fields
+        )
+        return self.age(CasheBooking, booking.pk, minutes)
+
+    def delivery(self, minutes=0, **fields):
+        delivery = CasheItemDelivery.objects.create(
+            user=self.customer, from_location='24.71,46.67', to_location='24.80,46.70',
+            receiver_name='-', receiver_phone='-', item_description='-', weight=Decimal('2.50'), **fields
+        )
+        return self.age(CasheItemDelivery, delivery.pk, minutes)
+
+    def keys(self, batch):
+        return list(zip(batch.rows['kind'].tolist(), batch.rows['id'].tolist()))
+
+
+@override_settings(
+    SIDE_EFFECTS={}, TRIP_SCHEDULER_TRIGGER='', TRIP_SCHEDULER_ROUND_BUDGET=3,
+    TRIP_SCHEDULER_AGING_SECONDS=15 * 60, TRIP_SCHEDULER_RETRY_BACKOFF=120,
+)
+class SchedulerQueueTests(SchedulerRequestsMixin, TransactionTestCase):
+    def run_round(self):
+        SchedulerCommand(stdout=io.StringIO()).run_scheduler({'min_cluster_size': 100})
+
+    def test_urgent_and_aged_requests_come_first(self):
+        normal = self.booking(minutes=1)
+        aged = self.booking(minutes=30)
+        urgent = self.delivery(urgent=True)
+        older_normal = self.delivery(minutes=2)
+
+        batch, remaining = load_queue(3)
+        self.assertEqual(self.keys(batch), [(BOOKING, aged), (DELIVERY, urgent), (DELIVERY, older_normal)])
+        self.assertEqual(remaining, 1)
+        self.assertNotIn((BOOKING, normal), self.keys(batch))
+
+    def test_attempted_requests_back_off(self):
+        first = [self.booking(minutes=10 - i) for i in range(3)]
+        newest = self.booking()
+
+        batch, _ = load_queue(3)
+        self.assertEqual(self.keys(batch), [(BOOKING, pk) for pk in first])
+        batch.mark_attempted(range(len(batch)))
+
+        batch, remaining = load_queue(3)
+        self.assertEqual(self.keys(batch), [(BOOKING, newest)])
+        self.assertEqual(remaining, 0)
+
+        CasheBooking.objects.update(last_attempt_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(len(load_queue(10)[0]), 4)
+
+    def test_round_without_drivers_does_not_retrigger_itself(self):
+        pks = [self.booking(minutes=10 - i) for i in range(4)]
+        with mock.patch('apis.management.commands.dbscan_clustering.request_run') as request_run:
+            self.run_round()
+            request_run.assert_not_called()
+        attempted = CasheBooking.objects.filter(last_attempt_at__isnull=False)
+        self.assertEqual(sorted(attempted.values_list('pk', flat=True)), pks[:3])
+        self.assertEqual(set(CasheBooking.objects.values_list('status', flat=True)), {CasheBooking.Status.PENDING})
+
+        # الجولة التالية تأخذ الطلب الذي لم يُجرَّب بدل إعادة نفس الطلبات الأقدم
+        batch, _ = load_queue(3)
+        self.assertEqual(self.keys(batch), [(BOOKING, pks[3])])
+
+    def test_invalid_coordinates_are_not_reloaded_every_round(self):
+        invalid = self.booking(from_location='nowhere')
+        self.run_round()
+        self.assertIsNotNone(CasheBooking.objects.get(pk=invalid).last_attempt_at)
+        self.assertEqual(len(load_queue(3)[0]), 0)
+
+    def test_round_deadline_carries_requests_over_untouched(self):
+        pks = [self.booking(minutes=10 - i) for i in range(2)]
+        with self.settings(TRIP_SCHEDULER_ROUND_SECONDS=0), \
+                mock.patch('apis.management.commands.dbscan_clustering.request_run') as request_run:
+            self.run_round()
+            # لم يُسند شيء، فلا تُطلب جولة فورية تعيد نفس العمل
+            request_run.assert_not_called()
+        self.assertFalse(CasheBooking.objects.filter(last_attempt_at__isnull=False).exists())
+        self.assertEqual(self.keys(load_queue(3)[0]), [(BOOKING, pk) for pk in pks])
+
+
+@override_settings(SIDE_EFFECTS={})
+class AttachmentUploadTests(TransactionTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        paths = self.settings(
+            MEDIA_ROOT=os.path.join(root.name, 'media'),
+            ATTACHMENT_UPLOAD_DIR=os.path.join(root.name, 'uploads'),
+        )
+        paths.enable()
+        self.addCleanup(paths.disable)
+        self.user = User.objects.create(username='uploader')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def start(self, size, filename='report.pdf'):
+        response = self.api.post('/attachments/uploads/', {'filename': filename, 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def send(self, upload_id, offset, body):
+        return self.api.patch(
+            f'/attachments/uploads/{upload_id}/', body,
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def upload(self, body):
+        upload_id = self.start(len(body))
+        self.assertEqual(self.send(upload_id, 0, body).status_code, 200)
+        response = self.api.post(f'/attachments/uploads/{upload_id}/complete/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_chunks_resume_from_the_server_offset(self):
+        upload_id = self.start(10)
+        response = self.send(upload_id, 0, b'01234')
+        self.assertEqual(response['Upload-Offset'], '5')
+
+        response = self.send(upload_id, 3, b'34567')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 5)
+        self.assertEqual(self.send(upload_id, 5, b'56789abc').status_code, 400)
+        self.assertEqual(self.api.post(f'/attachments/uploads/{upload_id}/complete/').status_code, 400)
+
+        self.send(upload_id, 5, b'56789')
+        data = self.api.post(f'/attachments/uploads/{upload_id}/complete/').data
+        self.assertEqual(data['status'], AttachmentUpload.Status.COMPLETE)
+        blob = AttachmentUpload.objects.get(pk=upload_id).blob
+        with blob.file.open('rb') as fh:
+            self.assertEqual(fh.read(), b'0123456789')
+        self.assertFalse(os.path.exists(attachments.temp_path(upload_id)))
+
+    def test_identical_content_is_stored_once(self):
+        first = self.upload(b'same bytes')
+        second = self.upload(b'same bytes')
+        self.assertEqual(first['blob']['id'], second['blob']['id'])
+        self.assertNotEqual(first['id'], second['id'])
+        self.assertFalse(os.path.exists(attachments.temp_path(second['id'])))
+
+    def test_failed_completion_can_be_retried(self):
+        upload_id = self.start(4)
+        self.send(upload_id, 0, b'data')
+        with mock.patch.object(AttachmentUpload, 'save', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                attachments.complete_upload(upload_id, self.user)
+        # تراجعت المعاملة، فيبقى الملف المؤقت ويُعاد الإكمال بنجاح
+        self.assertTrue(os.path.exists(attachments.temp_path(upload_id)))
+
+        upload = attachments.complete_upload(upload_id, self.user)
+        self.assertEqual(upload.status, AttachmentUpload.Status.COMPLETE)
+        self.assertEqual(attachments.complete_upload(upload_id, self.user).blob_id, upload.blob_id)
+        self.assertFalse(os.path.exists(attachments.temp_path(upload_id)))
+
+
+class MediaServingTests(TransactionTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        media = self.settings(MEDIA_ROOT=root.name, MEDIA_ACCEL_REDIRECT_PREFIX='')
+        media.enable()
+        self.addCleanup(media.disable)
+        self.body = bytes(range(256)) * 4
+        self.sha = 'ab' * 32
+        for name in ('clip.mp4', f'{self.sha}.mp4'):
+            with open(os.path.join(root.name, name), 'wb') as fh:
+                fh.write(self.body)
+
+    def get(self, name='clip.mp4', **headers):
+        response = self.client.get(f'/chat_attachments/{name}', headers=headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, content
+
+    def test_full_response_carries_validators_and_cache_headers(self):
+        response, content = self.get()
+        self.assertEqual((response.status_code, content), (200, self.body))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertIn('immutable', self.get(f'{self.sha}.mp4')[0]['Cache-Control'])
+
+        etag = response['ETag']
+        self.assertEqual(self.get(If_None_Match=etag)[0].status_code, 304)
+        self.assertEqual(self.get(If_Modified_Since=response['Last-Modified'])[0].status_code, 304)
+        self.assertEqual(self.get(If_None_Match='"other"')[0].status_code, 200)
+
+    def test_byte_ranges(self):
+        response, content = self.get(Range='bytes=10-19')
+        self.assertEqual((response.status_code, content), (206, self.body[10:20]))
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.body)}')
+        self.assertEqual(self.get(Range='bytes=-5')[1], self.body[-5:])
+        self.assertEqual(self.get(Range='bytes=1000-')[1], self.body[1000:])
+
+        response, _ = self.get(Range='bytes=5000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.body)}'))
+        # نطاقات متعددة أو صيغة غير مفهومة: يُتجاهل Range ويُرسل الملف كاملاً
+        for header in ('bytes=0-1,5-9', 'bytes=9-2', 'items=0-9'):
+            with self.subTest(range=header):
+                response, content = self.get(Range=header)
+                self.assertEqual((response.status_code, content), (200, self.body))
+        # الملف تغيّر منذ أن أخذ العميل نسخته، فيُرسل كاملاً
+        response, content = self.get(Range='bytes=0-9', If_Range='"stale"')
+        self.assertEqual((response.status_code, content), (200, self.body))
+
+    def test_paths_outside_the_root_and_unsafe_methods_are_refused(self):
+        self.assertEqual(self.get('../etc/passwd')[0].status_code, 404)
+        self.assertEqual(self.get('missing.mp4')[0].status_code, 404)
+        self.assertEqual(self.client.post('/chat_attachments/clip.mp4').status_code, 405)
+        self.assertEqual(self.client.head('/chat_attachments/clip.mp4').status_code, 200)
+
+    def test_accel_redirect_hands_the_file_to_nginx(self):
+        with self.settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected/'):
+            response, content = self.get(Range='bytes=0-9')
+        self.assertEqual((response.status_code, content), (200, b''))
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/media/clip.mp4')
+        self.assertIn('ETag', response)
+
+
+class DatabaseConnectionModeTests(TransactionTestCase):
+    def load(self, argv=('manage.py', 'celery'), **env):
+        """يقرأ backend/settings.py من جديد بمتغيرات البيئة env ويُرجع إعداد قاعدة البيانات."""
+        environ = {k: v for k, v in os.environ.items() if not k.startswith('DB_')}
+        with mock.patch.dict(os.environ, {**environ, **env}, clear=True), \
+                mock.patch.object(sys, 'argv', list(argv)):
+            spec = importlib.util.spec_from_file_location(
+                'settings_under_test', os.path.join(settings.BASE_DIR, 'backend', 'settings.py')
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        return module.DATABASES['default']
+
+    def test_default_mode_depends_on_the_server(self):
+        db = self.load()
+        self.assertEqual((db['CONN_MAX_AGE'], db['CONN_HEALTH_CHECKS']), (60, True))
+        self.assertFalse(db['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertNotIn('CONN_MAX_AGE', self.load(argv=['/usr/bin/daphne', 'backend.asgi:application']))
+        self.assertNotIn('CONN_MAX_AGE', self.load(DB_CONNECTION_MODE='none'))
+
+    def test_pgbouncer_disables_server_side_cursors(self):
+        db = self.load(DB_CONNECTION_MODE='pgbouncer', DB_CONN_MAX_AGE='30')
+        self.assertEqual((db['CONN_MAX_AGE'], db['DISABLE_SERVER_SIDE_CURSORS']), (30, True))
+
+    def test_pool_requires_psycopg_3(self):
+        with mock.patch.dict(sys.modules, {'psycopg_pool': None}):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'psycopg[pool]'):
+                self.load(DB_CONNECTION_MODE='pool')
+
+        with mock.patch.dict(sys.modules, {'psycopg_pool': types.ModuleType('psycopg_pool')}):
+            db = self.load(DB_CONNECTION_MODE='pool', DB_POOL_MAX_SIZE='20')
+        self.assertEqual(db['OPTIONS']['pool'], {'min_size': 2, 'max_size': 20, 'timeout': 10})
+        self.assertNotIn('CONN_MAX_AGE', db)
+
+
+class FCMTokenRegistrationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='fcm_owner')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_batch_registration_is_idempotent(self):
+        response = self.api.post(
+            '/api/fcm-tokens/batch/', {'tokens': ['t1', 't2', 't1'], 'device_info': {'os': 'android'}}, format='json'
+        )
+        self.assertEqual((response.status_code, response.data), (201, {'created': 2, 'updated': 0, 'unchanged': 0}))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(register_tokens(self.user, ['t1', 't2'], {'os': 'android'}), (0, 0, 2))
+        self.assertEqual(register_tokens(self.user, ['t1', 't3'], {'os': 'ios'}), (1, 1, 0))
+        self.assertEqual(FCMToken.objects.get(token='t1').device_info, {'os': 'ios'})
+
+    def test_token_moves_to_the_account_that_registers_it(self):
+        register_tokens(self.user, ['shared'])
+        other = User.objects.create(username='fcm_other')
+        self.assertEqual(register_tokens(other, ['shared']), (0, 1, 0))
+        self.assertEqual(FCMToken.objects.get(token='shared').user, other)
+        self.assertEqual(FCMToken.objects.count(), 1)
+
+    def test_old_tokens_are_touched_then_pruned(self):
+        register_tokens(self.user, ['old'])
+        FCMToken.objects.update(last_seen=timezone.now() - timedelta(days=2))
+        with self.settings(FCM_TOKEN_TOUCH_INTERVAL=60 * 60):
+            self.assertEqual(register_tokens(self.user, ['old']), (0, 1, 0))
+        self.assertGreater(FCMToken.objects.get().last_seen, timezone.now() - timedelta(minutes=1))
+
+        FCMToken.objects.update(last_seen=timezone.now() - timedelta(days=300))
+        self.assertEqual(prune_stale_tokens(), 1)
+        self.assertFalse(FCMToken.objects.exists())
+
+    def test_single_token_endpoint(self):
+        self.assertEqual(self.api.post('/api/save-fcm-token/', {'fcm_token': 'x'}, format='json').status_code, 201)
+        self.assertEqual(self.api.post('/api/save-fcm-token/', {'fcm_token': 'x'}, format='json').status_code, 200)
+        self.assertEqual(self.api.post('/api/save-fcm-token/', {}, format='json').status_code, 400)
+
+
+class FakePushServer:
+    """خادم fake_push_server داخل الاختبار: يرد بـ 503 على أول failures طلب، وبعد latency ثانية."""
+
+    def __init__(self, failures=0, latency=0):
+        self.payloads = []
+        self.failures = failures
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.payloads.append(payload)
+                threading.Event().wait(latency)
+                if server.failures:
+                    server.failures -= 1
+                    status, body = 503, {'error': 'Unavailable'}
+                else:
+                    status, body = 200, fake_push_response(payload)[1]
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        # العميل الذي انتهت مهلته يغلق الاتصال قبل الرد
+        self.httpd.handle_error = lambda request, client_address: None
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(PUSH_TIMEOUT=2, PUSH_MAX_RETRIES=2)
+class PushProviderTests(TransactionTestCase):
+    def serve(self, **options):
+        server = FakePushServer(**options)
+        self.addCleanup(server.close)
+        return server
+
+    def test_fcm_http_batches_and_reports_invalid_tokens(self):
+        server = self.serve()
+        provider = push.FCMHTTPProvider(server.url)
+        provider.max_batch = 2
+        result = provider.send(['a', 'invalid-b', 'c', 'd', 'invalid-e'], 'عنوان', 'نص', {'trip': 7, 'skip': None})
+        self.assertEqual(result, {'success': 3, 'failure': 2, 'invalid_tokens': ['invalid-b', 'invalid-e']})
+        self.assertEqual([len(p['registration_ids']) for p in server.payloads], [2, 2, 1])
+        self.assertEqual(server.payloads[0]['data'], {'trip': '7'})
+
+    def test_onesignal_reports_invalid_subscriptions(self):
+        server = self.serve()
+        result = push.OneSignalProvider(server.url).send(['s1', 'invalid-s2'], 'عنوان', 'نص')
+        self.assertEqual(result, {'success': 1, 'failure': 1, 'invalid_tokens': ['invalid-s2']})
+        self.assertEqual(server.payloads[0]['include_subscription_ids'], ['s1', 'invalid-s2'])
+
+    def test_transient_errors_are_retried_within_the_limit(self):
+        server = self.serve(failures=2)
+        self.assertEqual(push.FCMHTTPProvider(server.url).send(['a'], 't', 'b')['success'], 1)
+        self.assertEqual(len(server.payloads), 3)
+
+        server = self.serve(failures=5)
+        self.assertEqual(push.FCMHTTPProvider(server.url).send(['a', 'b'], 't', 'b')['failure'], 2)
+        self.assertEqual(len(server.payloads), 3)
+
+    def test_slow_provider_fails_the_batch_after_the_timeout(self):
+        server = self.serve(latency=1)
+        with self.settings(PUSH_TIMEOUT=0.2, PUSH_MAX_RETRIES=0):
+            provider = push.FCMHTTPProvider(server.url)
+        started = timezone.now()
+        self.assertEqual(provider.send(['a'], 't', 'b')['failure'], 1)
+        self.assertLess(timezone.now() - started, timedelta(seconds=1))
+
+    def test_rejected_tokens_are_deleted(self):
+        server = self.serve()
+        user = User.objects.create(username='push_user')
+        FCMToken.objects.bulk_create([FCMToken(user=user, token=t) for t in ('ok', 'invalid-old')])
+        with self.settings(PUSH_PROVIDER='fcm_http', FCM_HTTP_URL=server.url), \
+                mock.patch.object(push, '_providers', {}):
+            result = push.send_to_users([user.pk], 'عنوان', 'نص')
+        self.assertEqual(result['invalid_tokens'], ['invalid-old'])
+        self.assertEqual(list(FCMToken.objects.values_list('token', flat=True)), ['ok'])
+
+    def test_firebase_admin_is_imported_on_first_use_only(self):
+        # عملية جديدة حتى لا يكون firebase_admin محمّلاً من اختبار سابق
+        code = (
+            "import sys, django; django.setup(); "
+            "import apis.push, apis.firebase, apis.signals, apis.tasks; "
+            "print('firebase_admin' in sys.modules)"
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'backend.settings'},
+        )
+        self.assertEqual(result.stdout.split(), ['False'])
+
+        import firebase_admin
+
+        with mock.patch.dict(firebase_admin._apps, clear=True), \
+                mock.patch('firebase_admin.credentials.Certificate'), \
+                mock.patch('firebase_admin.initialize_app', side_effect=lambda *args: firebase_admin._apps.update(
+                    {firebase_admin._DEFAULT_APP_NAME: mock.sentinel.app}
+                )) as initialize_app, \
+                mock.patch('firebase_admin.get_app', return_value=mock.sentinel.app):
+            self.assertIs(firebase.get_app(), mock.sentinel.app)
+            self.assertIs(firebase.get_app(), mock.sentinel.app)
+        initialize_app.assert_called_once()
+
+
+@override_settings(SIDE_EFFECTS={}, PUSH_TIMEOUT=2, PUSH_MAX_RETRIES=0, ONESIGNAL_API_KEY='test-key')
+class AsyncViewTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='async_user')
+        self.other = User.objects.create(username='async_other')
+        self.chat = Chat.objects.create()
+        self.chat.participants.set([self.user, self.other])
+
+    def auth(self, user=None):
+        return {'authorization': f'Bearer {AccessToken.for_user(user or self.user)}'}
+
+    def get(self, path, data=None):
+        return self.async_client.get(path, data, headers=self.auth())
+
+    def post(self, path, data=None, user=None):
+        return self.async_client.post(path, data, content_type='application/json', headers=self.auth(user))
+
+    async def test_token_and_method_are_checked(self):
+        self.assertEqual((await self.async_client.get('/async/chats/')).status_code, 401)
+        response = await self.async_client.get('/async/chats/', headers={'authorization': 'Bearer junk'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual((await self.post('/async/chats/')).status_code, 405)
+
+    async def test_invalid_json_is_rejected(self):
+        response = await self.post('/async/fcm-token/', '{"fcm_token": ')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'JSON غير صالح'})
+
+    async def test_save_fcm_token(self):
+        response = await self.post('/async/fcm-token/', {'fcm_token': 'async-t1'})
+        self.assertEqual((response.status_code, response.json()['created']), (201, True))
+        response = await self.post('/async/fcm-token/', {'fcm_token': 'async-t1'})
+        self.assertEqual((response.status_code, response.json()['created']), (200, False))
+        self.assertEqual((await self.post('/async/fcm-token/', {})).status_code, 400)
+        self.assertEqual(await FCMToken.objects.filter(user=self.user).acount(), 1)
+
+    async def test_chat_list_and_send_message(self):
+        response = await self.get('/async/chats/')
+        self.assertEqual([chat['id'] for chat in response.json()], [self.chat.pk])
+
+        url = f'/async/chats/{self.chat.pk}/messages/send/'
+        response = await self.post(url, {'content': ' مرحبا '})
+        self.assertEqual((response.status_code, response.json()['content']), (201, 'مرحبا'))
+        self.assertEqual((await self.post(url, {'content': ' '})).status_code, 400)
+
+        outsider = await User.objects.acreate(username='async_outsider')
+        self.assertEqual((await self.post(url, {'content': 'x'}, user=outsider)).status_code, 403)
+        self.assertEqual(await Message.objects.filter(chat=self.chat).acount(), 1)
+
+    async def test_notification_list_and_mark_read(self):
+        notifications = [
+            await Notification.objects.acreate(user=self.user, title=f'n{i}', message='-') for i in range(3)
+        ]
+        await Notification.objects.acreate(user=self.other, title='other', message='-')
+
+        response = await self.get('/async/notifications/')
+        self.assertEqual([n['title'] for n in response.json()], ['n2', 'n1', 'n0'])
+        response = await self.get('/async/notifications/', {'before_id': notifications[2].pk})
+        self.assertEqual([n['title'] for n in response.json()], ['n1', 'n0'])
+
+        read_url = '/async/notifications/read/'
+        self.assertEqual((await self.post(read_url, {'ids': 'all'})).status_code, 400)
+        self.assertEqual((await self.post(read_url, {'ids': [notifications[0].pk]})).json(), {'updated': 1})
+        response = await self.get('/async/notifications/', {'unread': '1'})
+        self.assertEqual([n['title'] for n in response.json()], ['n2', 'n1'])
+        self.assertEqual((await self.post(read_url, {})).json(), {'updated': 2})
+
+    async def test_broadcast_is_admin_only(self):
+        server = FakePushServer()
+        self.addCleanup(server.close)
+        url, payload = '/async/notifications/broadcast/', {'title': 'عنوان', 'message': 'نص', 'segments': ['Drivers']}
+        self.assertEqual((await self.post(url, payload)).status_code, 403)
+
+        await User.objects.filter(pk=self.user.pk).aupdate(is_staff=True)
+        with mock.patch.object(push, '_providers', {'onesignal': push.OneSignalProvider(server.url)}):
+            self.assertEqual((await self.post(url, {'title': 'عنوان'})).status_code, 400)
+            response = await self.post(url, payload)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('id', response.json())
+            self.assertEqual(server.payloads[0]['included_segments'], ['Drivers'])
+
+            server.failures = 1
+            self.assertEqual((await self.post(url, payload)).status_code, 502)
+
+
+@override_settings(SIDE_EFFECTS={}, TRIP_SCHEDULER_MIN_WAIT=1, TRIP_SCHEDULER_MAX_WAIT=2)
+class SchedulerTriggerTests(SchedulerRequestsMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.delete(scheduling.PENDING_KEY)
+        self.addCleanup(cache.delete, scheduling.PENDING_KEY)
+
+    @override_settings(TRIP_SCHEDULER_TRIGGER='celery')
+    def test_celery_trigger_keeps_one_pending_round(self):
+        with mock.patch('apis.tasks.run_trip_scheduler.apply_async') as apply_async:
+            with transaction.atomic():
+                self.booking()
+                apply_async.assert_not_called()
+            self.delivery()
+            apply_async.assert_called_once_with(countdown=1)
+
+            scheduling.clear_pending()
+            self.booking()
+            self.assertEqual(apply_async.call_count, 2)
+
+    @override_settings(TRIP_SCHEDULER_TRIGGER='celery')
+    def test_broker_failure_does_not_block_later_rounds(self):
+        with mock.patch('apis.tasks.run_trip_scheduler.apply_async', side_effect=OSError('broker down')) as apply_async:
+            self.booking()
+            self.booking()
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertIsNone(cache.get(scheduling.PENDING_KEY))
+
+    @override_settings(TRIP_SCHEDULER_TRIGGER='listen')
+    def test_listener_wakes_only_for_committed_requests(self):
+        listener = scheduling.Listener()
+        self.addCleanup(listener.close)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.booking()
+            raise RuntimeError
+        self.assertEqual(listener.wait(0.2), 0)
+
+        self.booking()
+        self.delivery()
+        started = timezone.now()
+        self.assertTrue(listener.wait_for_batch(1))
+        # الإشعاران وصلا معاً، فتنتهي الدفعة بعد هدوء MIN_WAIT
+        self.assertLess(timezone.now() - started, timedelta(seconds=2))
+        self.assertFalse(listener.wait_for_batch(0.1))
+
+    def test_round_lock_is_exclusive(self):
+        held = []
+
+        def _try_round(i):
+            with scheduling.round_lock() as acquired:
+                held.append(acquired)
+
+        with scheduling.round_lock() as acquired:
+            self.assertTrue(acquired)
+            run_in_threads(1, _try_round)
+        self.assertEqual(held, [False])
+        with scheduling.round_lock() as acquired:
+            self.assertTrue(acquired)
+
+
+@override_settings(SIDE_EFFECTS={}, TRIP_SCHEDULER_TRIGGER='', TRIP_SCHEDULER_AGING_SECONDS=15 * 60)
+class RequestBatchLoaderTests(SchedulerRequestsMixin, TransactionTestCase):
+    def load(self, mode, queryset=None, kind=BOOKING, limit=10):
+        queryset = queryset if queryset is not None else CasheBooking.objects.all()
+        with self.settings(TRIP_SCHEDULER_FETCH=mode):
+            return fetch(_ordered(queryset, timezone.now()), kind, limit)
+
+    def test_copy_decoder_matches_values_rows(self):
+        pks = [self.booking(minutes=5 - i) for i in range(3)]
+        CasheBooking.objects.filter(pk=pks[1]).update(to_location=' -21.5 , +39.25 ')
+        invalid = self.booking(from_location='24.71;46.67')
+
+        values, copied = self.load('values'), self.load('copy')
+        self.assertEqual(copied.dtype, values.dtype)
+        np.testing.assert_array_equal(copied['id'], values['id'])
+        for name in ('from_lat', 'to_lat', 'to_lon', 'load', 'created'):
+            np.testing.assert_allclose(copied[name], values[name], equal_nan=True)
+        # الأقدم أولاً، والإحداثيات غير الصالحة NaN
+        self.assertEqual(values['id'].tolist(), pks + [invalid])
+        row = dict(zip(values['id'].tolist(), values))
+        self.assertEqual((row[pks[1]]['to_lat'], row[pks[1]]['to_lon']), (-21.5, 39.25))
+        self.assertTrue(np.isnan(row[invalid]['from_lat']))
+        self.assertEqual(row[pks[0]]['load'], 1.0)
+
+    def test_copy_decoder_handles_empty_and_limited_results(self):
+        self.assertEqual(len(self.load('copy')), 0)
+        for i in range(4):
+            self.delivery(minutes=i)
+        copied = self.load('copy', CasheItemDelivery.objects.all(), DELIVERY, limit=2)
+        self.assertEqual(len(copied), 2)
+        self.assertEqual(set(copied['kind'].tolist()), {DELIVERY})
+        self.assertEqual(copied['load'].tolist(), [2.5, 2.5])
+
+    def test_copy_layout_is_the_postgres_binary_row_format(self):
+        # صف واحد مبني يدوياً بصيغة COPY الثنائية: عدد الأعمدة ثم (الطول، القيمة) لكل عمود
+        values = (7, BOOKING, 24.5, 46.5, 21.5, 39.5, 3.0, 1700000000.0, 1)
+        row = struct.pack('>h', 9) + b''.join(
+            struct.pack('>i', 8 if fmt in 'qd' else 4) + struct.pack('>' + fmt, value)
+            for fmt, value in zip('qiddddddi', values)
+        )
+        decoded = np.frombuffer(row, dtype=COPY_DTYPE)
+        self.assertEqual(COPY_DTYPE.itemsize, len(row))
+        self.assertEqual(tuple(decoded[0][['id', 'kind', 'from_lat', 'load', 'priority']].tolist()), (7, 0, 24.5, 3.0, 1))
+
+    def test_instances_keep_order_and_skip_assigned_requests(self):
+        first, second = self.booking(minutes=3), self.booking(minutes=2)
+        third = self.delivery(minutes=1)
+        batch = load_queue(10)[0]
+        CasheBooking.objects.filter(pk=second).update(status=CasheBooking.Status.FAILED)
+        self.assertEqual([obj.pk for obj in batch.instances(range(len(batch)))], [first, third])
+        self.assertTrue(batch.valid.all())
+
+
+@override_settings(
+    SIDE_EFFECTS={}, TRIP_SCHEDULER_TRIGGER='', STALE_BOOKING_GRACE_MINUTES=30, STALE_DELIVERY_HOURS=24,
+    STALE_SWEEP_CHUNK=2,
+)
+class StaleRequestSweepTests(SchedulerRequestsMixin, TransactionTestCase):
+    def departed(self, minutes):
+        pk = self.booking()
+        CasheBooking.objects.filter(pk=pk).update(departure_time=timezone.now() - timedelta(minutes=minutes))
+        return pk
+
+    def test_expired_requests_are_closed_and_owners_notified_per_chunk(self):
+        expired = [self.departed(45) for _ in range(3)]
+        within_grace = self.departed(10)
+        old_delivery = self.age(CasheItemDelivery, self.delivery(), 25 * 60)
+        fresh_delivery = self.delivery(minutes=60)
+
+        with mock.patch('apis.stale_requests.dispatch') as dispatch:
+            self.assertEqual(sweep_stale_requests(), (3, 1))
+        # دفعتان من الحجوزات (2 + 1) ودفعة شحنات، ولكل دفعة إرسال واحد
+        self.assertEqual(dispatch.call_count, 3)
+        self.assertEqual(dispatch.call_args_list[0].args[:2], ('push_to_users', [self.customer.user_id]))
+
+        statuses = dict(CasheBooking.objects.values_list('pk', 'status'))
+        self.assertEqual({statuses[pk] for pk in expired}, {CasheBooking.Status.FAILED})
+        self.assertEqual(statuses[within_grace], CasheBooking.Status.PENDING)
+        self.assertEqual(CasheItemDelivery.objects.get(pk=old_delivery).status, CasheItemDelivery.Status.CANCELLED)
+        self.assertEqual(CasheItemDelivery.objects.get(pk=fresh_delivery).status, CasheItemDelivery.Status.PENDING)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('notification_type', 'related_object_id')),
+            sorted([('booking', pk) for pk in expired] + [('delivery', old_delivery)]),
+        )
+        self.assertEqual(sweep_stale_requests(), (0, 0))
+
+    def test_rows_locked_by_a_scheduler_round_are_skipped(self):
+        locked, free = self.departed(45), self.departed(45)
+        holding, release = threading.Event(), threading.Event()
+
+        def _round(i):
+            with transaction.atomic():
+                list(CasheBooking.objects.select_for_update().filter(pk=locked))
+                holding.set()
+                release.wait(10)
+
+        worker = threading.Thread(target=run_in_threads, args=(1, _round))
+        worker.start()
+        holding.wait(10)
+        try:
+            with mock.patch('apis.stale_requests.dispatch'):
+                self.assertEqual(sweep_stale_requests(), (1, 0))
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(CasheBooking.objects.get(pk=free).status, CasheBooking.Status.FAILED)
+        self.assertEqual(CasheBooking.objects.get(pk=locked).status, CasheBooking.Status.PENDING)
@@ -0,0 +1,63 @@
+# File: apis/trip_search.py
+"""
+البحث عن رحلات مفتوحة قريبة من نقطتي الركوب والوصول.
+
+الاستعلام يضيّق المرشحين بفهرس بادئات geohash لنقطة الانطلاق (وبادئات الوصول على نفس الصفوف)،
+ثم تُحسب المسافة الفعلية بـ haversine للمرشحين فقط، فلا يمر البحث على كل الرحلات مهما كثرت.
+"""
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .driver_selector import haversine_distance
+from .geohash import covering_cells
+from .models import Trip
+
+DEFAULT_WINDOW = timedelta(hours=24)
+MAX_RESULTS = 50
+
+
+def _prefix_filter(field, cells):
+    return reduce(or_, (Q(**{f'{field}__startswith': cell}) for cell in cells))
+
+
+def _candidates(from_lat, from_lon, to_lat, to_lon, radius, seats):
+    return Trip.objects.filter(
+        _prefix_filter('from_geohash', covering_cells(from_lat, from_lon, radius)),
+        _prefix_filter('to_geohash', covering_cells(to_lat, to_lon, radius)),
+        status__in=[Trip.Status.PENDING, Trip.Status.IN_PROGRESS],
+        available_seats__gte=seats,
+    ).order_by()
+
+
+def _rank(candidates, from_lat, from_lon, to_lat, to_lon, radius):
+    results = []
+    for trip in candidates:
+        pickup = haversine_distance(from_lat, from_lon, trip.from_lat, trip.from_lon)
+        dropoff = haversine_distance(to_lat, to_lon, trip.to_lat, trip.to_lon)
+        if pickup <= radius and dropoff <= radius:
+            results.append((trip, pickup, dropoff))
+    results.sort(key=lambda item: item[1] + item[2])
+    return results
+
+
+def nearby_trips(from_lat, from_lon, to_lat, to_lon, radius=3, seats=1, start=None, end=None):
+    """
+    يُرجع [(trip, pickup_km, dropoff_km)] للرحلات التي تبعد نقطة انطلاقها ووصولها عن
+    النقطتين المطلوبتين أقل من radius كم، مرتبة حسب pickup_km + dropoff_km.
+    """
+    start = start or timezone.now()
+    end = end or start + DEFAULT_WINDOW
+    candidates = _candidates(from_lat, from_lon, to_lat, to_lon, radius, seats).filter(
+        departure_time__range=(start, end)
+    )
+    return _rank(candidates, from_lat, from_lon, to_lat, to_lon, radius)[:MAX_RESULTS]
+
+
+def closest_open_trip(from_lat, from_lon, to_lat, to_lon, radius=3, seats=1):
+    """أقرب رحلة مفتوحة (قيد الانتظار أو التنفيذ) دون قيد على وقت المغادرة، أو None."""
+    results = _rank(_candidates(from_lat, from_lon, to_lat, to_lon, radius, seats), from_lat, from_lon, to_lat, to_lon, radius)
+    return results[0][0] if results else None
@@ -2,6 +2,7 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import *  # Import all views
 from .views import SupportTicketViewSet  # Explicitly import SupportTicketViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'wallets', WalletViewSet, basename='wallet')
@@ -28,4 +29,14 @@ urlpatterns = [
     path('', include(router.urls)),
     path('chats/', ChatListAPIView.as_view(), name='chat-list'),
     path('messages/', MessageListAPIView.as_view(), name='message-list'),
+    # واجهات غير متزامنة تُخدم عبر ASGI (انظر apis/async_views.py)
+    path('async/fcm-token/', async_views.save_fcm_token, name='async-fcm-token'),
+    path('async/chats/', async_views.chat_list, name='async-chat-list'),
+    path('async/chats/<int:chat_id>/messages/send/', async_views.send_message, name='async-message-send'),
+    path('async/notifications/', async_views.notification_list, name='async-notification-list'),
+    path('async/notifications/read/', async_views.notification_mark_read, name='async-notification-read'),
+    path('async/notifications/broadcast/', async_views.notification_broadcast, name='async-notification-broadcast'),
+    path('attachments/uploads/', AttachmentUploadView.as_view(), name='attachment-upload'),
+    path('attachments/uploads/<uuid:upload_id>/', AttachmentUploadDetailView.as_view(), name='attachment-upload-detail'),
+    path('attachments/uploads/<uuid:upload_id>/complete/', AttachmentUploadCompleteView.as_view(), name='attachment-upload-complete'),
 ]
\ No newline at end of file
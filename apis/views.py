@@ -1,5 +1,5 @@
-from .models import Client , Chat, Message, FCMToken, Wallet, Transaction, Vehicle, Driver, Trip, Booking, Rating, SupportTicket, Notification, Transfer, SubscriptionPlan, Subscription, Bonus, TripStop, ItemDelivery, CasheBooking, CasheItemDelivery
-from .serializers import ChatSerializer, MessageSerializer, UserSerializer, ClientSerializer, WalletSerializer, TransactionSerializer, VehicleSerializer, DriverSerializer, TripSerializer, BookingSerializer, RatingSerializer, SupportTicketSerializer, NotificationSerializer, TransferSerializer, SubscriptionPlanSerializer, SubscriptionSerializer, BonusSerializer, TripStopSerializer, ItemDeliverySerializer, CasheBookingSerializer, CasheItemDeliverySerializer
+from .models import AttachmentUpload, Client , Chat, Message, FCMToken, Wallet, Transaction, Vehicle, Driver, Trip, Booking, Rating, SupportTicket, Notification, Transfer, SubscriptionPlan, Subscription, Bonus, TripStop, ItemDelivery, CasheBooking, CasheItemDelivery
+from .serializers import AttachmentUploadSerializer, BulkCreditSerializer, DriverLocationSerializer, FCMTokenBatchSerializer, NearbyTripsQuerySerializer, ChatSerializer, MessageSerializer, UserSerializer, ClientSerializer, WalletSerializer, TransactionSerializer, VehicleSerializer, DriverSerializer, TripSerializer, BookingSerializer, RatingSerializer, SupportTicketSerializer, NotificationSerializer, TransferSerializer, SubscriptionPlanSerializer, SubscriptionSerializer, BonusSerializer, TripStopSerializer, ItemDeliverySerializer, CasheBookingSerializer, CasheItemDeliverySerializer
 from rest_framework import viewsets, permissions, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -7,9 +7,16 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from django.db.models import Q, Count, Prefetch
 from django.contrib.auth import get_user_model
+import io
 import logging
 from django.utils.translation import gettext_lazy as _
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from . import ledger
+from .payouts import award_bonuses, read_credit_csv
+from .chats import chats_for_user, get_or_create_direct_chat, mark_read
+from .pagination import MessageKeysetPagination
+from . import attachments, locations, trip_search
+from .fcm_tokens import register_tokens
 
 User = get_user_model()
 
@@ -82,6 +89,20 @@ class DriverViewSet(viewsets.ModelViewSet):
         # يمنع تغيير المستخدم عند التحديث
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'], url_path='location')
+    def location(self, request):
+        """
+        استقبال دفعة نقاط GPS من تطبيق السائق: {"points": [{"lat", "lon", "ts"}, ...]}
+        يُحفظ أحدثها في مخزن المواقع دون كتابة صف السائق في كل طلب.
+        """
+        driver_id = Driver.objects.filter(user=request.user).values_list('pk', flat=True).first()
+        if driver_id is None:
+            raise PermissionDenied(_("هذا الحساب ليس حساب سائق."))
+        serializer = DriverLocationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        latest = locations.record_points(driver_id, serializer.validated_data['points'])
+        return Response({'accepted': latest is not None}, status=status.HTTP_202_ACCEPTED)
+
 class TripViewSet(viewsets.ModelViewSet):
     serializer_class = TripSerializer
 
@@ -98,6 +119,24 @@ class TripViewSet(viewsets.ModelViewSet):
             ).distinct()
         return queryset
 
+    @action(detail=False, methods=['get'], url_path='nearby', permission_classes=[IsAuthenticated])
+    def nearby(self, request):
+        """
+        الرحلات المفتوحة التي تنطلق قرب نقطة الركوب وتصل قرب الوجهة خلال نافذة زمنية،
+        مرتبة حسب مجموع بعد الركوب والنزول عن مسار الرحلة:
+        ?from_lat=&from_lon=&to_lat=&to_lon=&radius=3&seats=1&start=&end=
+        """
+        query = NearbyTripsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        results = trip_search.nearby_trips(**query.validated_data)
+        data = []
+        for trip, pickup_km, dropoff_km in results:
+            item = TripSerializer(trip).data
+            item['pickup_distance_km'] = round(pickup_km, 2)
+            item['dropoff_distance_km'] = round(dropoff_km, 2)
+            data.append(item)
+        return Response(data)
+
 class BookingViewSet(viewsets.ModelViewSet):
     """
     واجهة للتعامل مع الحجوزات مع فلترة حسب المستخدم والحالة
@@ -135,6 +174,18 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def perform_create(self, serializer):
+        try:
+            serializer.save()
+        except ValueError as e:
+            raise ValidationError({'seats': str(e)})
+
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except ValueError as e:
+            raise ValidationError({'seats': str(e)})
+
 
 class RatingViewSet(viewsets.ModelViewSet):
     queryset = Rating.objects.all()
@@ -177,6 +228,42 @@ class BonusViewSet(viewsets.ModelViewSet):
     queryset = Bonus.objects.all()
     serializer_class = BonusSerializer
 
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[permissions.IsAdminUser])
+    def bulk(self, request):
+        """
+        منح مكافآت جماعية في عملية دفتر مجمّعة واحدة.
+        body: {"reason": "promotion", "items": [{"user": 1, "amount": "10.00"}]} أو ملف CSV في الحقل file.
+        """
+        entries, data = _bulk_credit_entries(request)
+        try:
+            bonuses = award_bonuses(entries, reason=data['reason'])
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': len(bonuses)}, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-payout', permission_classes=[permissions.IsAdminUser])
+    def bulk_payout(self, request):
+        """إيداع مجمّع في المحافظ بدون إنشاء سجلات مكافأة."""
+        entries, data = _bulk_credit_entries(request)
+        try:
+            created, missing = ledger.bulk_credit(entries, description=data.get('description'))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': len(created), 'missing_wallets': missing}, status=status.HTTP_201_CREATED)
+
+
+def _bulk_credit_entries(request):
+    """يُرجع أسطر (user_id, amount) من الطلب مع البيانات المتحقق منها."""
+    serializer = BulkCreditSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    data = serializer.validated_data
+    if data.get('file'):
+        try:
+            return read_credit_csv(data['file']), data
+        except ValueError as e:
+            raise ValidationError({'file': str(e)})
+    return [(item['user'], item['amount']) for item in data['items']], data
+
 class TripStopViewSet(viewsets.ModelViewSet):
     queryset = TripStop.objects.all()
     serializer_class = TripStopSerializer
@@ -259,14 +346,8 @@ class SaveFCMTokenView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # استخدم update_or_create لتحديث السجل إذا وُجد أو إنشائه إذا لم يوجد
-        obj, created = FCMToken.objects.update_or_create(
-            token=token,
-            defaults={
-                'user': request.user,
-                'device_info': device_info,
-            }
-        )
+        # upsert واحد، ولا كتابة إذا لم يتغير شيء منذ آخر تسجيل قريب
+        created, _updated, _unchanged = register_tokens(request.user, [token], device_info)
 
         if created:
             message = _('FCM token saved successfully.')
@@ -276,17 +357,38 @@ class SaveFCMTokenView(APIView):
             response_status = status.HTTP_200_OK
 
         return Response(
-            {'message': message, 'created': created},
+            {'message': message, 'created': bool(created)},
             status=response_status
         )
 
 
+class FCMTokenBatchView(APIView):
+    """
+    تسجيل عدة توكنات FCM للجهاز في طلب واحد:
+    {"tokens": ["..."], "device_info": {...}}
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = FCMTokenBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created, updated, unchanged = register_tokens(
+            request.user,
+            serializer.validated_data['tokens'],
+            serializer.validated_data.get('device_info'),
+        )
+        return Response(
+            {'created': created, 'updated': updated, 'unchanged': unchanged},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
+
+
 class ChatListAPIView(generics.ListAPIView):
     serializer_class = ChatSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Chat.objects.filter(participants=self.request.user).order_by('-updated_at')
+        return chats_for_user(self.request.user)
 
 
 class ChatCreateOrGetAPIView(APIView):
@@ -302,18 +404,17 @@ class ChatCreateOrGetAPIView(APIView):
         except User.DoesNotExist:
             return Response({'detail': 'المستخدم غير موجود'}, status=status.HTTP_404_NOT_FOUND)
 
-        chat = Chat.objects.filter(participants=request.user).filter(participants=other_user).first()
-        if not chat:
-            chat = Chat.objects.create()
-            chat.participants.set([request.user, other_user])
+        chat, _created = get_or_create_direct_chat(request.user.pk, other_user.pk)
 
         serializer = ChatSerializer(chat)
         return Response(serializer.data)
 
 
 class MessageListAPIView(generics.ListAPIView):
+    """سجل رسائل المحادثة على نوافذ ثابتة الحجم من الأحدث إلى الأقدم (before_id / after_id / limit)."""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageKeysetPagination
 
     def get_queryset(self):
         chat_id = self.kwargs['chat_id']
@@ -321,9 +422,24 @@ class MessageListAPIView(generics.ListAPIView):
         if not chat:
             return Message.objects.none()
 
-        # وضع الرسائل كـ مقروءة
-        chat.messages.filter(is_read=False).exclude(sender=self.request.user).update(is_read=True)
-        return chat.messages.order_by('created_at')
+        # تقديم مؤشر القراءة (لا يكتب شيئاً إذا لم تصل رسائل جديدة)
+        mark_read(chat.pk, self.request.user.pk, chat.last_message_id)
+        self.chat = chat
+        return chat.messages.select_related('sender', 'blob')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        chat = getattr(self, 'chat', None)
+        if chat:
+            user_id = self.request.user.pk
+            cursors = dict(chat.read_cursors.values_list('user_id', 'last_read_message_id'))
+            peers = [last_read for uid, last_read in cursors.items() if uid != user_id]
+            context['read_cursors'] = {
+                'user_id': user_id,
+                'own': cursors.get(user_id, 0),
+                'peers': min(peers) if peers else 0,
+            }
+        return context
 
 
 class MessageCreateAPIView(APIView):
@@ -336,16 +452,86 @@ class MessageCreateAPIView(APIView):
 
         content = request.data.get('content', '').strip()
         attachment = request.FILES.get('attachment')
+        upload_id = request.data.get('upload_id')
 
-        if not content and not attachment:
+        blob = None
+        if upload_id:
+            # مرفق رُفع مسبقاً عبر attachments/uploads/
+            try:
+                blob = attachments.completed_blob(request.user, upload_id)
+            except ValueError as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not content and not attachment and not blob:
             return Response({'detail': 'أدخل محتوى أو مرفق'}, status=status.HTTP_400_BAD_REQUEST)
 
         message = Message.objects.create(
             chat=chat,
             sender=request.user,
             content=content if content else None,
-            attachment=attachment if attachment else None
+            attachment=attachment if attachment else None,
+            blob=blob
         )
 
         serializer = MessageSerializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AttachmentUploadView(APIView):
+    """بدء رفع مرفق مجزأ: {"filename": ..., "size": ...}."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        try:
+            size = int(request.data.get('size') or 0)
+            upload = attachments.start_upload(request.user, request.data.get('filename'), size)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(AttachmentUploadSerializer(upload).data, status=status.HTTP_201_CREATED)
+
+
+class AttachmentUploadDetailView(APIView):
+    """
+    GET: حالة الرفع والموضع الذي يُستأنف منه.
+    PATCH: جسم الطلب الخام هو الجزء التالي، وترويسة Upload-Offset موضعه في الملف.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, upload_id):
+        upload = AttachmentUpload.objects.filter(pk=upload_id, user=request.user).select_related('blob').first()
+        if not upload:
+            return Response({'detail': 'غير موجود'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(AttachmentUploadSerializer(upload).data, headers={'Upload-Offset': str(upload.received_bytes)})
+
+    def patch(self, request, upload_id):
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return Response({'detail': 'ترويسة Upload-Offset مطلوبة'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # نقرأ الجسم من المجرى مباشرة حتى لا يُحمَّل الجزء كاملاً في الذاكرة
+            upload = attachments.append_chunk(upload_id, request.user, offset, request.stream or io.BytesIO())
+        except AttachmentUpload.DoesNotExist:
+            return Response({'detail': 'غير موجود'}, status=status.HTTP_404_NOT_FOUND)
+        except attachments.OffsetMismatch as e:
+            return Response(
+                {'detail': str(e), 'offset': e.offset},
+                status=status.HTTP_409_CONFLICT,
+                headers={'Upload-Offset': str(e.offset)},
+            )
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(AttachmentUploadSerializer(upload).data, headers={'Upload-Offset': str(upload.received_bytes)})
+
+
+class AttachmentUploadCompleteView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, upload_id):
+        try:
+            upload = attachments.complete_upload(upload_id, request.user)
+        except AttachmentUpload.DoesNotExist:
+            return Response({'detail': 'غير موجود'}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(AttachmentUploadSerializer(upload).data)
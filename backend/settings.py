@@ -2,7 +2,9 @@ from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
 import os
+import sys
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,7 +41,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'apis',
     'rest_framework',
+    'channels',
 ]
+# daphne يثبّت مفاعل twisted عند تحميله (~0.3 ث وعشرات الميغابايت)، ولا يحتاجه إلا runserver
+# ليصبح خادم ASGI؛ الإنتاج يشغّل daphne مباشرة، و migrate و Celery لا يحتاجانه
+if 'runserver' in sys.argv[1:2]:
+    INSTALLED_APPS.insert(0, 'daphne')
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware', 
@@ -55,16 +62,127 @@ CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
-from celery.schedules import crontab
+# تشغيل المجدول عند وصول طلبات جديدة (apis/scheduling.py): 'celery' أو 'listen' أو '' للجولات الدورية فقط.
+# 'listen' يحتاج عملية `manage.py dbscan_clustering --listen` دائمة، ولا تشغّلها ملفات النشر الحالية
+TRIP_SCHEDULER_TRIGGER = os.getenv("TRIP_SCHEDULER_TRIGGER", "celery")
+# نافذة تجميع الطلبات المتقاربة في جولة واحدة بالثواني: هدوء MIN_WAIT، وبحد أقصى MAX_WAIT من أول طلب
+TRIP_SCHEDULER_MIN_WAIT = float(os.getenv("TRIP_SCHEDULER_MIN_WAIT", 2))
+TRIP_SCHEDULER_MAX_WAIT = float(os.getenv("TRIP_SCHEDULER_MAX_WAIT", 10))
+# جولة دورية لإعادة محاولة الطلبات التي لم تُعالج؛ يمكن تبعيدها (300 مثلاً) عند تشغيل المستمع
+TRIP_SCHEDULER_SWEEP_INTERVAL = int(os.getenv("TRIP_SCHEDULER_SWEEP_INTERVAL", 20))
+# أقصى عدد طلبات تعالجه جولة واحدة؛ الباقي لجولة تالية حسب الأولوية (apis/priority.py)
+TRIP_SCHEDULER_ROUND_BUDGET = int(os.getenv("TRIP_SCHEDULER_ROUND_BUDGET", 200))
+# أقصى مدة لجولة واحدة بالثواني؛ العناقيد التي لم تُعالج تبقى معلقة لجولة تالية فورية
+TRIP_SCHEDULER_ROUND_SECONDS = float(os.getenv("TRIP_SCHEDULER_ROUND_SECONDS", 30))
+# طريقة قراءة الطلبات المعلقة للجولة: 'values' (values_list) أو 'copy' (COPY الثنائي من Postgres)
+TRIP_SCHEDULER_FETCH = os.getenv("TRIP_SCHEDULER_FETCH", "values")
+# الطلب الذي حاولت جولة إسناده دون نجاح لا يُعاد تحميله قبل هذه الثواني
+TRIP_SCHEDULER_RETRY_BACKOFF = int(os.getenv("TRIP_SCHEDULER_RETRY_BACKOFF", 120))
+# الطلب الذي ينتظر أكثر من هذا (بالثواني) يُعامل كعاجل حتى لا يتأخر بلا حد
+TRIP_SCHEDULER_AGING_SECONDS = int(os.getenv("TRIP_SCHEDULER_AGING_SECONDS", 15 * 60))
+# الطلبات المعلقة المنتهية (apis/stale_requests.py): حجز فات وقت مغادرته بهذه الدقائق، وشحنة معلقة منذ هذه الساعات
+STALE_BOOKING_GRACE_MINUTES = int(os.getenv("STALE_BOOKING_GRACE_MINUTES", 30))
+STALE_DELIVERY_HOURS = int(os.getenv("STALE_DELIVERY_HOURS", 48))
+STALE_SWEEP_CHUNK = int(os.getenv("STALE_SWEEP_CHUNK", 500))
 CELERY_BEAT_SCHEDULE = {
-    'run-trip-scheduler-every-20-seconds': {
+    'run-trip-scheduler-sweep': {
         'task': 'apis.tasks.run_trip_scheduler',
-        'schedule': timedelta(seconds=20),
+        'schedule': timedelta(seconds=TRIP_SCHEDULER_SWEEP_INTERVAL),
     },
+    'reconcile-trip-seats-every-10-minutes': {
+        'task': 'apis.tasks.reconcile_trip_seats',
+        'schedule': timedelta(minutes=10),
+    },
+    'snapshot-wallet-balances-hourly': {
+        'task': 'apis.tasks.snapshot_wallet_balances',
+        'schedule': timedelta(hours=1),
+    },
+    'purge-stale-attachment-uploads-daily': {
+        'task': 'apis.tasks.purge_stale_attachment_uploads',
+        'schedule': timedelta(days=1),
+    },
+    'prune-stale-fcm-tokens-daily': {
+        'task': 'apis.tasks.prune_stale_fcm_tokens',
+        'schedule': timedelta(days=1),
+    },
+    'flush-driver-locations-every-minute': {
+        'task': 'apis.tasks.flush_driver_locations',
+        'schedule': timedelta(minutes=1),
+    },
+    'sweep-stale-trip-requests-every-10-minutes': {
+        'task': 'apis.tasks.sweep_stale_trip_requests',
+        'schedule': timedelta(minutes=10),
+    },
+    'reconcile-driver-availability-every-minute': {
+        'task': 'apis.tasks.reconcile_driver_availability',
+        'schedule': timedelta(minutes=1),
+    },
+}
+# وضع دفتر المحافظ: 'inplace' (افتراضي) أو 'journal' حيث تصبح العمليات سجلاً للإضافة فقط
+WALLET_LEDGER_MODE = os.getenv("WALLET_LEDGER_MODE", "inplace")
+# طريقة تنفيذ الآثار الجانبية للإشارات: sync | on_commit | thread | celery (انظر apis/side_effects.py)
+SIDE_EFFECTS_DEFAULT = 'sync'
+SIDE_EFFECTS = {
+    'push_notification': os.getenv("SIDE_EFFECTS_BACKEND", "thread"),
+    'mark_driver_busy': 'on_commit',
+    'broadcast_message': 'on_commit',
+    'broadcast_notification': 'on_commit',
+    'broadcast_trip': 'on_commit',
+    'generate_attachment_thumbnail': os.getenv("SIDE_EFFECTS_BACKEND", "thread"),
+    'flush_driver_locations': os.getenv("SIDE_EFFECTS_BACKEND", "thread"),
+    'push_to_users': os.getenv("SIDE_EFFECTS_BACKEND", "thread"),
+    'release_driver': 'on_commit',
 }
+SIDE_EFFECT_THREADS = int(os.getenv("SIDE_EFFECT_THREADS", 4))
+# مخزن آخر موقع للسائقين (apis/locations.py): Redis إذا ضُبط العنوان، وإلا ذاكرة العملية.
+# مطلوب في الإنتاج: عمال Celery (الترحيل ومطابقة نبضات DRIVER_HEARTBEAT_TIMEOUT) لا يرون ذاكرة عمليات الويب
+DRIVER_LOCATION_REDIS_URL = os.getenv("DRIVER_LOCATION_REDIS_URL", "")
+# السائق الذي آخر موقع أرسله أقدم من هذه الثواني يُعدّ غير متصل ولا تُسند إليه رحلات؛ من لم يرسل موقعاً قط
+# لا يتأثر (0 للتعطيل، انظر apis/availability.py)
+DRIVER_HEARTBEAT_TIMEOUT = int(os.getenv("DRIVER_HEARTBEAT_TIMEOUT", 5 * 60))
+# كل كم ثانية تُرحَّل المواقع المتغيرة إلى جدول السائقين
+DRIVER_LOCATION_FLUSH_INTERVAL = int(os.getenv("DRIVER_LOCATION_FLUSH_INTERVAL", 30))
+# مزود الإشعارات الفورية للأجهزة: fcm_admin أو fcm_http أو onesignal (انظر apis/push.py)
+PUSH_PROVIDER = os.getenv("PUSH_PROVIDER", "fcm_admin")
+PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", 5))
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", 2))
+PUSH_POOL_SIZE = int(os.getenv("PUSH_POOL_SIZE", 10))
+FCM_SERVER_KEY = os.getenv("FCM_SERVER_KEY", "")
+FCM_HTTP_URL = os.getenv("FCM_HTTP_URL", "https://fcm.googleapis.com/fcm/send")
+ONESIGNAL_API_URL = os.getenv("ONESIGNAL_API_URL", "https://onesignal.com/api/v1/notifications")
+ONESIGNAL_APP_ID = os.getenv("ONESIGNAL_APP_ID", "69c44861-7e54-47ed-937a-497977c0c662")
+ONESIGNAL_API_KEY = os.getenv("ONESIGNAL_API_KEY", "")
+# أقل مدة بين تحديثين لـ last_seen لنفس توكن FCM؛ إعادة التسجيل خلالها دون تغيير لا تكتب شيئاً
+FCM_TOKEN_TOUCH_INTERVAL = int(os.getenv("FCM_TOKEN_TOUCH_INTERVAL", 24 * 60 * 60))
 ROOT_URLCONF = 'backend.urls'
+ASGI_APPLICATION = 'backend.asgi.application'
+# كاش مشترك بين العمليات، يحتاجه قيد "جولة جدولة معلقة واحدة" في apis/scheduling.py؛
+# بدونه يستخدم Django كاشاً في ذاكرة كل عملية فلا يمنع التكرار إلا داخل العملية نفسها
+if os.getenv("CACHE_REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("CACHE_REDIS_URL"),
+        }
+    }
+# طبقة القنوات للتحديثات الحية: Redis مطلوب خارج DEBUG، لأن طبقة الذاكرة لا تنقل البث من عمليات
+# Celery والمجدول إلى عملاء daphne؛ في التطوير تُستخدم الذاكرة مع تحذير عند الإقلاع (apis/apps.py)
+if os.getenv("CHANNEL_REDIS_URL"):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.getenv("CHANNEL_REDIS_URL")]},
+        },
+    }
+elif DEBUG or 'test' in sys.argv[1:2]:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+else:
+    raise ImproperlyConfigured("CHANNEL_REDIS_URL must be set when DEBUG is off")
 MEDIA_URL = '/chat_attachments/'  # ← الجزء الأول من المسار
 MEDIA_ROOT = os.path.join(BASE_DIR, 'chat_attachments')
+# الملفات المؤقتة للرفع المجزأ؛ خارج MEDIA_ROOT حتى لا تُخدم، وعلى نفس القرص ليُربط الملف بمساره دون نسخ
+ATTACHMENT_UPLOAD_DIR = os.getenv("ATTACHMENT_UPLOAD_DIR", os.path.join(BASE_DIR, 'attachment_uploads'))
+ATTACHMENT_MAX_SIZE = int(os.getenv("ATTACHMENT_MAX_SIZE", 100 * 1024 * 1024))
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -93,6 +211,33 @@ DATABASES = {
     }
 }
 
+# طريقة إدارة اتصالات قاعدة البيانات (DB_CONNECTION_MODE):
+#   none        اتصال جديد لكل طلب (السلوك القديم، والافتراضي تحت خادم ASGI)
+#   persistent  إعادة استخدام الاتصال لكل عامل مع فحص صلاحيته قبل الطلب (الافتراضي لـ Celery و manage.py)
+#   pool        مجمّع psycopg 3 المدمج في Django 5.1؛ يتطلب تثبيت psycopg[pool] بدل psycopg2 في requirements.txt
+#   pgbouncer   اتصال دائم إلى PgBouncer بوضع transaction، دون مؤشرات من جهة الخادم
+# تحت ASGI تعمل الطلبات المتزامنة في خيوط متغيرة، فتبقى الاتصالات الدائمة مفتوحة لكل خيط
+# ولا تُغلق (تحذير Django)؛ لذلك لا تُستخدم إلا إذا طُلبت صراحة
+RUNNING_ASGI = os.path.basename(sys.argv[0]) in ("daphne", "uvicorn") or 'runserver' in sys.argv[1:2]
+DB_CONNECTION_MODE = os.getenv("DB_CONNECTION_MODE", "none" if RUNNING_ASGI else "persistent")
+if DB_CONNECTION_MODE == "pool":
+    try:
+        import psycopg_pool  # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured("DB_CONNECTION_MODE=pool requires psycopg[pool] (psycopg 3) to be installed")
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+            "timeout": int(os.getenv("DB_POOL_TIMEOUT", 10)),
+        },
+    }
+elif DB_CONNECTION_MODE in ("persistent", "pgbouncer"):
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", 60))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+    # PgBouncer بوضع transaction لا يحتفظ بالمؤشرات المسماة بين المعاملات (تستخدمها iterator())
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = DB_CONNECTION_MODE == "pgbouncer"
+
 
 AUTH_USER_MODEL = 'auth.User' 
 AUTH_PASSWORD_VALIDATORS = [
@@ -123,6 +268,15 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'static'
+# collectstatic يضيف بصمة المحتوى لأسماء الملفات، فتُخدم بـ Cache-Control طويل و immutable
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'},
+}
+# عند وضع nginx أمام التطبيق (مثلاً /_protected/): يُحوَّل الملف إلى <prefix>/media/... أو <prefix>/static/...
+# وهما موقعان internal في nginx يشيران إلى MEDIA_ROOT و STATIC_ROOT، فيرسل nginx الملف بـ sendfile؛
+# بدونه يبث daphne الملف على كتل من عملية التطبيق
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "")
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -4,14 +4,15 @@ from django.urls import path, include
 from apis.views import *
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.conf import settings
-from django.conf.urls.static import static
-from django.contrib.staticfiles.urls import staticfiles_urlpatterns
+from django.urls import re_path
+from apis.media import serve_media, serve_static
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/token/", TokenObtainPairView.as_view(), name="get_token"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="refresh"),
     path('api/save-fcm-token/', SaveFCMTokenView.as_view(), name='save-fcm-token'),
+    path('api/fcm-tokens/batch/', FCMTokenBatchView.as_view(), name='fcm-token-batch'),
     path("api-auth/", include("rest_framework.urls")),
     path('api/register/', RegisterView.as_view(), name='register'),
     path("",include('apis.urls')),
@@ -20,7 +21,9 @@ urlpatterns = [
     path('chats/<int:chat_id>/messages/', MessageListAPIView.as_view(), name='messages-list'),
     path('chats/<int:chat_id>/messages/send/', MessageCreateAPIView.as_view(), name='messages-send'),
 
-] + static ( settings.MEDIA_URL, document_root= settings.MEDIA_ROOT)
-urlpatterns += staticfiles_urlpatterns()
+    # الوسائط والملفات الثابتة مع دعم Range و ETag (انظر apis/media.py)
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
+    re_path(r'^%s(?P<path>.+)$' % settings.STATIC_URL.lstrip('/'), serve_static, name='static'),
+]
 
 